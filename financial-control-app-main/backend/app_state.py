@@ -0,0 +1,80 @@
+"""
+Immutable snapshot of the state the endpoints serve.
+
+AppState bundles everything a P&L depends on: the transaction frame, the
+mapping list, the overrides and the versions identifying them. A state is
+never modified: writers build a new one and swap the single reference held by
+StateHolder (read-copy-update), one writer at a time. A request takes that
+reference once and computes against it, so it never sees a half-applied
+upload or edit, and reading takes no lock.
+
+The frame, tuples and dicts of a state are shared with the states derived
+from it and must be treated as read-only; the with_* methods copy what they
+change.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from logic import get_initial_mappings
+from models import MappingItem
+
+Overrides = Dict[str, Dict[str, float]]  # {"line_num": {"month": value}}
+
+
+class AppState(NamedTuple):
+    df: Optional[pd.DataFrame]
+    mappings: Tuple[MappingItem, ...]
+    overrides: Overrides
+    data_version: int = 0      # Bumped every time df is replaced
+    snapshot_version: int = 0  # Published snapshot df was loaded from
+    segments: Tuple[Any, ...] = ()  # store.Segment of the snapshot that df holds
+
+    @classmethod
+    def initial(cls) -> 'AppState':
+        return cls(None, tuple(get_initial_mappings()), {})
+
+    def with_frame(self, df: Optional[pd.DataFrame], snapshot_version: int, segments: Iterable[Any] = ()) -> 'AppState':
+        return self._replace(df=df, data_version=self.data_version + 1, snapshot_version=snapshot_version,
+                             segments=tuple(segments))
+
+    def with_mappings(self, mappings: Iterable[MappingItem]) -> 'AppState':
+        return self._replace(mappings=tuple(mappings))
+
+    def with_override(self, line: str, month: str, value: float) -> 'AppState':
+        overrides = dict(self.overrides)
+        overrides[line] = {**overrides.get(line, {}), month: value}
+        return self._replace(overrides=overrides)
+
+    def apply(self, change: Dict[str, Any]) -> 'AppState':
+        """State after one journaled edit."""
+        op = change["op"]
+        if op == "override":
+            return self.with_override(change["line"], change["month"], change["value"])
+        if op == "clear_overrides":
+            return self._replace(overrides={})
+        if op == "set_mappings":
+            return self.with_mappings(MappingItem(**m) for m in change["mappings"])
+        if op == "reset_mappings":
+            return self.with_mappings(get_initial_mappings())
+        return self
+
+
+class StateHolder:
+    """The current AppState: lock-free reads, serialized read-copy-update writes."""
+
+    def __init__(self, state: AppState):
+        self._state = state
+        self._write_lock = threading.RLock()
+
+    def get(self) -> AppState:
+        # Reading one attribute is atomic: always a complete state
+        return self._state
+
+    def update(self, change: Callable[[AppState], AppState]) -> AppState:
+        """Swap in change(current state); returns the new state."""
+        with self._write_lock:
+            self._state = change(self._state)
+            return self._state
@@ -0,0 +1,237 @@
+"""
+Benchmarks for the upload (process_upload) path.
+Run with: python3 backend/benchmark_ingest.py [rows]
+"""
+import glob
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmark_pnl import bench, make_synthetic_frame
+from ingest import converter_valor_br, parse_currency_column, parse_date_column, parse_date_value, read_csv_upload
+from logic import (
+    PAYROLL_KEYWORDS,
+    add_match_columns,
+    normalize_text_helper,
+    process_upload,
+    process_upload_stream,
+    route_payroll_cost_center,
+)
+from schema import CATEGORICAL_COLUMNS, memory_report, split_free_text
+
+
+SAMPLE_EXTRATO = next(iter(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Extrato*.csv'))), None)
+
+
+def legacy_read_csv(file_content: bytes) -> pd.DataFrame:
+    """
+    Original encoding x separator retry loop from process_upload.
+    Kept as the reference implementation for benchmarks and differential tests.
+    """
+    df = None
+    encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
+    separators = [',', ';', '\t']
+    for encoding in encodings:
+        for sep in separators:
+            try:
+                df = pd.read_csv(io.BytesIO(file_content), encoding=encoding, sep=sep)
+                if 'Data de competência' in df.columns:
+                    break
+                df = None
+            except Exception:
+                continue
+        if df is not None:
+            break
+        for sep in separators:
+            try:
+                df = pd.read_csv(io.BytesIO(file_content), encoding=encoding, sep=sep, on_bad_lines='skip', engine='python')
+                if 'Data de competência' in df.columns:
+                    break
+                df = None
+            except Exception:
+                continue
+        if df is not None:
+            break
+    return df
+
+
+def make_extrato_bytes(rows: int, sep: str = ',', encoding: str = 'utf-8') -> bytes:
+    """Sample extrato (or a synthetic stand-in) repeated to `rows` rows."""
+    if SAMPLE_EXTRATO:
+        base = pd.read_csv(SAMPLE_EXTRATO, dtype=str)
+    else:
+        base = make_synthetic_frame(1000).astype(str)
+        base['Data de competência'] = '15/01/2025'
+    df = base.iloc[np.arange(rows) % len(base)]
+    return df.to_csv(index=False, sep=sep).encode(encoding, errors='replace')
+
+
+def legacy_enforce_wages(df: pd.DataFrame, payroll_keywords=PAYROLL_KEYWORDS) -> pd.Series:
+    """
+    Original row-wise payroll routing from process_upload.
+    Kept as the reference implementation for benchmarks and differential tests.
+    """
+    def enforce_wages_cost_center(row):
+        current_cc = str(row.get('Centro de Custo 1', '') or '').strip()
+        cc_norm = normalize_text_helper(current_cc)
+
+        # Already correctly tagged
+        if cc_norm == 'wages expenses':
+            return 'Wages Expenses'
+
+        # Build a combined text field to search for payroll hints
+        combined_text = ' '.join([
+            normalize_text_helper(row.get('Categoria 1', '')),
+            normalize_text_helper(row.get('Descrição', '')),
+            normalize_text_helper(row.get('Nome do fornecedor/cliente', ''))
+        ])
+
+        if any(keyword in combined_text for keyword in payroll_keywords):
+            return 'Wages Expenses'
+
+        return current_cc
+
+    return df.apply(enforce_wages_cost_center, axis=1)
+
+
+def make_amount_strings(rows: int, seed: int = 42) -> pd.Series:
+    """BR-formatted amounts as exported by Conta Azul ("-1.234,56")."""
+    rng = np.random.default_rng(seed)
+    amounts = np.round(rng.normal(0, 5000, rows), 2)
+    text = [f"{a:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.') for a in amounts]
+    return pd.Series(text, dtype=object)
+
+
+def bench_currency(rows: int):
+    amounts = make_amount_strings(rows)
+    # Juros/Multa/Desconto-like column: almost always "0,00"
+    fees = amounts.where(np.random.default_rng(1).random(rows) < 0.02, '0,00')
+
+    for label, col in [("Valor (R$)-like", amounts), ("Juros (R$)-like", fees)]:
+        print(f"\n== Currency parsing, {label} ({rows:,} rows) ==")
+        legacy = bench("Series.apply(converter_valor_br)", lambda: col.apply(converter_valor_br), repeat=1)
+        fast = bench("parse_currency_column", lambda: parse_currency_column(col))
+
+        same = np.array_equal(col.apply(converter_valor_br).to_numpy(), parse_currency_column(col).to_numpy())
+        print(f"speedup: {legacy / fast:.1f}x | identical results: {same}")
+
+
+def bench_dates(rows: int):
+    rng = np.random.default_rng(7)
+    days = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 900, rows), unit='D')
+    col = pd.Series(days.strftime('%d/%m/%Y'), dtype=object)
+    col[rng.random(rows) < 0.01] = None
+
+    print(f"\n== Date parsing, dd/mm/yyyy ({rows:,} rows) ==")
+    legacy = bench("Series.apply(parse_date_value)", lambda: col.apply(parse_date_value), repeat=1)
+    fast = bench("parse_date_column", lambda: parse_date_column(col))
+
+    same = col.apply(parse_date_value).equals(parse_date_column(col))
+    print(f"speedup: {legacy / fast:.1f}x | identical results: {same}")
+
+
+def bench_payroll(rows: int):
+    df = add_match_columns(make_synthetic_frame(rows))
+
+    print(f"\n== Payroll routing ({rows:,} rows) ==")
+    legacy = bench("df.apply(enforce_wages_cost_center)", lambda: legacy_enforce_wages(df), repeat=1)
+    fast = bench("route_payroll_cost_center", lambda: route_payroll_cost_center(df))
+
+    same = legacy_enforce_wages(df).tolist() == route_payroll_cost_center(df).tolist()
+    print(f"speedup: {legacy / fast:.1f}x | identical results: {same}")
+
+
+def bench_csv_read(rows: int):
+    cases = [("sample extrato", open(SAMPLE_EXTRATO, 'rb').read())] if SAMPLE_EXTRATO else []
+    cases += [
+        (f"{rows:,} rows, utf-8 ','", make_extrato_bytes(rows)),
+        (f"{rows:,} rows, latin-1 ';'", make_extrato_bytes(rows, sep=';', encoding='latin-1')),
+        # One malformed line near the end makes every strict attempt fail late
+        (f"{rows:,} rows, ';' with a malformed line", make_extrato_bytes(rows, sep=';') + b'x;y\n' * 1 + b'1;2;3;' * 40 + b'\n'),
+    ]
+    for label, content in cases:
+        print(f"\n== CSV reading, {label} ==")
+        legacy = bench("encoding x separator retry loop", lambda: legacy_read_csv(content), repeat=1)
+        fast = bench("read_csv_upload (sniff + one parse)", lambda: read_csv_upload(content))
+
+        df, dialect = read_csv_upload(content)
+        same = legacy_read_csv(content).equals(df)
+        print(f"speedup: {legacy / fast:.1f}x | identical frames: {same} | {dialect}")
+
+
+def _upload_peak_rss(path: str, streaming: bool, queue):
+    """Child process: run one upload path and report its peak RSS (MB)."""
+    if streaming:
+        with open(path, 'rb') as f:
+            rows = len(process_upload_stream(f))
+    else:
+        # Old /upload: whole request body in memory, then process_upload
+        with open(path, 'rb') as f:
+            rows = len(process_upload(f.read()))
+    queue.put((rows, _peak_rss_mb()))
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM starts over at exec; ru_maxrss would inherit the parent's peak
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_streaming_memory(rows: int):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+        f.write(make_extrato_bytes(rows))
+        path = f.name
+    try:
+        print(f"\n== Upload peak memory ({rows:,} rows, {os.path.getsize(path) / 2**20:.0f} MB CSV) ==")
+        for label, streaming in [("file.read() + process_upload", False), ("process_upload_stream", True)]:
+            queue = ctx.Queue()
+            child = ctx.Process(target=_upload_peak_rss, args=(path, streaming, queue))
+            child.start()
+            n, peak = queue.get()
+            child.join()
+            print(f"{label:<45} {peak:>10.0f} MB peak RSS ({n:,} rows)")
+    finally:
+        os.remove(path)
+
+
+def bench_schema_memory(rows: int):
+    cases = [("sample extrato", open(SAMPLE_EXTRATO, 'rb').read())] if SAMPLE_EXTRATO else []
+    cases.append((f"{rows:,} synthetic rows", make_extrato_bytes(rows)))
+    for label, content in cases:
+        compact, _ = split_free_text(process_upload(content))
+        # Frame as kept before the compact schema: plain text columns, Period
+        # months and the free text in memory
+        legacy = process_upload(content)
+        for col in CATEGORICAL_COLUMNS:
+            if col in legacy.columns:
+                legacy[col] = legacy[col].astype(str)
+        legacy['Mes_Competencia'] = legacy['Data de competência'].dt.to_period('M')
+
+        before, after = memory_report(legacy), memory_report(compact)
+        print(f"\n== current_df memory, {label} ==")
+        print(f"before: {before}")
+        print(f"after:  {after}")
+        print(f"reduction: {before['total_mb'] / after['total_mb']:.1f}x")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    bench_currency(rows)
+    bench_dates(rows)
+    bench_payroll(rows)
+    bench_csv_read(rows)
+    bench_streaming_memory(rows * 5)
+    bench_schema_memory(rows * 10)
@@ -0,0 +1,203 @@
+"""
+Benchmarks for the P&L hot path.
+Run with: python3 backend/benchmark_pnl.py [rows]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from classifier import MappingClassifier, UNMAPPED
+from logic import (
+    PnLCube,
+    add_match_columns,
+    aggregate_line_months,
+    calculate_pnl,
+    compute_derived_lines,
+    get_initial_mappings,
+    month_codes_for,
+    normalize_text_helper,
+    prepare_mappings,
+)
+
+
+def legacy_classify(df: pd.DataFrame, mappings) -> np.ndarray:
+    """
+    Original row-by-row classification loop from calculate_pnl.
+    Kept as the reference implementation for benchmarks and differential tests.
+    Returns the matched mapping index per row (UNMAPPED when none).
+    """
+    specific_mappings, generic_mappings = prepare_mappings(mappings)
+    position = {id(m): i for i, m in enumerate(mappings)}
+    result = np.full(len(df), UNMAPPED, dtype=np.int64)
+
+    for i, (_, row) in enumerate(df.iterrows()):
+        cc = row['cc_norm']
+        match_text = row['match_text']
+        matched_mapping = None
+
+        for m in specific_mappings.get(cc, []):
+            if normalize_text_helper(m.fornecedor_cliente) in match_text:
+                matched_mapping = m
+                break
+        if not matched_mapping:
+            matched_mapping = generic_mappings.get(cc)
+
+        if not matched_mapping and 'Categoria 1' in row:
+            cat_cc = normalize_text_helper(row['Categoria 1'])
+            for m in specific_mappings.get(cat_cc, []):
+                if normalize_text_helper(m.fornecedor_cliente) in match_text:
+                    matched_mapping = m
+                    break
+            if not matched_mapping:
+                matched_mapping = generic_mappings.get(cat_cc)
+
+        if matched_mapping:
+            result[i] = position[id(matched_mapping)]
+    return result
+
+
+def make_synthetic_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Build an extrato-like frame with realistic key repetition."""
+    rng = np.random.default_rng(seed)
+    mappings = get_initial_mappings()
+    cost_centers = sorted({m.centro_custo for m in mappings}) + ['Unknown Center', '']
+    suppliers = sorted({m.fornecedor_cliente for m in mappings}) + [f'Fornecedor {i}' for i in range(200)]
+    categories = cost_centers + ['Folha de Pagamento', 'Ajuste de cotas']
+    descriptions = [f'Pagamento ref {i}' for i in range(500)] + ['Transferência | Pix', 'Rentabilidade CDI']
+
+    months = pd.period_range('2023-01', '2025-12', freq='M')
+    df = pd.DataFrame({
+        'Centro de Custo 1': rng.choice(cost_centers, rows),
+        'Nome do fornecedor/cliente': rng.choice(suppliers, rows),
+        'Descrição': rng.choice(descriptions, rows),
+        'Categoria 1': rng.choice(categories, rows),
+        'Valor_Num': np.round(rng.normal(0, 5000, rows), 2),
+        'Mes_Competencia': rng.choice(months, rows),
+    })
+    df['Data de competência'] = df['Mes_Competencia'].dt.to_timestamp()
+    return df
+
+
+def legacy_match_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Original per-row .apply(normalize_text_helper) construction of the match columns."""
+    df = df.copy()
+    df['cc_norm'] = df['Centro de Custo 1'].fillna('').apply(normalize_text_helper)
+    df['supp_norm'] = df['Nome do fornecedor/cliente'].fillna('').apply(normalize_text_helper)
+    df['desc_norm'] = df['Descrição'].fillna('').apply(normalize_text_helper)
+    df['match_text'] = (df['supp_norm'] + " " + df['desc_norm']).str.strip()
+    df['cat_norm'] = df['Categoria 1'].apply(normalize_text_helper)
+    return df
+
+
+def bench(label: str, fn, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<45} {best * 1000:>10.1f} ms")
+    return best
+
+
+def bench_classifier(rows: int):
+    print(f"\n== Mapping classification ({rows:,} rows) ==")
+    mappings = get_initial_mappings()
+    df = add_match_columns(make_synthetic_frame(rows))
+    classifier = MappingClassifier(mappings)
+
+    legacy = bench("legacy iterrows loop", lambda: legacy_classify(df, mappings), repeat=1)
+    vectorized = bench("MappingClassifier.classify_indices", lambda: classifier.classify_indices(
+        df['cc_norm'], df['match_text'], df['cat_norm']))
+
+    same = np.array_equal(
+        legacy_classify(df, mappings),
+        classifier.classify_indices(df['cc_norm'], df['match_text'], df['cat_norm']),
+    )
+    print(f"speedup: {legacy / vectorized:.1f}x | identical results: {same}")
+
+
+def legacy_aggregate(lines, months, values, month_strs):
+    """Original per-row dict accumulation into line_values[line][month]."""
+    line_values = {i: {m: 0.0 for m in month_strs} for i in range(1, 121)}
+    for line_num, month, val in zip(lines, months, values):
+        if line_num > 0 and month in line_values[line_num]:
+            line_values[line_num][month] += val
+    return line_values
+
+
+def bench_aggregation(rows: int):
+    print(f"\n== Line x month aggregation ({rows:,} rows) ==")
+    df = make_synthetic_frame(rows)
+    rng = np.random.default_rng(0)
+    lines = rng.choice([0, 25, 33, 38, 43, 56, 62, 68, 90], rows)
+    month_strs = [str(m) for m in sorted(df['Mes_Competencia'].unique())]
+    values = df['Valor_Num'].to_numpy()
+
+    legacy = bench("legacy dict accumulation", lambda: legacy_aggregate(
+        lines, df['Mes_Competencia'].astype(str).to_numpy(), values, month_strs))
+
+    def vectorized():
+        matrix = aggregate_line_months(lines, month_codes_for(df['Mes_Competencia'], month_strs), values, len(month_strs))
+        compute_derived_lines(matrix)
+
+    fast = bench("bincount matrix + derived lines", vectorized)
+    print(f"speedup: {legacy / fast:.1f}x")
+
+
+def bench_match_columns(rows: int):
+    print(f"\n== Normalized match columns ({rows:,} rows) ==")
+    df = make_synthetic_frame(rows)
+
+    legacy = bench("legacy per-row apply", lambda: legacy_match_columns(df), repeat=1)
+    fast = bench("dictionary-encoded add_match_columns", lambda: add_match_columns(df.copy()))
+
+    same = all(
+        (legacy_match_columns(df)[col].to_numpy(dtype=object) == add_match_columns(df.copy())[col].to_numpy(dtype=object)).all()
+        for col in ['cc_norm', 'supp_norm', 'desc_norm', 'match_text', 'cat_norm']
+    )
+    print(f"speedup: {legacy / fast:.1f}x | identical results: {same}")
+
+
+def bench_date_ranges(rows: int):
+    print(f"\n== P&L date ranges ({rows:,} rows) ==")
+    mappings = get_initial_mappings()
+    df = add_match_columns(make_synthetic_frame(rows))
+    whole, ragged = ('2024-01-01', '2024-12-31'), ('2024-01-15', '2024-12-10')
+
+    legacy = bench("calculate_pnl per range", lambda: calculate_pnl(df, mappings, None, *ragged))
+    cube = PnLCube(df, mappings)
+    bench("PnLCube build (once per dataset/mappings)", lambda: PnLCube(df, mappings))
+    sliced = bench("PnLCube whole-month range", lambda: cube.pnl(None, *whole))
+    ragged_time = bench("PnLCube ragged range", lambda: cube.pnl(None, *ragged))
+
+    same = calculate_pnl(df, mappings, None, *ragged) == cube.pnl(None, *ragged)
+    print(f"speedup: {legacy / sliced:.1f}x whole months, {legacy / ragged_time:.1f}x ragged | identical results: {same}")
+
+
+def bench_mapping_edit(rows: int):
+    print(f"\n== Mapping edit of one cost center ({rows:,} rows) ==")
+    mappings = get_initial_mappings()
+    df = add_match_columns(make_synthetic_frame(rows))
+    edited = [m.model_copy() for m in mappings]
+    for m in edited:
+        if m.centro_custo == "Marketing & Growth Expenses":
+            m.linha_pl = "90"
+
+    cube = PnLCube(df, mappings)
+    rebuild = bench("PnLCube build with the edited mappings", lambda: PnLCube(df, edited))
+    remap = bench("PnLCube.remap (changed cost centers only)", lambda: cube.remap(edited))
+    bench("PnLCube.preview (dry run)", lambda: cube.preview(edited))
+
+    diff = np.abs(cube.remap(edited).line_values - PnLCube(df, edited).line_values).max()
+    print(f"speedup: {rebuild / remap:.1f}x | max difference: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    bench_match_columns(rows)
+    bench_classifier(rows)
+    bench_aggregation(rows)
+    bench_date_ranges(rows)
+    bench_mapping_edit(rows)
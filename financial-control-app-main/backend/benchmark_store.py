@@ -0,0 +1,59 @@
+"""
+Benchmarks for the on-disk transaction store (cold start / lazy loads).
+Run with: python3 backend/benchmark_store.py [rows]
+"""
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmark_ingest import make_extrato_bytes
+from benchmark_pnl import bench
+from logic import calculate_pnl, get_initial_mappings, process_upload
+from schema import ANALYSIS_COLUMNS, FREE_TEXT_COLUMNS, split_free_text
+from store import read_frame, write_frame
+
+
+def pickle_load(path: Path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def bench_cold_start(rows: int):
+    df = process_upload(make_extrato_bytes(rows))
+    frame, text = split_free_text(df)
+    month = int(frame['Mes_Competencia'].max())
+    mappings = get_initial_mappings()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        # Before: the whole cleaned frame pickled into current_data.pkl
+        pickle_path = tmp / 'current_data.pkl'
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        arrow_path, text_path = tmp / 'current_data.arrow', tmp / 'current_text.arrow'
+        write_frame(arrow_path, frame)
+        write_frame(text_path, text)
+
+        print(f"\n== Cold start, {rows:,} rows ==")
+        print(f"pickle {os.path.getsize(pickle_path) / 2**20:.1f} MB | "
+              f"arrow {os.path.getsize(arrow_path) / 2**20:.1f} MB + text {os.path.getsize(text_path) / 2**20:.1f} MB")
+        legacy = bench("pickle.load(current_data.pkl)", lambda: pickle_load(pickle_path))
+        full = bench("read_frame, all columns", lambda: read_frame(arrow_path))
+        fast = bench("read_frame, ANALYSIS_COLUMNS", lambda: read_frame(arrow_path, columns=ANALYSIS_COLUMNS))
+        print(f"speedup: {legacy / fast:.1f}x (all columns: {legacy / full:.1f}x)")
+
+        print(f"\n== Drill-down free text of one month, {rows:,} rows ==")
+        bench("read_frame(text), all months", lambda: read_frame(text_path, columns=FREE_TEXT_COLUMNS))
+        bench("read_frame(text), one month", lambda: read_frame(text_path, columns=FREE_TEXT_COLUMNS, months=[month]))
+
+        stored = read_frame(arrow_path, columns=ANALYSIS_COLUMNS)
+        same = read_frame(arrow_path).sort_index().equals(frame)
+        same_pnl = calculate_pnl(stored, mappings) == calculate_pnl(frame, mappings)
+        print(f"identical frame after round trip: {same} | identical P&L: {same_pnl}")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bench_cold_start(rows)
@@ -0,0 +1,220 @@
+"""
+Vectorized mapping classifier.
+
+Compiles the mapping list into per-cost-center pattern tables and assigns a
+P&L line to every transaction of a frame at once, instead of walking the
+rows one by one.
+
+Matching semantics (same as the original row loop in calculate_pnl):
+1. Specific mappings of the row's cost center, longest supplier first,
+   matched as substrings of "supplier + description".
+2. Generic ("Diversos") mapping of the row's cost center.
+3. Same two steps using 'Categoria 1' as the cost center.
+
+A row's line therefore depends only on the rules of its cost center and of
+its 'Categoria 1' key: MappingClassifier.changed_keys tells which keys an
+edit of the mapping list affects, so only their rows need reclassifying.
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from models import MappingItem
+
+# Valid P&L source lines (line_values in calculate_pnl is indexed 1..120)
+MIN_LINE = 1
+MAX_LINE = 120
+
+UNMAPPED = -1
+
+
+def dict_encode(col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dictionary-encode a text column: (codes, uniques) with every code >= 0.
+    Missing values are encoded as "". Categorical columns reuse their codes.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.to_numpy().astype(np.int64)
+        uniques = col.cat.categories.to_numpy(dtype=object)
+    else:
+        codes, uniques = pd.factorize(col)
+        codes = codes.astype(np.int64)
+        uniques = np.asarray(uniques, dtype=object)
+    uniques = np.append(uniques, "")
+    codes[codes < 0] = len(uniques) - 1
+    return codes, uniques
+
+
+def encode_combination_codes(columns: List[pd.Series]) -> Tuple[np.ndarray, List[Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Factorize the row-wise combinations of several text columns.
+    Returns (key_codes, per_column): key_codes[i] indexes the unique
+    combination of row i and per_column[j] is (codes, uniques), the value of
+    column j in combination k being uniques[codes[k]].
+    """
+    encoded = [dict_encode(col) for col in columns]
+
+    # Combined key over the per-column codes -> unique key combinations
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    for codes, uniques in encoded:
+        combined = combined * len(uniques) + codes
+    key_codes, key_uniques = pd.factorize(combined)
+
+    # Split each unique combination back into its per-column codes
+    per_column = []
+    rest = key_uniques
+    for codes, uniques in reversed(encoded):
+        per_column.append((rest % len(uniques), uniques))
+        rest = rest // len(uniques)
+    per_column.reverse()
+    return key_codes, per_column
+
+
+def encode_combinations(columns: List[pd.Series]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Factorize the row-wise combinations of several text columns.
+    Returns (key_codes, per_column_uniques): key_codes[i] indexes the unique
+    combination of row i and per_column_uniques[j][k] is the value of column j
+    in combination k.
+    """
+    key_codes, per_column = encode_combination_codes(columns)
+    return key_codes, [uniques[codes] for codes, uniques in per_column]
+
+
+def _line_number(mapping: MappingItem) -> int:
+    """Return the mapping's P&L line, or 0 when it can't be accumulated."""
+    try:
+        line = int(mapping.linha_pl)
+    except (TypeError, ValueError):
+        return 0
+    return line if MIN_LINE <= line <= MAX_LINE else 0
+
+
+class MappingClassifier:
+    """
+    Compiled form of a mapping list.
+
+    Classification runs over the unique (cost center, match text, category)
+    combinations of the frame and the results are broadcast back through the
+    factorized codes, so the cost is driven by distinct keys, not row count.
+    """
+
+    def __init__(self, mappings: List[MappingItem]):
+        # Local import: logic imports this module
+        from logic import normalize_text_helper, prepare_mappings
+
+        self.mappings = list(mappings)
+        position = {id(m): i for i, m in enumerate(self.mappings)}
+
+        specific_by_cc, generic_by_cc = prepare_mappings(self.mappings)
+
+        # cc_norm -> [(supplier_norm, mapping_index)], longest supplier first
+        self.specific: Dict[str, List[Tuple[str, int]]] = {
+            cc: [(normalize_text_helper(m.fornecedor_cliente), position[id(m)]) for m in m_list]
+            for cc, m_list in specific_by_cc.items()
+        }
+        # cc_norm -> mapping_index
+        self.generic: Dict[str, int] = {cc: position[id(m)] for cc, m in generic_by_cc.items()}
+
+        self.line_of_mapping = np.array([_line_number(m) for m in self.mappings] + [0], dtype=np.int64)
+
+    def _match(self, cc: np.ndarray, text: np.ndarray) -> np.ndarray:
+        """Match unique keys against one cost-center column. Returns mapping indices."""
+        result = np.full(len(cc), UNMAPPED, dtype=np.int64)
+        if len(cc) == 0:
+            return result
+
+        for cc_value, positions in pd.Series(cc).groupby(cc, sort=False).indices.items():
+            patterns = self.specific.get(cc_value)
+            if patterns:
+                # Longest supplier first: each pattern only scans the keys
+                # still pending in this cost center
+                pending = positions
+                for pattern, mapping_idx in patterns:
+                    hit = pd.Series(text[pending]).str.contains(pattern, regex=False).to_numpy(dtype=bool)
+                    result[pending[hit]] = mapping_idx
+                    pending = pending[~hit]
+                    if len(pending) == 0:
+                        break
+            generic_idx = self.generic.get(cc_value)
+            if generic_idx is not None:
+                group = result[positions]
+                group[group == UNMAPPED] = generic_idx
+                result[positions] = group
+        return result
+
+    def classify_indices(
+        self,
+        cc_norm: pd.Series,
+        match_text: pd.Series,
+        cat_norm: Optional[pd.Series] = None,
+    ) -> np.ndarray:
+        """
+        Return the index (into self.mappings) of the mapping matched by each
+        row, or UNMAPPED (-1).
+
+        All inputs must already be normalized with normalize_text_helper.
+        """
+        n = len(cc_norm)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+
+        columns = [cc_norm, match_text] + ([cat_norm] if cat_norm is not None else [])
+        key_codes, per_column = encode_combinations(columns)
+        return self.classify_combinations(*per_column)[key_codes]
+
+    def classify_combinations(
+        self,
+        cc: np.ndarray,
+        text: np.ndarray,
+        cat: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Mapping index (or UNMAPPED) of each (cost center, match text, category) combination."""
+        matched = self._match(cc, text)
+
+        if cat is not None:
+            fallback = matched == UNMAPPED
+            if fallback.any():
+                matched[fallback] = self._match(cat[fallback], text[fallback])
+
+        return matched
+
+    def rules(self) -> Dict[str, Tuple[Tuple[Tuple[str, int], ...], Optional[int]]]:
+        """
+        Per cost center: its specific (supplier, line) rules in match order
+        and the line of its generic rule (None: no generic rule).
+        """
+        rules = {}
+        for cc in self.specific.keys() | self.generic.keys():
+            specific = tuple((pattern, int(self.line_of_mapping[i])) for pattern, i in self.specific.get(cc, ()))
+            generic = self.generic.get(cc)
+            rules[cc] = (specific, None if generic is None else int(self.line_of_mapping[generic]))
+        return rules
+
+    def changed_keys(self, other: 'MappingClassifier') -> Set[str]:
+        """
+        Normalized cost centers whose rules give other lines under `other`:
+        only rows with one of them as cost center or 'Categoria 1' can be
+        classified differently.
+        """
+        mine, theirs = self.rules(), other.rules()
+        return {cc for cc in mine.keys() | theirs.keys() if mine.get(cc) != theirs.get(cc)}
+
+    def line_numbers(self, mapping_indices: np.ndarray) -> np.ndarray:
+        """Translate mapping indices to P&L line numbers (0 = not accumulated)."""
+        # UNMAPPED (-1) picks the trailing 0 sentinel
+        return self.line_of_mapping[mapping_indices]
+
+    def classify(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Emit the 'linha_pl' column for a frame that already carries the
+        normalized 'cc_norm', 'match_text' and (optionally) 'cat_norm' columns.
+        """
+        indices = self.classify_indices(
+            df['cc_norm'],
+            df['match_text'],
+            df['cat_norm'] if 'cat_norm' in df.columns else None,
+        )
+        return pd.Series(self.line_numbers(indices), index=df.index, name='linha_pl')
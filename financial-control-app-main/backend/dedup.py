@@ -0,0 +1,162 @@
+"""
+Transaction fingerprints for append uploads.
+
+A transaction's fingerprint is a 64-bit hash of the export columns that
+identify it (dates, amount, supplier, description, bank account, supplier
+identifier); its key is the same hash without the amount. Identical rows are
+legitimate (two equal payments on one day), so the n-th occurrence of a
+fingerprint within a file is hashed together with n: re-uploading a file
+matches each of its rows once, and a file with one more identical payment
+inserts just that one.
+
+Appending a file, a row whose fingerprint is already stored is a duplicate;
+a row whose key is stored under another fingerprint (the same transaction
+exported again with an edited amount) is a conflict, reported and not
+inserted; every other row is inserted. Within a chunk, duplicates are
+numbered before the other rows of their key, so the outcome doesn't depend
+on the order of the rows.
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from schema import NO_MONTH
+
+FINGERPRINT_COLUMNS = [
+    'Data movimento',
+    'Data de competência',
+    'Valor_Num',
+    'Nome do fornecedor/cliente',
+    'Descrição',
+    'Conta bancária',
+    'Identificador do fornecedor/cliente',
+]
+AMOUNT_COLUMN = 'Valor_Num'
+
+_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_NO_AMOUNT = np.iinfo(np.int64).min
+_NO_HASHES = np.empty(0, dtype=np.int64)
+
+# (fingerprints, keys) -> (fingerprint stored?, key stored?) per row
+Lookup = Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+
+def _column_hash(col: pd.Series) -> np.ndarray:
+    """Hash of each value, the same whichever dtype the column was stored with."""
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        values = col.to_numpy(dtype='datetime64[s]').view(np.int64)
+    elif col.name == AMOUNT_COLUMN:
+        cents = np.round(col.to_numpy(dtype=float) * 100)
+        values = np.where(np.isnan(cents), _NO_AMOUNT, cents).astype(np.int64)
+    else:
+        values = col.astype(object).where(col.notna(), '').to_numpy(dtype=object)
+    return pd.util.hash_array(values)
+
+
+def _combine(hashes: List[np.ndarray], rows: int) -> np.ndarray:
+    combined = np.zeros(rows, dtype=np.uint64)
+    for h in hashes:
+        combined = combined * _MULTIPLIER + h
+    return combined
+
+
+def row_hashes(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """(fingerprint, key) of every row, before occurrence numbering."""
+    columns = [col for col in FINGERPRINT_COLUMNS if col in df.columns]
+    hashes = {col: _column_hash(df[col]) for col in columns}
+    fingerprints = _combine([hashes[col] for col in columns], len(df))
+    keys = _combine([hashes[col] for col in columns if col != AMOUNT_COLUMN], len(df))
+    return fingerprints, keys
+
+
+class Occurrences:
+    """Numbers the occurrences of each hash across the chunks of one file."""
+
+    def __init__(self):
+        self._seen: Dict[int, int] = {}
+
+    def number(self, hashes: np.ndarray) -> np.ndarray:
+        """Hashes combined with their occurrence number (as int64, storable in SQLite)."""
+        unique, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+        before = np.array([self._seen.get(h, 0) for h in unique.tolist()], dtype=np.uint64)
+        within = pd.Series(inverse).groupby(inverse).cumcount().to_numpy(dtype=np.uint64)
+        for h, seen, count in zip(unique.tolist(), before.tolist(), counts.tolist()):
+            self._seen[h] = seen + count
+        occurrence = before[inverse] + within
+        return pd.util.hash_array(hashes ^ (occurrence * _MULTIPLIER)).view(np.int64)
+
+
+def fingerprint_frame(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Numbered (fingerprints, keys) of a whole stored frame."""
+    fingerprints, keys = row_hashes(df)
+    return Occurrences().number(fingerprints), Occurrences().number(keys)
+
+
+class FingerprintIndex:
+    """Sorted fingerprint and key arrays of stored segments, searched without loading them whole."""
+
+    def __init__(self, parts: Sequence[np.ndarray] = ()):
+        self.parts = [part for part in parts if part.shape[1]]  # Each (2, n): fingerprints, keys
+
+    @staticmethod
+    def build(fingerprints: np.ndarray, keys: np.ndarray) -> np.ndarray:
+        return np.vstack([np.sort(fingerprints), np.sort(keys)])
+
+    def lookup(self, fingerprints: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        found = np.zeros(len(fingerprints), dtype=bool), np.zeros(len(keys), dtype=bool)
+        for part in self.parts:
+            for hits, stored, values in zip(found, part, (fingerprints, keys)):
+                pos = np.minimum(np.searchsorted(stored, values), len(stored) - 1)
+                hits |= stored[pos] == values
+        return found
+
+
+class Deduplicator:
+    """
+    Filter the chunks of an upload down to the rows not stored yet, counting
+    inserted, duplicate and conflicting rows along the way.
+    """
+
+    def __init__(self, lookup: Optional[Lookup] = None):
+        self.lookup = lookup
+        self._fingerprints = Occurrences()
+        self._keys = Occurrences()
+        self.inserted = self.duplicates = self.conflicts = 0
+        self.months: Set[int] = set()
+        self.new_fingerprints: List[np.ndarray] = []
+        self.new_keys: List[np.ndarray] = []
+
+    def filter(self, chunk: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+        """(rows to insert, their fingerprints, their keys)"""
+        fingerprints, keys = row_hashes(chunk)
+        fingerprints = self._fingerprints.number(fingerprints)
+        if self.lookup is not None:
+            # Re-sent rows take the first occurrences of their keys, wherever
+            # they are in the chunk; the new rows are numbered after them
+            duplicate, _ = self.lookup(fingerprints, _NO_HASHES)
+            self.duplicates += int(duplicate.sum())
+            self._keys.number(keys[duplicate])
+            chunk, fingerprints, keys = chunk[~duplicate], fingerprints[~duplicate], keys[~duplicate]
+        keys = self._keys.number(keys)
+        if self.lookup is not None:
+            _, conflict = self.lookup(_NO_HASHES, keys)
+            self.conflicts += int(conflict.sum())
+            chunk, fingerprints, keys = chunk[~conflict], fingerprints[~conflict], keys[~conflict]
+        self.inserted += len(chunk)
+        if 'Mes_Competencia' in chunk.columns:
+            self.months.update(m for m in np.unique(chunk['Mes_Competencia'].to_numpy()).tolist() if m != NO_MONTH)
+        self.new_fingerprints.append(fingerprints)
+        self.new_keys.append(keys)
+        return chunk, fingerprints, keys
+
+    def index_part(self) -> np.ndarray:
+        """Sorted (2, n) fingerprints and keys of the inserted rows."""
+        return FingerprintIndex.build(
+            np.concatenate(self.new_fingerprints) if self.new_fingerprints else np.empty(0, np.int64),
+            np.concatenate(self.new_keys) if self.new_keys else np.empty(0, np.int64),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        return {"inserted": self.inserted, "duplicates": self.duplicates, "conflicts": self.conflicts}
@@ -0,0 +1,513 @@
+"""
+Parsing kernels for Conta Azul extrato uploads.
+
+Used by process_upload in logic.py: the CSV is sniffed and read once, then
+every kernel works column-at-a-time and, where values repeat, evaluates each
+distinct value only once.
+"""
+
+import codecs
+import csv
+import io
+import logging
+import re
+import warnings
+from collections import Counter
+from typing import Any, BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+logger = logging.getLogger(__name__)
+
+# Monetary columns of the Conta Azul export (parsed from BR/US formatted text)
+MONEY_COLUMNS = [
+    'Valor (R$)',
+    'Saldo conta (R$)',
+    'Valor original (R$)',
+    'Juros (R$)',
+    'Multa (R$)',
+    'Desconto (R$)',
+    'Taxas (R$)',
+    'Valor na Categoria 1',
+    'Valor no Centro de Custo 1',
+]
+
+# Date columns of the Conta Azul export
+DATE_COLUMNS = [
+    'Data movimento',
+    'Data de competência',
+    'Data original de vencimento',
+    'Data prevista',
+]
+
+# Accepted date formats, in priority order
+DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y']
+
+# CSV sniffing: candidate delimiters (ties keep this order) and sample size
+CSV_DELIMITERS = [',', ';', '\t', '|']
+SNIFF_BYTES = 16 * 1024
+
+# CSV bytes per chunk for streaming uploads (bounds the raw text held in memory)
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Bytes 0x80-0x9F that cp1252 maps to printable characters (the other five are
+# undefined there, so a file containing them can only be latin-1)
+_CP1252_UNDEFINED = {0x81, 0x8D, 0x8F, 0x90, 0x9D}
+_NON_C1_BYTES = bytes(b for b in range(256) if not 0x80 <= b <= 0x9F)
+
+
+class CsvDialect(NamedTuple):
+    """How an uploaded CSV was read (reported back by /upload)."""
+    encoding: str
+    delimiter: str
+    quotechar: str
+    skipped_lines: int = 0
+
+
+def _bom_encoding(head: bytes) -> Optional[str]:
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def _single_byte_encoding(c1: set) -> str:
+    """C1-range bytes that are all printable in cp1252 mean a Windows export."""
+    if c1 and not c1 & _CP1252_UNDEFINED:
+        return 'cp1252'
+    return 'latin-1'
+
+
+def detect_encoding(content: bytes) -> str:
+    """
+    BOM first, then strict UTF-8 validation of the whole buffer (C speed),
+    then byte statistics: C1-range bytes that are printable in cp1252 mean a
+    Windows export, anything else decodes as latin-1.
+    """
+    bom = _bom_encoding(content)
+    if bom:
+        return bom
+    try:
+        content.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    return _single_byte_encoding(set(content.translate(None, _NON_C1_BYTES)))
+
+
+def detect_file_encoding(fileobj: BinaryIO, block_size: int = 1 << 20) -> str:
+    """detect_encoding over a seekable file, reading it in blocks. Rewinds the file."""
+    fileobj.seek(0)
+    encoding = _bom_encoding(fileobj.read(4))
+    fileobj.seek(0)
+    if encoding:
+        return encoding
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    utf8 = True
+    c1 = set()
+    for block in iter(lambda: fileobj.read(block_size), b''):
+        if utf8:
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                utf8 = False
+        c1 |= set(block.translate(None, _NON_C1_BYTES))
+    if utf8:
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            utf8 = False
+    fileobj.seek(0)
+    return 'utf-8' if utf8 else _single_byte_encoding(c1)
+
+
+def _decode_sample(content: bytes, encoding: str) -> str:
+    """Decode the first SNIFF_BYTES, ignoring a multi-byte char cut at the end."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    return decoder.decode(content[:SNIFF_BYTES], final=False)
+
+
+def sniff_dialect(sample: str, delimiters: List[str] = CSV_DELIMITERS) -> Tuple[str, str]:
+    """
+    Pick (delimiter, quotechar) from a text sample: the delimiter whose field
+    count is the same on most sample lines, preferring more fields.
+    """
+    lines = sample.splitlines()
+    if len(lines) > 1 and not sample.endswith(('\n', '\r')):
+        lines = lines[:-1]  # last line is probably cut by the sample boundary
+    lines = [line for line in lines if line.strip()][:50]
+    if not lines:
+        raise ValueError("Error reading CSV file. The file is empty.")
+
+    # Quote character: the one that opens fields (after a delimiter or at line start)
+    opening = '(?:^|[' + re.escape(''.join(delimiters)) + ']){}'
+    quoted = {q: len(re.findall(opening.format(q), sample, flags=re.MULTILINE)) for q in ['"', "'"]}
+    quotechar = "'" if quoted["'"] > quoted['"'] else '"'
+
+    best, best_score = None, (0.0, 1)
+    for delimiter in delimiters:
+        counts = Counter(len(row) for row in csv.reader(lines, delimiter=delimiter, quotechar=quotechar))
+        fields, consistent = counts.most_common(1)[0]
+        if fields < 2:
+            continue
+        score = (consistent / len(lines), fields)
+        if score > best_score:
+            best, best_score = delimiter, score
+    if best is None:
+        raise ValueError("Error reading CSV file. Could not detect valid format (encoding/separator).")
+    return best, quotechar
+
+
+def read_csv_upload(content: bytes) -> Tuple[pd.DataFrame, CsvDialect]:
+    """
+    Sniff encoding and dialect from the upload, then parse it exactly once.
+    Malformed lines are skipped (and counted) instead of failing the upload.
+    """
+    encoding = detect_encoding(content)
+    delimiter, quotechar = sniff_dialect(_decode_sample(content, encoding))
+
+    df, skipped = _parse_csv_bytes(content, encoding, delimiter, quotechar)
+
+    dialect = CsvDialect(encoding, delimiter, quotechar, skipped)
+    _log_dialect(dialect)
+    return df, dialect
+
+
+def _parse_csv_bytes(content: bytes, encoding: str, delimiter: str, quotechar: str) -> Tuple[pd.DataFrame, int]:
+    """One C-engine parse; malformed lines are skipped. Returns (df, skipped lines)."""
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', pd.errors.ParserWarning)
+        try:
+            df = pd.read_csv(
+                io.BytesIO(content), encoding=encoding, sep=delimiter,
+                quotechar=quotechar, on_bad_lines='warn',
+            )
+        except Exception as e:
+            raise ValueError(f"Error reading CSV file. Please ensure it's a valid CSV. Details: {e}")
+    skipped = sum(
+        str(w.message).count('Skipping line') for w in caught if issubclass(w.category, pd.errors.ParserWarning)
+    )
+    return df, skipped
+
+
+def _log_dialect(dialect: CsvDialect):
+    if dialect.skipped_lines:
+        logger.warning(f"Skipped {dialect.skipped_lines} malformed CSV lines")
+    logger.info(f"CSV dialect: {dialect}")
+
+
+def _record_ends(buf: bytes, quote: int) -> np.ndarray:
+    """
+    Positions of the newlines of `buf` that end a record, i.e. are not inside
+    a quoted field (buf must start on a record boundary).
+    """
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    in_quotes = np.bitwise_xor.accumulate((arr == quote).view(np.uint8))
+    return np.flatnonzero((arr == ord('\n')) & (in_quotes == 0))
+
+
+def _split_first_record(buf: bytes, quote: int) -> Tuple[bytes, bytes]:
+    ends = _record_ends(buf, quote)
+    cut = int(ends[0]) + 1 if len(ends) else len(buf)
+    return buf[:cut], buf[cut:]
+
+
+def _iter_record_blocks(fileobj: BinaryIO, block_size: int, quote: int) -> Iterator[bytes]:
+    """Read the file in blocks of about block_size bytes cut on record boundaries."""
+    carry = b''
+    while True:
+        data = fileobj.read(block_size)
+        if not data:
+            if carry:
+                yield carry
+            return
+        buf = carry + data
+        ends = _record_ends(buf, quote)
+        if len(ends) == 0:
+            carry = buf
+            continue
+        cut = int(ends[-1])
+        yield buf[:cut + 1]
+        carry = buf[cut + 1:]
+
+
+class CsvChunkReader:
+    """
+    Iterate over a seekable upload file in DataFrames of about `chunk_bytes`
+    of CSV text each.
+
+    Encoding and dialect are sniffed up front like read_csv_upload (the file
+    is scanned block by block, never loaded whole). Blocks are cut on record
+    boundaries and each one is parsed behind the file's header, so every
+    chunk is read exactly like the whole file would be (pandas' own chunksize
+    mishandles malformed lines at chunk starts). `dialect` is final once
+    iteration is done.
+    """
+
+    def __init__(self, fileobj: BinaryIO, chunk_bytes: int = UPLOAD_CHUNK_BYTES):
+        self.fileobj = fileobj
+        self.chunk_bytes = chunk_bytes
+        self.encoding = detect_file_encoding(fileobj)
+        self.delimiter, self.quotechar = sniff_dialect(_decode_sample(fileobj.read(SNIFF_BYTES), self.encoding))
+        fileobj.seek(0)
+        self.skipped_lines = 0
+
+    @property
+    def dialect(self) -> CsvDialect:
+        return CsvDialect(self.encoding, self.delimiter, self.quotechar, self.skipped_lines)
+
+    def _read(self, content: bytes, count_skipped: bool = True) -> pd.DataFrame:
+        df, skipped = _parse_csv_bytes(content, self.encoding, self.delimiter, self.quotechar)
+        if count_skipped:
+            self.skipped_lines += skipped
+        return df
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        if self.encoding == 'utf-16':
+            # Byte-level record splitting needs an ASCII-compatible encoding
+            yield self._read(self.fileobj.read())
+        else:
+            quote = ord(self.quotechar)
+            header = first_record = prefix_rows = None
+            offset = 0
+            for block in _iter_record_blocks(self.fileobj, self.chunk_bytes, quote):
+                if header is None:
+                    header, rest = _split_first_record(block, quote)
+                    first_record = _split_first_record(rest, quote)[0] if rest else None
+                    chunk = self._read(block)
+                elif first_record is None:
+                    first_record = _split_first_record(block, quote)[0]
+                    chunk = self._read(header + block)
+                else:
+                    # Read behind the header and the file's first record:
+                    # pandas takes a first data line with an extra field as
+                    # an index column instead of a malformed line
+                    if prefix_rows is None:
+                        prefix_rows = len(self._read(header + first_record, count_skipped=False))
+                    chunk = self._read(header + first_record + block).iloc[prefix_rows:]
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+        _log_dialect(self.dialect)
+
+
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate same-schema chunks into one frame with a fresh RangeIndex.
+    Categorical columns stay categorical (categories are unioned) and an
+    all-missing chunk of a text or categorical column takes the column's
+    dtype instead of degrading the whole column to object.
+
+    The chunks are consumed: each column is popped from them as soon as it is
+    concatenated, so peak memory is the result plus one column, not twice it.
+    """
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+
+    columns = {}
+    for col in list(chunks[0].columns):
+        parts = [chunk.pop(col) for chunk in chunks]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            # An all-missing chunk has float64 categories; give it the others'
+            filled = next((p.dtype.categories for p in parts if not p.isna().all()), None)
+            if filled is not None:
+                empty = pd.CategoricalDtype(filled[:0])
+                parts = [p.astype(empty) if p.isna().all() else p for p in parts]
+            columns[col] = pd.Series(union_categoricals(parts))
+            continue
+        text = next((p.dtype for p in parts if isinstance(p.dtype, pd.StringDtype)), None)
+        if text is not None:
+            parts = [p.astype(text) if p.isna().all() else p for p in parts]
+        columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def converter_valor_br(valor_str: Any) -> float:
+    """
+    Scalar reference parser for one amount: strips 'R$', handles (1.234,56)
+    and trailing-minus negatives and BR vs US separators. Unparseable -> 0.0.
+    parse_currency_column must stay equivalent to this function.
+    """
+    if pd.isna(valor_str) or str(valor_str).strip() == "":
+        return 0.0
+
+    s = str(valor_str).replace('R$', '').strip()
+
+    negative = False
+    # (1.234,56) accounting negative
+    if s.startswith('(') and s.endswith(')'):
+        negative = True
+        s = s[1:-1].strip()
+
+    # 1.234,56- trailing minus
+    if s.endswith('-'):
+        negative = True
+        s = s[:-1].strip()
+
+    # Remove spaces
+    s = s.replace(' ', '')
+
+    # Brazilian vs US separators
+    if ',' in s and '.' in s:
+        if s.rfind(',') > s.rfind('.'):
+            s = s.replace('.', '').replace(',', '.')
+        else:
+            s = s.replace(',', '')
+    elif ',' in s:
+        s = s.replace(',', '.')
+
+    try:
+        v = float(s)
+        return -v if negative else v
+    except ValueError:
+        return 0.0
+
+
+# Amounts needing none of the R$/parenthesis/trailing-minus/space rules:
+# BR "-1.234,56" (dots dropped, comma -> decimal point) or plain "-1234.56"
+_CANONICAL_AMOUNT = r'-?[0-9][0-9.]*,[0-9]+|-?[0-9]+(?:\.[0-9]+)?'
+
+_PLAIN_NUMBER = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+
+
+def _parse_currency_strings(s: pd.Series) -> np.ndarray:
+    """Vectorized converter_valor_br over a Series of str (no missing values)."""
+    empty = (s.str.strip() == '').to_numpy()
+
+    s = s.str.replace('R$', '', regex=False).str.strip()
+
+    # (1.234,56) accounting negative
+    paren = s.str.startswith('(') & s.str.endswith(')')
+    s = s.where(~paren, s.str[1:-1].str.strip())
+
+    # 1.234,56- trailing minus
+    trailing = s.str.endswith('-')
+    s = s.where(~trailing, s.str[:-1].str.strip())
+    negative = (paren | trailing).to_numpy().copy()
+
+    s = s.str.replace(' ', '', regex=False)
+
+    # Brazilian vs US separators
+    has_comma = s.str.contains(',', regex=False)
+    has_dot = s.str.contains('.', regex=False)
+    # Last comma after the last dot -> '1.234,56'
+    brazilian = has_comma & has_dot & s.str.contains(r',[^.]*$', regex=True)
+    us = has_comma & has_dot & ~brazilian
+    comma_decimal = has_comma & ~has_dot
+    s = s.where(~brazilian, s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    s = s.where(~us, s.str.replace(',', '', regex=False))
+    s = s.where(~comma_decimal, s.str.replace(',', '.', regex=False))
+
+    # Plain decimals are converted in one tight pass; the rest goes through
+    # float() one by one so inputs Python accepts ('1_000', 'nan', 'inf',
+    # non-ASCII digits) behave exactly like the scalar parser
+    plain = s.str.fullmatch(_PLAIN_NUMBER).to_numpy(dtype=bool)
+    values = np.zeros(len(s), dtype=np.float64)
+    values[plain] = [float(v) for v in s[plain].tolist()]
+    for i in np.flatnonzero(~plain & ~empty):
+        try:
+            values[i] = float(s.iat[i])
+        except ValueError:
+            values[i] = 0.0
+            negative[i] = False
+
+    values = np.where(negative, -values, values)
+    values[empty] = 0.0
+    return values
+
+
+def parse_currency_column(col: pd.Series) -> pd.Series:
+    """
+    Vectorized equivalent of col.apply(converter_valor_br).
+    Each distinct value is parsed once and broadcast back through the codes.
+    """
+    codes, uniques = pd.factorize(col)
+    if len(uniques) == 0:
+        return pd.Series(np.zeros(len(col)), index=col.index, name=col.name)
+
+    text = pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype('str')
+    parsed = np.zeros(len(text), dtype=np.float64)
+
+    # Fast path: canonical export amounts ("-1.234,56", "10000.00")
+    canonical = text.str.fullmatch(_CANONICAL_AMOUNT).to_numpy(dtype=bool)
+    fast = text[canonical]
+    brazilian = fast.str.contains(',', regex=False)
+    fast = fast.where(~brazilian, fast.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    parsed[canonical] = [float(v) for v in fast.tolist()]
+
+    # Everything else goes through the full rule set
+    if not canonical.all():
+        parsed[~canonical] = _parse_currency_strings(text[~canonical].reset_index(drop=True))
+
+    # Missing values (code -1) pick the trailing 0.0
+    parsed = np.append(parsed, 0.0)
+    return pd.Series(parsed[codes], index=col.index, name=col.name)
+
+
+def parse_date_value(date_str: Any) -> pd.Timestamp:
+    """
+    Scalar reference parser: first of DATE_FORMATS that matches, else NaT.
+    """
+    if pd.isna(date_str):
+        return pd.NaT
+    date_str = str(date_str).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return pd.to_datetime(date_str, format=fmt)
+        except (ValueError, TypeError):
+            continue
+    return pd.NaT
+
+
+def infer_date_format(sample: pd.Series, formats: List[str] = DATE_FORMATS) -> Optional[str]:
+    """
+    Pick the format that parses most of the sample (ties go to the earlier,
+    higher-priority format). Returns None when nothing parses.
+    """
+    best, best_count = None, 0
+    for fmt in formats:
+        count = int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+        if count > best_count:
+            best, best_count = fmt, count
+    return best
+
+
+def parse_date_column(col: pd.Series, formats: List[str] = DATE_FORMATS, sample_size: int = 500) -> pd.Series:
+    """
+    Vectorized date parsing: infer the column's dominant format from a sample
+    of its distinct values, parse everything with it in one call, and retry
+    only the leftover values with the remaining formats (in priority order).
+    """
+    codes, uniques = pd.factorize(col)
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=col.index, dtype='datetime64[us]', name=col.name)
+
+    text = pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype('str').str.strip()
+
+    dominant = infer_date_format(text.iloc[:sample_size], formats)
+    order = [dominant] + [f for f in formats if f != dominant] if dominant else []
+    if dominant and col.name is not None:
+        logger.info(f"{col.name}: dominant date format {dominant}")
+
+    parsed = pd.Series(pd.NaT, index=text.index, dtype='datetime64[us]')
+    pending = text
+    for fmt in order:
+        attempt = pd.to_datetime(pending, format=fmt, errors='coerce')
+        ok = attempt.notna()
+        parsed.loc[attempt.index[ok]] = attempt[ok]
+        pending = pending[~ok]
+        if pending.empty:
+            break
+
+    # Missing values (code -1) pick the trailing NaT
+    values = np.append(parsed.to_numpy(dtype='datetime64[us]'), np.datetime64('NaT', 'us'))
+    return pd.Series(values[codes], index=col.index, name=col.name)
@@ -0,0 +1,229 @@
+"""
+Append-only journal of mapping and override edits (data/changes.jsonl).
+
+Every edit is one JSON line (sequence number, timestamp, user, op and its
+arguments), so persisting an edit is one small append whatever the size of the
+state. The state on disk is the last snapshot (mappings.json, overrides.json)
+plus the journal tail, replayed at startup. Once the journal passes
+`compact_bytes`, compact() writes a new snapshot and moves the journal into
+the history directory, which keeps every edit for auditing.
+
+Edits are full replacements (set a cell, clear, replace the mapping list), so
+replaying a record the snapshot already contains is harmless: a crash between
+writing a snapshot and rotating the journal loses nothing.
+
+Several worker processes can share one journal: appends and compactions take
+an exclusive file lock, and each worker catches up on the records the others
+appended (sync(), before its own commits) so they all apply the same edits
+in the same order.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: edits are serialized within the process only
+    fcntl = None
+
+Change = Dict[str, Any]
+
+
+class ChangeJournal:
+    """Thread-safe append-only change log with snapshot compaction."""
+
+    def __init__(self, path: Path, history_dir: Path, compact_bytes: int = 256 * 1024):
+        self.path = Path(path)
+        self.history_dir = Path(history_dir)
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self._lock_file = None
+        self._depth = 0
+        self._seq = 0
+        self._seen: Optional[Tuple[int, int]] = None  # journal file (inode, size) applied
+        self.compactions = 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Exclusive access to the journal, across threads and worker processes (reentrant)."""
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth == 1 and fcntl is not None:
+                    if self._lock_file is None:
+                        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+                        self._lock_file = open(self.lock_path, 'a')
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if self._depth == 1 and fcntl is not None:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            finally:
+                self._depth -= 1
+
+    def _file_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size
+
+    def replay(self, apply: Callable[[Change], None]) -> int:
+        """Apply the journal tail (on top of the loaded snapshot); returns the record count."""
+        with self.locked():
+            self._seq = max(self._seq, self._compacted_seq())
+            self._drop_torn_tail()
+            count = 0
+            for change in self.read():
+                apply(change)
+                self._seq = max(self._seq, change.get('seq', 0))
+                count += 1
+            self._seen = self._file_state()
+            return count
+
+    def sync(self, apply: Callable[[Change], None]) -> int:
+        """
+        Apply the records other processes committed since this one last read
+        the journal; returns their count. One stat() when nothing changed.
+        """
+        if self._file_state() == self._seen:
+            return 0
+        with self.locked():
+            return self._catch_up(apply)
+
+    def _catch_up(self, apply: Callable[[Change], None]) -> int:
+        records = list(self.read())
+        first = records[0].get('seq', 0) if records else self._compacted_seq() + 1
+        if first > self._seq + 1:
+            # Another process compacted records this one hasn't applied yet
+            missed = []
+            for segment in self._segments():
+                if int(segment.stem.rsplit('-', 1)[-1]) > self._seq:
+                    missed.extend(self._read_segment(segment))
+            records = missed + records
+        count = 0
+        for change in records:
+            if change.get('seq', 0) > self._seq:
+                apply(change)
+                self._seq = change['seq']
+                count += 1
+        self._seen = self._file_state()
+        return count
+
+    def _drop_torn_tail(self):
+        """Cut a last line left incomplete by a crash, so appends start on a new line."""
+        if self.size() == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def read(self) -> Iterator[Change]:
+        """Records of the current journal, oldest first (a torn last line is skipped)."""
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def commit(self, change: Change, apply: Callable[[Change], None], user: Optional[str] = None) -> Change:
+        """
+        Append an edit to the journal, then apply it to the in-memory state.
+        Both happen under the journal lock, after catching up on the edits
+        of other processes, so the journal order is the order the edits were
+        applied in everywhere and a compaction never splits them. An edit
+        that could not be written is not applied (and takes no sequence number).
+        """
+        with self.locked():
+            self._catch_up(apply)
+            record = {'seq': self._seq + 1, 'ts': datetime.now().isoformat(), 'user': user, **change}
+            line = json.dumps(record, default=str) + '\n'
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                    f.flush()
+            except OSError:
+                # A partly written line would be taken for a torn tail
+                self._drop_torn_tail()
+                raise
+            apply(record)
+            self._seq = record['seq']
+            self._seen = self._file_state()
+            return record
+
+    def _segments(self) -> List[Path]:
+        """History segments (changes-<time>-<last seq>.jsonl), oldest first."""
+        if not self.history_dir.exists():
+            return []
+        return sorted(self.history_dir.glob('changes-*.jsonl'))
+
+    def _read_segment(self, segment: Path) -> List[Change]:
+        with open(segment, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _compacted_seq(self) -> int:
+        segments = self._segments()
+        return int(segments[-1].stem.rsplit('-', 1)[-1]) if segments else 0
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def needs_compaction(self) -> bool:
+        return self.size() >= self.compact_bytes
+
+    def compact(self, write_snapshot: Callable[[], None]) -> bool:
+        """
+        Write a snapshot of the current state and start a new journal.
+        Edits wait for it; a compaction already running makes this a no-op,
+        and so does a journal with records this process hasn't applied (the
+        snapshot would miss them).
+        """
+        if not self._compacting.acquire(blocking=False):
+            return False
+        try:
+            with self.locked():
+                if not self.path.exists() or self._file_state() != self._seen:
+                    return False
+                write_snapshot()
+                self.history_dir.mkdir(parents=True, exist_ok=True)
+                stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+                os.replace(self.path, self.history_dir / f'changes-{stamp}-{self._seq}.jsonl')
+                self._seen = None
+                self.compactions += 1
+                return True
+        finally:
+            self._compacting.release()
+
+    def history(self, limit: int = 100) -> List[Change]:
+        """Most recent records, compacted ones included, newest first."""
+        with self.locked():
+            records = list(self.read())
+            segments = self._segments()
+        records.reverse()
+        for segment in reversed(segments):
+            if len(records) >= limit:
+                break
+            records.extend(reversed(self._read_segment(segment)))
+        return records[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'journal_bytes': self.size(),
+            'last_seq': self._seq,
+            'compactions': self.compactions,
+        }
@@ -2,66 +2,144 @@ import pandas as pd
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from datetime import datetime
-import io
+import copy
 import logging
-from typing import List, Dict, Any
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
 from collections import defaultdict
 import unicodedata
-from models import MappingItem, PnLItem, PnLResponse, DashboardData, ValidationAlert
+from models import LineMove, MappingItem, MappingPreview, PnLCell, PnLDelta, PnLItem, PnLResponse, DashboardData, ValidationAlert
+import re
+from classifier import MappingClassifier, UNMAPPED, MAX_LINE, dict_encode, encode_combination_codes, encode_combinations
+from pnl_graph import PNL_GRAPH, TOLERANCE
+from schema import NO_MONTH, apply_schema, month_code, month_label, split_free_text, to_month_codes
+from ingest import (
+    DATE_COLUMNS,
+    MONEY_COLUMNS,
+    UPLOAD_CHUNK_BYTES,
+    CsvChunkReader,
+    CsvDialect,
+    concat_chunks,
+    parse_currency_column,
+    parse_date_column,
+    read_csv_upload,
+)
 
 # Configure logging for financial calculations
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-def process_upload(file_content: bytes) -> pd.DataFrame:
+# P&L matrix layout: row index = line number (source lines 1-120, derived 100-113)
+N_LINES = MAX_LINE + 1
+FINAL_LINES = {100, 106, 111}  # Revenue, EBITDA, Net Result (overridable)
+COUNT_COLUMN = 'Qtd_Transacoes'  # Transactions summed into a row (SQLite P&L groups)
+PREVIEW_TOLERANCE = 1e-6  # Smaller P&L differences are float noise, not changes
+
+# Payroll routing: transactions whose category/description/supplier mention one
+# of these keywords are moved to the Wages Expenses cost center (P&L line 62)
+WAGES_COST_CENTER = 'Wages Expenses'
+PAYROLL_KEYWORDS = [
+    'folha de pagamento', 'folha pagamento', 'folha',
+    'pro labore', 'pro-labore', 'pró labore', 'pró-labore',
+    'salario', 'salário', 'holerite',
+    'prestador de servico pj', 'payroll'
+]
+
+def process_upload(file_content: bytes, payroll_keywords: List[str] = PAYROLL_KEYWORDS) -> pd.DataFrame:
     """
     Process the uploaded CSV file from Conta Azul.
     """
-    # Try different encodings and separators
-    df = None
-    encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
-    separators = [',', ';', '\t']
-    last_error = None
-    
-    for encoding in encodings:
-        for sep in separators:
-            try:
-                # Try strict parsing first
-                df = pd.read_csv(io.BytesIO(file_content), encoding=encoding, sep=sep)
-                
-                # Check if it has the critical column 'Data de competência'
-                if 'Data de competência' in df.columns:
-                    break
-                else:
-                    df = None # Not the right separator
-            except Exception:
-                continue
-        
-        if df is not None:
-            break
-            
-        # If strict parsing failed for this encoding, try with on_bad_lines='skip' as fallback
-        for sep in separators:
-            try:
-                print(f"⚠️ Strict parsing failed. Retrying with on_bad_lines='skip', encoding={encoding}, sep='{sep}'")
-                df = pd.read_csv(io.BytesIO(file_content), encoding=encoding, sep=sep, on_bad_lines='skip', engine='python')
-                if 'Data de competência' in df.columns:
-                    break
-                else:
-                    df = None
-            except Exception as e:
-                last_error = e
-                continue
-        
-        if df is not None:
-            break
-    
-    if df is None:
-        if last_error:
-            raise ValueError(f"Error reading CSV file. Please ensure it's a valid CSV. Details: {last_error}")
+    # Sniff encoding/delimiter from the content and parse it once
+    df, dialect = read_csv_upload(file_content)
+
+    df = clean_transactions(normalize_upload_columns(df), payroll_keywords)
+    df.attrs['csv_dialect'] = dialect._asdict()
+    return df
+
+# Stages process_upload_stream reports to `on_progress`, in order
+UPLOAD_STAGES = ['sniff', 'parse', 'clean', 'classify', 'persist']
+
+def stream_upload(
+    fileobj: BinaryIO,
+    on_chunk: Optional[Callable[[pd.DataFrame], None]] = None,
+    on_text_chunk: Optional[Callable[[pd.DataFrame], None]] = None,
+    chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+    payroll_keywords: List[str] = PAYROLL_KEYWORDS,
+    on_progress: Optional[Callable[[str, int], None]] = None,
+) -> Tuple[int, CsvDialect]:
+    """
+    Clean a (spooled) CSV file chunk by chunk without keeping the chunks.
+
+    The CSV is read about `chunk_bytes` at a time and every cleaning stage runs
+    per chunk; each cleaned chunk is handed to `on_chunk` (e.g. the on-disk
+    store writer) and then released, so peak memory is one chunk whatever
+    the file size. Returns (rows read, dialect the file was read with).
+
+    With `on_text_chunk`, the free-text columns (schema.FREE_TEXT_COLUMNS)
+    are split off every chunk and handed to it instead of being kept.
+
+    `on_progress(stage, rows)` is called as each UPLOAD_STAGES stage
+    completes, with the number of rows through that stage so far.
+    """
+    def progress(stage: str, rows: int):
+        if on_progress is not None:
+            on_progress(stage, rows)
+
+    reader = CsvChunkReader(fileobj, chunk_bytes)
+    progress('sniff', 0)
+    columns = None
+    rows = 0
+    for chunk in reader:
+        rows += len(chunk)
+        progress('parse', rows)
+        if columns is None:
+            chunk = normalize_upload_columns(chunk)
+            columns = chunk.columns
         else:
-            raise ValueError("Error reading CSV file. Could not detect valid format (encoding/separator).")
+            # Same header for every chunk: reuse the normalized names
+            chunk.columns = columns
+        chunk = clean_values(chunk)
+        progress('clean', rows)
+        chunk = classify_transactions(chunk, payroll_keywords)
+        progress('classify', rows)
+        if on_text_chunk is not None:
+            chunk, text = split_free_text(chunk)
+            on_text_chunk(text)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        progress('persist', rows)
 
+    if columns is None:
+        raise ValueError("Error reading CSV file. The file is empty.")
+    return rows, reader.dialect
+
+def process_upload_stream(
+    fileobj: BinaryIO,
+    on_chunk: Optional[Callable[[pd.DataFrame], None]] = None,
+    on_text_chunk: Optional[Callable[[pd.DataFrame], None]] = None,
+    chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+    payroll_keywords: List[str] = PAYROLL_KEYWORDS,
+    on_progress: Optional[Callable[[str, int], None]] = None,
+) -> pd.DataFrame:
+    """
+    Streaming variant of process_upload for a (spooled) file object: the
+    chunks of stream_upload, kept and concatenated into the cleaned frame.
+    The raw text frame never exists in full: peak memory is one raw chunk
+    plus the cleaned rows.
+    """
+    cleaned = []
+
+    def keep(chunk: pd.DataFrame):
+        if on_chunk is not None:
+            on_chunk(chunk)
+        cleaned.append(chunk)
+
+    _, dialect = stream_upload(fileobj, keep, on_text_chunk, chunk_bytes, payroll_keywords, on_progress)
+    df = concat_chunks(cleaned)
+    df.attrs['csv_dialect'] = dialect._asdict()
+    return df
+
+def normalize_upload_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip column names, resolve export aliases and check the required columns."""
     # Normalize column names - strip whitespace
     df.columns = [c.strip() for c in df.columns]
     
@@ -100,21 +178,23 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
         available = ', '.join(df.columns[:10])  # Show first 10 columns
         raise ValueError(f"Missing required columns: {missing_cols}. Available columns: {available}...")
 
+    return df
+
+def clean_transactions(df: pd.DataFrame, payroll_keywords: List[str] = PAYROLL_KEYWORDS) -> pd.DataFrame:
+    """
+    Cleaning stages of the upload: dates, amounts, Tipo sign, competence month,
+    match columns and payroll routing. Works on the whole file or on a chunk.
+    """
+    return classify_transactions(clean_values(df), payroll_keywords)
+
+def clean_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse dates and amounts, apply the Tipo sign and derive the competence month."""
     # Data cleaning
     
-    # Robust date parsing
-    def parse_dates(date_str):
-        if pd.isna(date_str): return pd.NaT
-        date_str = str(date_str).strip()
-        formats = ['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y']
-        for fmt in formats:
-            try:
-                return pd.to_datetime(date_str, format=fmt)
-            except:
-                continue
-        return pd.NaT
-
-    df['Data de competência'] = df['Data de competência'].apply(parse_dates)
+    # Robust date parsing: one vectorized pass per date column
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_date_column(df[col])
     
     def normalize_text(s: Any) -> str:
         if pd.isna(s):
@@ -123,42 +203,12 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
         s = unicodedata.normalize("NFKD", s)
         return "".join(ch for ch in s if not unicodedata.combining(ch))
     
-    def converter_valor_br(valor_str: Any) -> float:
-        if pd.isna(valor_str) or str(valor_str).strip() == "":
-            return 0.0
-
-        s = str(valor_str).replace('R$', '').strip()
-
-        negative = False
-        # (1.234,56) accounting negative
-        if s.startswith('(') and s.endswith(')'):
-            negative = True
-            s = s[1:-1].strip()
-
-        # 1.234,56- trailing minus
-        if s.endswith('-'):
-            negative = True
-            s = s[:-1].strip()
-
-        # Remove spaces
-        s = s.replace(' ', '')
-
-        # Brazilian vs US separators
-        if ',' in s and '.' in s:
-            if s.rfind(',') > s.rfind('.'):
-                s = s.replace('.', '').replace(',', '.')
-            else:
-                s = s.replace(',', '')
-        elif ',' in s:
-            s = s.replace(',', '.')
-
-        try:
-            v = float(s)
-            return -v if negative else v
-        except ValueError:
-            return 0.0
-
-    df['Valor_Num'] = df['Valor (R$)'].apply(converter_valor_br)
+    # Amounts: one vectorized pass per monetary column ('Valor (R$)' is kept
+    # as exported, its parsed value goes to Valor_Num)
+    df['Valor_Num'] = parse_currency_column(df['Valor (R$)'])
+    for col in MONEY_COLUMNS:
+        if col != 'Valor (R$)' and col in df.columns:
+            df[col] = parse_currency_column(df[col])
 
     if 'Tipo' in df.columns:
         tipo = df['Tipo'].apply(normalize_text)
@@ -183,7 +233,7 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
         logger.info(f"Sum abs Valor_Num: {df['Valor_Num'].abs().sum():.2f}")
     else:
         logger.warning("CSV has no Tipo/Entrada-Saída column; using sign embedded in Valor (R$).")
-    df['Mes_Competencia'] = df['Data de competência'].dt.to_period('M')
+    df['Mes_Competencia'] = month_code(df['Data de competência'])
     
     # Normalize text columns for mapping
     if 'Centro de Custo 1' in df.columns:
@@ -192,38 +242,19 @@ def process_upload(file_content: bytes) -> pd.DataFrame:
         df['Nome do fornecedor/cliente'] = df['Nome do fornecedor/cliente'].astype(str).str.strip()
     if 'Categoria 1' in df.columns:
         df['Categoria 1'] = df['Categoria 1'].astype(str).str.strip()
+    return df
 
-    # Ensure payroll transactions are routed to Wages Expenses (P&L line 62)
-    payroll_keywords = [
-        'folha de pagamento', 'folha pagamento', 'folha',
-        'pro labore', 'pro-labore', 'pró labore', 'pró-labore',
-        'salario', 'salário', 'holerite',
-        'prestador de servico pj', 'payroll'
-    ]
-
-    def enforce_wages_cost_center(row):
-        current_cc = str(row.get('Centro de Custo 1', '') or '').strip()
-        cc_norm = normalize_text_helper(current_cc)
-
-        # Already correctly tagged
-        if cc_norm == 'wages expenses':
-            return 'Wages Expenses'
-
-        # Build a combined text field to search for payroll hints
-        combined_text = ' '.join([
-            normalize_text_helper(row.get('Categoria 1', '')),
-            normalize_text_helper(row.get('Descrição', '')),
-            normalize_text_helper(row.get('Nome do fornecedor/cliente', ''))
-        ])
-
-        if any(keyword in combined_text for keyword in payroll_keywords):
-            return 'Wages Expenses'
-
-        return current_cc
+def classify_transactions(df: pd.DataFrame, payroll_keywords: List[str] = PAYROLL_KEYWORDS) -> pd.DataFrame:
+    """Match columns and payroll routing of cleaned rows, in the compact schema."""
+    # Persist normalized matching keys so P&L requests start from ready-made columns
+    df = add_match_columns(df)
 
-    df['Centro de Custo 1'] = df.apply(enforce_wages_cost_center, axis=1)
+    # Ensure payroll transactions are routed to Wages Expenses (P&L line 62)
+    df['Centro de Custo 1'] = route_payroll_cost_center(df, payroll_keywords)
+    df['cc_norm'] = normalize_text_column(df['Centro de Custo 1'])
 
-    return df
+    # Compact in-memory representation (categoricals, int32 month codes)
+    return apply_schema(df)
 
 def get_initial_mappings() -> List[MappingItem]:
     """
@@ -311,6 +342,87 @@ def normalize_text_helper(s: Any) -> str:
     s = unicodedata.normalize("NFKD", s)
     return "".join(ch for ch in s if not unicodedata.combining(ch))
 
+# Normalized matching columns stored with the transaction frame
+MATCH_COLUMNS = ['cc_norm', 'supp_norm', 'desc_norm', 'match_text', 'cat_norm']
+
+def _categorical_from_lookup(codes: np.ndarray, values: List[str], index: pd.Index) -> pd.Series:
+    """Build a categorical column from per-code values (values may repeat)."""
+    value_codes, categories = pd.factorize(np.array(values, dtype=object))
+    return pd.Series(pd.Categorical.from_codes(value_codes[codes], categories=categories), index=index)
+
+def normalize_text_column(col: pd.Series) -> pd.Series:
+    """
+    Dictionary-encoded normalize_text_helper: each distinct value is normalized
+    once and broadcast back through the codes. Returns a categorical column.
+    """
+    codes, uniques = dict_encode(col)
+    return _categorical_from_lookup(codes, [normalize_text_helper(u) for u in uniques], col.index)
+
+def combine_match_text(supp_norm: pd.Series, desc_norm: pd.Series) -> pd.Series:
+    """(supplier + " " + description).strip(), evaluated once per distinct pair."""
+    supp_codes, supp_uniques = dict_encode(supp_norm)
+    desc_codes, desc_uniques = dict_encode(desc_norm)
+    pair_codes, pairs = pd.factorize(supp_codes * len(desc_uniques) + desc_codes)
+    texts = [
+        (supp_uniques[p // len(desc_uniques)] + " " + desc_uniques[p % len(desc_uniques)]).strip()
+        for p in pairs
+    ]
+    return _categorical_from_lookup(pair_codes, texts, supp_norm.index)
+
+def add_match_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the normalized matching columns (cc_norm, supp_norm, desc_norm,
+    match_text and, when 'Categoria 1' exists, cat_norm) used by the classifier.
+    """
+    df['cc_norm'] = normalize_text_column(df['Centro de Custo 1'])
+    df['supp_norm'] = normalize_text_column(df['Nome do fornecedor/cliente'])
+    if 'Descrição' in df.columns:
+        df['desc_norm'] = normalize_text_column(df['Descrição'])
+    else:
+        df['desc_norm'] = pd.Categorical([''] * len(df))
+
+    # Combined text for looser matching (Supplier + Description)
+    df['match_text'] = combine_match_text(df['supp_norm'], df['desc_norm'])
+
+    # 'Categoria 1' acts as a fallback Cost Center (if available)
+    if 'Categoria 1' in df.columns:
+        df['cat_norm'] = normalize_text_column(df['Categoria 1'])
+    return df
+
+def has_match_columns(df: pd.DataFrame) -> bool:
+    """True when the frame already carries the matching columns for its schema."""
+    expected = MATCH_COLUMNS if 'Categoria 1' in df.columns else MATCH_COLUMNS[:-1]
+    return all(col in df.columns for col in expected)
+
+def compile_keywords(keywords: List[str]) -> re.Pattern:
+    """Single alternation regex over the normalized keywords."""
+    normalized = dict.fromkeys(normalize_text_helper(k) for k in keywords)
+    return re.compile('|'.join(re.escape(k) for k in normalized))
+
+def route_payroll_cost_center(df: pd.DataFrame, keywords: List[str] = PAYROLL_KEYWORDS) -> pd.Series:
+    """
+    Return 'Centro de Custo 1' with payroll transactions moved to Wages Expenses.
+
+    A row is payroll when its normalized "category description supplier" text
+    contains any keyword. The keyword regex runs once per distinct
+    (cat_norm, desc_norm, supp_norm) combination; expects add_match_columns.
+    """
+    cost_center = df['Centro de Custo 1']
+    is_wages = (df['cc_norm'] == normalize_text_helper(WAGES_COST_CENTER)).to_numpy(dtype=bool)
+
+    if keywords and len(df) > 0:
+        parts = [
+            df['cat_norm'] if 'cat_norm' in df.columns else pd.Series('', index=df.index),
+            df['desc_norm'],
+            df['supp_norm'],
+        ]
+        key_codes, (cats, descs, supps) = encode_combinations(parts)
+        texts = pd.Series([' '.join(t) for t in zip(cats, descs, supps)], dtype=object)
+        hit = texts.str.contains(compile_keywords(keywords), regex=True).to_numpy(dtype=bool)
+        is_wages = is_wages | hit[key_codes]
+
+    return cost_center.where(~is_wages, WAGES_COST_CENTER)
+
 def prepare_mappings(mappings: List[MappingItem]):
     from collections import defaultdict
     
@@ -339,309 +451,573 @@ def calculate_pnl(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict
     """
     Calculate P&L based on dataframe and mappings.
     Optionally filter by date range.
+
+    Builds the frame's PnLCube for this one call; callers serving several
+    ranges of the same data keep the cube and query it instead.
     """
     if df is None or df.empty:
         return PnLResponse(headers=[], rows=[])
-    
-    # Apply date filter if provided
-    filtered_df = df.copy()
-    if start_date or end_date:
-        if start_date:
-            start = pd.to_datetime(start_date)
-            filtered_df = filtered_df[filtered_df['Data de competência'] >= start]
-        if end_date:
-            end = pd.to_datetime(end_date)
-            filtered_df = filtered_df[filtered_df['Data de competência'] <= end]
-
-    # Calculate months from filtered data
-    months = sorted(filtered_df['Mes_Competencia'].dropna().unique())
-    month_strs = [str(m) for m in months]
-
-    # Initialize data structure for calculations
-    # line_values[line_num][month_str] = value
-    line_values = {i: {m: 0.0 for m in month_strs} for i in range(1, 121)}
-
-    # Optimize Mapping Lookups
-    specific_mappings, generic_mappings = prepare_mappings(mappings)
-
-    # DataFrame Enhancement for Matching
-    # Ensure necessary columns exist for detailed matching
-    if 'Descrição' not in filtered_df.columns:
-        filtered_df['Descrição'] = ''
-    
-    # Create normalized columns for robust matching (without modifying original too much)
-    # We use vectorization for performance
-    filtered_df['cc_norm'] = filtered_df['Centro de Custo 1'].fillna('').apply(normalize_text_helper)
-    filtered_df['supp_norm'] = filtered_df['Nome do fornecedor/cliente'].fillna('').apply(normalize_text_helper)
-    filtered_df['desc_norm'] = filtered_df['Descrição'].fillna('').apply(normalize_text_helper)
-    
-    # Combined text for looser matching (Supplier + Description)
-    filtered_df['match_text'] = (filtered_df['supp_norm'] + " " + filtered_df['desc_norm']).str.strip()
+    return PnLCube(df, mappings).pnl(overrides, start_date, end_date)
 
-    # Iterate through DataFrame
-    for _, row in filtered_df.iterrows():
-        month = str(row['Mes_Competencia'])
-        if month not in month_strs:
-            continue
-            
-        val = row['Valor_Num']
-        cc = row['cc_norm']
-        match_text = row['match_text']
-        
-        matched_mapping = None
-        
-        # 1. Try Specific Mappings within the matching Cost Center
-        # Get candidate mappings for this Cost Center
-        candidates = specific_mappings.get(cc, [])
-        for m in candidates:
-            m_supp_norm = normalize_text_helper(m.fornecedor_cliente)
-            # Check if filtered supplier token exists in the row's supplier OR description
-            if m_supp_norm in match_text:
-                matched_mapping = m
-                break
-        
-        # 2. If no specific match, try Generic Mapping for this Cost Center
-        if not matched_mapping:
-            matched_mapping = generic_mappings.get(cc)
-        
-        # 3. Fallback: If still no match, try 'Categoria 1' as Cost Center (if available)
-        if not matched_mapping and 'Categoria 1' in row:
-            cat_cc = normalize_text_helper(row['Categoria 1'])
-            # Try specific
-            candidates_cat = specific_mappings.get(cat_cc, [])
-            for m in candidates_cat:
-                m_supp_norm = normalize_text_helper(m.fornecedor_cliente)
-                if m_supp_norm in match_text:
-                    matched_mapping = m
-                    break
-            # Try generic
-            if not matched_mapping:
-                matched_mapping = generic_mappings.get(cat_cc)
-
-        # 4. If match found, accumulate
-        if matched_mapping:
-            try:
-                line_num = int(matched_mapping.linha_pl)
-                line_values[line_num][month] += val
-                
-                # DEBUG: Log large matches
-                if abs(val) > 20000:
-                    description = matched_mapping.observacoes
-                    logger.info(f"MATCH: Line {line_num} ({description}) | Val: {val:.2f} | Basis: '{match_text}' matched '{matched_mapping.fornecedor_cliente}'")
-            except:
-                continue
-        else:
-            # Optionally log unmapped significant items
-            if abs(val) > 10000:
-                logger.debug(f"UNMAPPED: {val:.2f} | CC: {cc} | Text: {match_text}")
 
-    # ========================================================================
-    # CALCULATE DERIVED VALUES FOR EACH MONTH
-    # ========================================================================
-    
-    for m in month_strs:
-        
-        # ============================================
-        # FINANCIAL CALCULATIONS
-        # ============================================
-        
-        # 1. TOTAL REVENUE (Enforced positive)
-        google_rev = abs(line_values[25].get(m, 0.0))
-        apple_rev = abs(line_values[33].get(m, 0.0))
-        # Line 38 (Rendimentos) + Line 49 (Possible misc revenue)
-        invest_income = abs(line_values[38].get(m, 0.0)) + abs(line_values[49].get(m, 0.0))
-        
-        total_revenue = google_rev + apple_rev + invest_income
-        revenue_no_tax = google_rev + apple_rev
-        
-        # 2. PAYMENT PROCESSING (17.65%)
-        # Note: If user wants specific line items for negative adjustments (refunds),
-        # they should be mapped to an Expense line or kept in Revenue to reduce it.
-        # Current logic ABSOLUTES the revenue, so refunds (-100) become (+100).
-        # To fix this without breaking the "No Negative Revenue" rule for the Total:
-        # We should logically SUM the raw values first.
-        # But 'process_upload' already applies sign based on Tipo.
-        # If 'Devoluções' (Refunds) has Tipo='Saída', value is Negative.
-        # If we map 'Devoluções' to Line 25 (Google Revenue), it would REDUCE the sum.
-        # BUT, we are taking abs() below: `google_rev = abs(...)`.
-        # This INVALIDATES refunds if they are mapped to Revenue lines.
-        #
-        # FIX: We mapped 'Devoluções e Estornos' to Line 90 (Other Expenses) in get_initial_mappings.
-        # So Refunds are treated as Expenses. This preserves Revenue as purely Gross Sales
-        # and Refunds as an Expense line. This is safer and aligned with "No Negative Revenue".
-        
-        payment_processing_rate = 0.1765
-        payment_processing_cost = revenue_no_tax * payment_processing_rate
-        
-        # 3. COGS
-        cogs_sum = sum(abs(line_values[i].get(m, 0.0)) for i in range(43, 49))
-        
-        # 4. GROSS PROFIT
-        gross_profit = total_revenue - payment_processing_cost - cogs_sum
-        
-        # 5. OPEX
-        marketing_abs = abs(line_values[56].get(m, 0.0))
-        wages_abs = abs(line_values[62].get(m, 0.0))
-        # Tech Support: 68 + 65
-        tech_support_abs = abs(line_values[68].get(m, 0.0)) + abs(line_values[65].get(m, 0.0))
-        other_expenses_abs = abs(line_values[90].get(m, 0.0))
-        
-        sga_total = marketing_abs + wages_abs + tech_support_abs
-        total_opex = sga_total + other_expenses_abs
-        
-        # 6. EBITDA
-        ebitda = gross_profit - total_opex
-        
-        # 7. NET RESULT
-        net_result = ebitda
-        
-        # Store for Display (Revenues +, Expenses -)
-        line_values[100][m] = total_revenue
-        line_values[101][m] = revenue_no_tax
-        line_values[112][m] = google_rev
-        line_values[113][m] = apple_rev
-        line_values[102][m] = -payment_processing_cost
-        line_values[103][m] = -cogs_sum
-        line_values[104][m] = gross_profit
-        line_values[105][m] = -sga_total
-        line_values[106][m] = ebitda
-        line_values[107][m] = -marketing_abs
-        line_values[108][m] = -wages_abs
-        line_values[109][m] = -tech_support_abs
-        line_values[110][m] = -other_expenses_abs
-        line_values[111][m] = net_result
-        
-        logger.info(f"Month {m}: Rev={total_revenue:.2f}, EBITDA={ebitda:.2f}")
-
-    # APPLY OVERRIDES (Restricted to Final Lines)
-    FINAL_LINES = {100, 106, 111} # Revenue, EBITDA, Net Result
-    if overrides:
-        for line_str, months_data in overrides.items():
-            try:
-                line_num = int(line_str)
-                if line_num not in FINAL_LINES:
+class PnLCube:
+    """
+    Materialized P&L of one dataset under one mapping list: the source lines x
+    months matrix, plus each row's line, value and date for the ragged months
+    of a date range.
+
+    A date range covering whole months is answered by slicing the matrix; only
+    a month the range cuts (start or end date inside it) is summed again, from
+    its rows within the range. Sums are accumulated in row order, so any range
+    matches filtering the frame and aggregating it from scratch.
+
+    Rows are classified per distinct (cost center, match text, category) key;
+    remap() reclassifies only the keys a mapping edit affects and sums again
+    only the lines rows moved between; append() adds the rows of an append
+    upload, summing again only their months. Both recompute only the derived
+    lines depending on what changed, and both match a cube built afresh.
+    """
+
+    def __init__(self, df: pd.DataFrame, mappings: List[MappingItem]):
+        # Normalized matching columns are built at ingest (process_upload);
+        # frames from other sources get them computed here
+        if not has_match_columns(df):
+            df = add_match_columns(df.copy(deep=False))
+
+        month_col = to_month_codes(df['Mes_Competencia'])
+        self.months = np.unique(month_col[month_col != NO_MONTH])
+        self.month_strs = [month_label(m) for m in self.months]
+
+        # Classify every distinct key in one vectorized pass
+        classifier = MappingClassifier(mappings)
+        columns = [df['cc_norm'], df['match_text']] + ([df['cat_norm']] if 'cat_norm' in df.columns else [])
+        # Per key, the codes of its cost center, match text and category
+        self.key_codes, self.key_columns = encode_combination_codes(columns)
+        mapping_idx = classifier.classify_combinations(*self.key_values())[self.key_codes]
+        self.classifier = classifier
+        self.lines = classifier.line_numbers(mapping_idx).astype(np.int16)
+        # Rows of key k: key_rows[key_bounds[k]:key_bounds[k + 1]]
+        self.key_rows = np.argsort(self.key_codes, kind='stable')
+        self.key_bounds = np.concatenate([[0], np.cumsum(np.bincount(self.key_codes, minlength=len(self.key_columns[0][0])))])
+        self.values = df['Valor_Num'].to_numpy(dtype=float)
+        # Transactions per row (rows of the database are summed groups)
+        self.counts = df[COUNT_COLUMN].to_numpy(dtype=np.int64) if COUNT_COLUMN in df.columns else None
+        self.month_idx = np.searchsorted(self.months, month_col).astype(np.int64)
+        self.month_idx[month_col == NO_MONTH] = -1
+
+        # DEBUG: Log large matches / unmapped significant items
+        for i in np.flatnonzero((self.month_idx >= 0) & (self.lines > 0) & (np.abs(self.values) > 20000)):
+            m = classifier.mappings[mapping_idx[i]]
+            logger.info(f"MATCH: Line {self.lines[i]} ({m.observacoes}) | Val: {self.values[i]:.2f} | Basis: '{df['match_text'].iat[i]}' matched '{m.fornecedor_cliente}'")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i in np.flatnonzero((mapping_idx == UNMAPPED) & (np.abs(self.values) > 10000)):
+                logger.debug(f"UNMAPPED: {self.values[i]:.2f} | CC: {df['cc_norm'].iat[i]} | Text: {df['match_text'].iat[i]}")
+
+        # line_values[line_num, month_idx] = value (dense lines x months matrix)
+        self.line_values = aggregate_line_months(self.lines, self.month_idx, self.values, len(self.months))
+        # With the derived lines, before overrides: the whole-dataset P&L and
+        # the cells of an override edit start from it
+        self.derived = compute_derived_lines(self.line_values.copy())
+        self._month_pos = {m: j for j, m in enumerate(self.month_strs)}
+
+        # Rows ordered by (month, date): the rows of a month within a date
+        # range are one contiguous run of month_rows[j] (undated rows sort
+        # last and are left out: never within a range)
+        self.dates = None
+        if 'Data de competência' in df.columns:
+            self.dates = df['Data de competência'].to_numpy(dtype='datetime64[ns]')
+            self._index_months(np.lexsort((self.dates, self.month_idx)))
+
+    def _index_months(self, order: np.ndarray):
+        """Month runs of the rows in (month, date) order (rows without a month first)."""
+        self.order = order
+        self.sorted_dates = self.dates[order]
+        # Rows of month j (undated ones included): order[month_bounds[j]:month_bounds[j + 1]]
+        self.month_bounds = np.searchsorted(self.month_idx[order], np.arange(-1, len(self.months) + 1))
+        bounds = self.month_bounds[1:]
+        undated = np.add.reduceat(np.isnat(self.sorted_dates), bounds[:-1]) if len(self.months) else np.zeros(0, int)
+        self.month_rows = np.stack([bounds[:-1], bounds[1:] - undated], axis=1)
+        self.has_undated = undated > 0
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.lines, self.values, self.month_idx, self.line_values, self.derived, self.key_codes, self.key_rows]
+        if self.dates is not None:
+            arrays += [self.dates, self.order, self.sorted_dates]
+        if self.counts is not None:
+            arrays.append(self.counts)
+        return sum(a.nbytes for a in arrays)
+
+    def key_values(self, keys: np.ndarray = None) -> List[np.ndarray]:
+        """Cost center, match text (and category) strings of the given keys (all by default)."""
+        return [uniques[codes if keys is None else codes[keys]] for codes, uniques in self.key_columns]
+
+    def moved_rows(self, classifier: MappingClassifier):
+        """
+        (rows, their current lines, their lines under `classifier`) of the rows
+        another mapping list classifies differently. Only the keys of the cost
+        centers (or 'Categoria 1' values) whose rules changed are reclassified.
+        """
+        none = (np.empty(0, np.int64), np.empty(0, np.int16), np.empty(0, np.int16))
+        changed = self.classifier.changed_keys(classifier)
+        if not changed:
+            return none
+
+        def coded(column: int, values) -> np.ndarray:
+            codes, uniques = self.key_columns[column]
+            return np.array([value in values for value in uniques], dtype=bool)[codes]
+
+        affected = coded(0, changed)
+        if len(self.key_columns) > 2:
+            # The 'Categoria 1' fallback is only reached from cost centers
+            # without a generic rule
+            affected = affected | (coded(2, changed) & ~coded(0, classifier.generic.keys()))
+        keys = np.flatnonzero(affected)
+        new_lines = classifier.line_numbers(classifier.classify_combinations(*self.key_values(keys)))
+        # Rows of the reclassified keys: runs of key_rows
+        starts = self.key_bounds[keys]
+        lengths = self.key_bounds[keys + 1] - starts
+        rows = self.key_rows[np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+        old_rows_lines = self.lines[rows]
+        rows_lines = np.repeat(new_lines, lengths).astype(np.int16)
+        moved = old_rows_lines != rows_lines
+        return rows[moved], old_rows_lines[moved], rows_lines[moved]
+
+    def moved_line_values(self, rows: np.ndarray, old_lines: np.ndarray, new_lines: np.ndarray):
+        """
+        (rows' lines, matrix, lines changed) with the rows moved to
+        `new_lines`: the lines they left or joined are summed again from
+        their rows, in row order, so the matrix matches a fresh cube.
+        """
+        lines = self.lines.copy()
+        lines[rows] = new_lines
+        touched = np.union1d(old_lines, new_lines)
+        touched = touched[touched > 0]
+        line_values = self.line_values.copy()
+        if len(touched):
+            in_touched = np.zeros(N_LINES, dtype=bool)
+            in_touched[touched] = True
+            summed = np.flatnonzero(in_touched[lines])
+            sums = aggregate_line_months(lines[summed], self.month_idx[summed], self.values[summed], len(self.months))
+            line_values[touched] = sums[touched]
+        return lines, line_values, touched
+
+    def remap(self, mappings: List[MappingItem]) -> 'PnLCube':
+        """
+        The cube of the same rows under another mapping list, patched with
+        the rows that moved to another line (moved_rows). Row arrays are
+        shared with this cube.
+        """
+        classifier = MappingClassifier(mappings)
+        rows, old_lines, new_lines = self.moved_rows(classifier)
+        cube = copy.copy(self)
+        cube.classifier = classifier
+        if len(rows) == 0:
+            return cube
+
+        cube.lines, cube.line_values, touched = self.moved_line_values(rows, old_lines, new_lines)
+        cube.derived = rederive_lines(self.derived, cube.line_values, touched)
+        return cube
+
+    def append(self, df: pd.DataFrame) -> 'PnLCube':
+        """
+        The cube with the rows of `df` added after this cube's rows (rows
+        appended to the dataset). Only the new rows are classified and only
+        the months they fall in are summed again, from their rows in row
+        order: the result matches a cube built from the whole frame.
+        """
+        if df.empty:
+            return copy.copy(self)
+        if not has_match_columns(df):
+            df = add_match_columns(df.copy(deep=False))
+        n_old = len(self.values)
+        cube = copy.copy(self)
+
+        # Months: this cube's columns keep their values, at their new positions
+        month_col = to_month_codes(df['Mes_Competencia'])
+        cube.months = np.union1d(self.months, month_col[month_col != NO_MONTH])
+        cube.month_strs = [month_label(m) for m in cube.months]
+        cube._month_pos = {m: j for j, m in enumerate(cube.month_strs)}
+        moved_to = np.searchsorted(cube.months, self.months)
+        month_idx = np.searchsorted(cube.months, month_col).astype(np.int64)
+        month_idx[month_col == NO_MONTH] = -1
+        old_month_idx = self.month_idx if len(cube.months) == len(self.months) else np.append(moved_to, -1)[self.month_idx]
+        cube.month_idx = np.concatenate([old_month_idx, month_idx])
+
+        # Keys: the new rows' combinations are classified, then merged into
+        # this cube's dictionaries (combinations seen before keep their key)
+        columns = [df['cc_norm'], df['match_text']] + ([df['cat_norm']] if len(self.key_columns) > 2 else [])
+        codes, per_column = encode_combination_codes(columns)
+        key_lines = self.classifier.line_numbers(self.classifier.classify_combinations(
+            *[uniques[column_codes] for column_codes, uniques in per_column]))
+        cube.lines = np.concatenate([self.lines, key_lines[codes].astype(np.int16)])
+        cube.values = np.concatenate([self.values, df['Valor_Num'].to_numpy(dtype=float)])
+        if self.counts is not None:
+            counts = df[COUNT_COLUMN].to_numpy(dtype=np.int64) if COUNT_COLUMN in df.columns else np.ones(len(df), np.int64)
+            cube.counts = np.concatenate([self.counts, counts])
+
+        key_columns = []
+        candidates = np.ones(len(self.key_bounds) - 1, dtype=bool)  # Old keys the new rows may share
+        for (old_codes, old_uniques), (new_codes, new_uniques) in zip(self.key_columns, per_column):
+            # Position of each new value among the old ones (first occurrence);
+            # "" may be in the uniques twice (dict_encode)
+            distinct = pd.Index(new_uniques).unique()
+            hits = distinct.get_indexer(old_uniques)
+            at = np.flatnonzero(hits >= 0)
+            values, first = np.unique(hits[at], return_index=True)
+            position = np.full(len(distinct), -1, dtype=np.int64)
+            position[values] = at[first]
+            found = position >= 0
+            position[~found] = len(old_uniques) + np.arange((~found).sum())
+            uniques = np.concatenate([old_uniques, distinct.to_numpy(dtype=object)[~found]])
+            position = position[distinct.get_indexer(new_uniques)]
+            key_columns.append((old_codes, position[new_codes], uniques))
+            present = np.zeros(len(uniques), dtype=bool)
+            present[position] = True
+            candidates &= present[old_codes]
+        candidates = np.flatnonzero(candidates)
+        old_combined, new_combined = 0, 0
+        for old_codes, new_codes, uniques in key_columns:
+            old_combined = old_combined * len(uniques) + old_codes[candidates]
+            new_combined = new_combined * len(uniques) + new_codes
+        key_map = pd.Index(old_combined).get_indexer(new_combined)
+        unseen = key_map < 0
+        key_map[~unseen] = candidates[key_map[~unseen]]
+        n_old_keys = len(self.key_bounds) - 1
+        key_map[unseen] = n_old_keys + np.arange(unseen.sum())
+        cube.key_columns = [
+            (np.concatenate([old_codes, new_codes[unseen]]), uniques) for old_codes, new_codes, uniques in key_columns
+        ]
+        new_keys = key_map[codes]
+        cube.key_codes = np.concatenate([self.key_codes, new_keys])
+        # Rows of each key: its rows in this cube, then its new ones
+        n_keys = n_old_keys + int(unseen.sum())
+        old_counts = np.bincount(self.key_codes, minlength=n_keys)
+        new_counts = np.bincount(new_keys, minlength=n_keys)
+        cube.key_bounds = np.concatenate([[0], np.cumsum(old_counts + new_counts)])
+        cube.key_rows = np.empty(n_old + len(df), dtype=self.key_rows.dtype)
+        old_keys = np.repeat(np.arange(n_keys), old_counts)
+        cube.key_rows[cube.key_bounds[old_keys] + np.arange(n_old) - self.key_bounds[old_keys]] = self.key_rows
+        by_key = np.argsort(new_keys, kind='stable')
+        sorted_keys = new_keys[by_key]
+        new_bounds = np.concatenate([[0], np.cumsum(new_counts)])
+        rank = np.arange(len(df)) - new_bounds[sorted_keys]
+        cube.key_rows[cube.key_bounds[sorted_keys] + old_counts[sorted_keys] + rank] = n_old + by_key
+
+        # Matrix: the months with new rows are summed again from all their rows
+        cube.line_values = np.zeros((N_LINES, len(cube.months)))
+        cube.line_values[:, moved_to] = self.line_values
+        touched = np.unique(month_idx[month_idx >= 0])
+        if len(touched):
+            column = np.full(len(cube.months) + 1, -1, dtype=np.int64)
+            column[touched] = np.arange(len(touched))
+            rows = np.flatnonzero(column[cube.month_idx] >= 0)
+            cube.line_values[:, touched] = aggregate_line_months(
+                cube.lines[rows], column[cube.month_idx[rows]], cube.values[rows], len(touched))
+        # Derived lines: months without new rows keep theirs
+        cube.derived = np.zeros_like(cube.line_values)
+        cube.derived[:, moved_to] = self.derived
+        cube.derived[:, touched] = compute_derived_lines(cube.line_values[:, touched].copy())
+
+        if self.dates is not None and 'Data de competência' in df.columns:
+            dates = df['Data de competência'].to_numpy(dtype='datetime64[ns]')
+            cube.dates = np.concatenate([self.dates, dates])
+            new_order = np.lexsort((dates, month_idx))
+            new_bounds = np.searchsorted(month_idx[new_order], np.arange(-1, len(cube.months) + 1))
+            was = np.full(len(cube.months) + 1, -1, dtype=np.int64)  # New month position -> old one
+            was[moved_to] = np.arange(len(self.months))
+            runs = []
+            for j in range(-1, len(cube.months)):
+                old = self.order[self.month_bounds[was[j] + 1]:self.month_bounds[was[j] + 2]] if j < 0 or was[j] >= 0 else None
+                new = n_old + new_order[new_bounds[j + 1]:new_bounds[j + 2]]
+                if old is None or not len(new):
+                    runs.append(new if old is None else old)
                     continue
-                for m, val in months_data.items():
-                    if m in month_strs:
-                        line_values[line_num][m] = val
-            except:
+                run = np.concatenate([old, new])
+                # Stable: on equal dates, rows stay in row order
+                runs.append(run[np.argsort(cube.dates[run], kind='stable')])
+            cube._index_months(np.concatenate(runs))
+        else:
+            cube.dates = None
+        return cube
+
+    def preview(self, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None) -> MappingPreview:
+        """
+        P&L impact of another mapping list, without building its cube: the
+        display cells that change and the rows moving between lines.
+        """
+        rows, old_lines, new_lines = self.moved_rows(MappingClassifier(mappings))
+        dated = self.month_idx[rows] >= 0  # Rows without a month are not in the P&L
+        rows, old_lines, new_lines = rows[dated], old_lines[dated], new_lines[dated]
+
+        before = self.derived.copy()
+        _, line_values, touched = self.moved_line_values(rows, old_lines, new_lines)
+        after = rederive_lines(self.derived, line_values, touched)
+        for line_values in (before, after):
+            apply_overrides(line_values, self.month_strs, overrides)
+        cells = []
+        for (row, old), (_, new) in zip(PNL_GRAPH.display_values(before), PNL_GRAPH.display_values(after)):
+            for j in np.flatnonzero(~np.isclose(new, old, rtol=0, atol=PREVIEW_TOLERANCE)):
+                cells.append(PnLDelta(line_number=row.line_number, description=row.description, month=self.month_strs[j],
+                                      before=float(old[j]), after=float(new[j]), delta=float(new[j] - old[j])))
+
+        # Rows and amount per (from line, to line); line 0: unmapped
+        counts = self.counts[rows] if self.counts is not None else np.ones(len(rows), np.int64)
+        pairs, inverse = np.unique(old_lines.astype(np.int64) * N_LINES + new_lines, return_inverse=True)
+        n_rows = np.bincount(inverse, weights=counts, minlength=len(pairs))
+        amounts = np.bincount(inverse, weights=np.nan_to_num(self.values[rows]), minlength=len(pairs))
+        moves = sorted(
+            (LineMove(from_line=int(pair // N_LINES), to_line=int(pair % N_LINES), rows=int(n), amount=float(v))
+             for pair, n, v in zip(pairs, n_rows, amounts)),
+            key=lambda move: -abs(move.amount),
+        )
+        return MappingPreview(
+            cells=cells,
+            moves=moves,
+            rows_moved=int(counts.sum()),
+            amount_moved=float(sum(abs(move.amount) for move in moves)),
+        )
+
+    def line_values_between(self, start_date: str = None, end_date: str = None):
+        """(source lines x months matrix, month labels) of the rows within the date range."""
+        if not (start_date or end_date):
+            return self.line_values.copy(), list(self.month_strs)
+        if self.dates is None:
+            raise ValueError("Date range requested from transactions without a competence date")
+
+        start = np.datetime64(pd.to_datetime(start_date), 'ns') if start_date else None
+        end = np.datetime64(pd.to_datetime(end_date), 'ns') if end_date else None
+        columns, month_strs = [], []
+        for j, (a, b) in enumerate(self.month_rows):
+            if a == b:
+                continue  # Only undated rows: never within a range
+            first, last = self.sorted_dates[a], self.sorted_dates[b - 1]
+            if (start is not None and last < start) or (end is not None and first > end):
                 continue
+            if self.has_undated[j] or (start is not None and first < start) or (end is not None and last > end):
+                # Ragged month: sum its rows within the range, in row order
+                lo = a if start is None else a + np.searchsorted(self.sorted_dates[a:b], start, side='left')
+                hi = b if end is None else a + np.searchsorted(self.sorted_dates[a:b], end, side='right')
+                if lo == hi:
+                    continue
+                rows = np.sort(self.order[lo:hi])
+                columns.append(aggregate_line_months(self.lines[rows], np.zeros(len(rows), np.int64), self.values[rows], 1)[:, 0])
+            else:
+                columns.append(self.line_values[:, j])
+            month_strs.append(self.month_strs[j])
+        if not columns:
+            return np.zeros((N_LINES, 0)), []
+        return np.stack(columns, axis=1), month_strs
 
-    # Build P&L Rows
-    rows = []
-    
-    def add_row(line_num, desc, val_dict, is_header=False, is_total=False):
-        # Check for override on this specific line (even if not in FINAL_LINES, to display user intent if blocked?)
-        # For safety as requested, we strictly rely on the calc above, 
-        # but if we want to show the overridden value we must read from line_values which we updated above.
-        
-        rows.append(PnLItem(
-            line_number=line_num,
-            description=desc,
-            values=val_dict,
-            is_header=is_header,
-            is_total=is_total
-        ))
-
-    add_row(1, "RECEITA OPERACIONAL BRUTA", line_values[100], is_header=True)
-    add_row(2, "Receita de Vendas (Google + Apple)", line_values[101])
-    add_row(21, "Google Play Revenue", line_values[112])
-    add_row(22, "App Store Revenue", line_values[113])
-    add_row(3, "Rendimentos de Aplicações", line_values[38])
-    
-    add_row(4, "(-) CUSTOS DIRETOS", {m: line_values[102][m] + line_values[103][m] for m in month_strs}, is_header=True)
-    add_row(5, "Payment Processing (17.65%)", line_values[102])
-    add_row(6, "COGS (Web Services)", line_values[103])
-    
-    add_row(7, "(=) LUCRO BRUTO", line_values[104], is_total=True)
-    
-    add_row(8, "(-) DESPESAS OPERACIONAIS", {m: line_values[105][m] + line_values[110][m] for m in month_strs}, is_header=True)
-    add_row(9, "Marketing", line_values[107])
-    add_row(10, "Salários (Wages)", line_values[108])
-    add_row(11, "Tech Support & Services", line_values[109])
-    add_row(12, "Outras Despesas", line_values[110])
-    
-    add_row(13, "(=) EBITDA", line_values[106], is_total=True)
-    add_row(16, "(=) RESULTADO LÍQUIDO", line_values[111], is_total=True)
-    
-    # Margins
-    ebitda_margins = {}
-    gross_margins = {}
-    for m in month_strs:
-        rev = line_values[100][m]
-        if rev and rev != 0:
-            ebitda_margins[m] = (line_values[106][m] / rev) * 100
-            gross_margins[m] = (line_values[104][m] / rev) * 100
+    def pnl(self, overrides: Dict[str, Dict[str, float]] = None, start_date: str = None, end_date: str = None) -> PnLResponse:
+        """P&L of the rows within the date range, with the user overrides."""
+        return build_pnl_response(*self.evaluate(overrides, start_date, end_date))
+
+    def evaluate(self, overrides: Dict[str, Dict[str, float]] = None, start_date: str = None, end_date: str = None):
+        """(lines x months matrix with the derived lines and overrides, month labels) of the date range."""
+        if start_date or end_date:
+            line_values, month_strs = self.line_values_between(start_date, end_date)
+
+            # ====================================================================
+            # CALCULATE DERIVED VALUES FOR ALL MONTHS AT ONCE
+            # ====================================================================
+            compute_derived_lines(line_values)
         else:
-            ebitda_margins[m] = 0.0
-            gross_margins[m] = 0.0
-            
-    add_row(14, "Margem EBITDA %", ebitda_margins)
-    add_row(15, "Margem Bruta %", gross_margins)
+            line_values, month_strs = self.derived.copy(), list(self.month_strs)
+
+        for j, m in enumerate(month_strs):
+            logger.info(f"Month {m}: Rev={line_values[100, j]:.2f}, EBITDA={line_values[106, j]:.2f}")
+
+        # APPLY OVERRIDES (Restricted to Final Lines)
+        apply_overrides(line_values, month_strs, overrides)
+        return line_values, month_strs
+
+    def month_cells(self, month: str, overrides: Dict[str, Dict[str, float]], lines: List[int]):
+        """
+        (cells, validation alerts) of one month after an override of the
+        matrix `lines`: the display cells the override changes and all the
+        month's alerts, evaluated on that month's column alone.
+        """
+        j = self._month_pos.get(month)
+        if j is None:
+            return [], []
+        column = self.derived[:, j:j + 1].copy()
+        apply_overrides(column, [month], overrides)
+        pnl = build_pnl_response(column, [month])
+        changed = PNL_GRAPH.override_rows(line for line in lines if line in FINAL_LINES)
+        cells = [
+            PnLCell(line_number=row.line_number, month=month, value=row.values[month])
+            for row in pnl.rows if row.line_number in changed
+        ]
+        return cells, pnl.validation_alerts or []
+
+
+def month_codes_for(month_col: pd.Series, month_strs: List[str]) -> np.ndarray:
+    """Position of each row's month in month_strs (-1 for missing/unknown months)."""
+    # Stringify only the distinct months, then broadcast through the codes
+    codes, uniques = pd.factorize(month_col)
+    position = {m: j for j, m in enumerate(month_strs)}
+    lookup = np.array([position.get(str(u), -1) for u in uniques] + [-1], dtype=np.int64)
+    return lookup[codes]
+
+
+def aggregate_line_months(lines: np.ndarray, month_codes: np.ndarray, values: np.ndarray, n_months: int) -> np.ndarray:
+    """
+    Grouped sum of transaction values into a dense (N_LINES x n_months) matrix.
+
+    Rows with line 0 (unmapped) or month code -1 are ignored; NaN values count as 0.
+    """
+    keep = (lines > 0) & (month_codes >= 0)
+    flat = lines[keep] * n_months + month_codes[keep]
+    weights = np.nan_to_num(values[keep])
+    sums = np.bincount(flat, weights=weights, minlength=N_LINES * n_months)
+    return sums.reshape(N_LINES, n_months)
+
+
+def compute_derived_lines(line_values: np.ndarray) -> np.ndarray:
+    """
+    Fill the derived lines 100-113 (revenue, payment processing, gross profit,
+    EBITDA, ...) as whole-column array expressions over every month, as
+    declared in the P&L graph (pnl_graph.py).
+    """
+    PNL_GRAPH.evaluate(line_values)
+    return line_values
+
+
+def rederive_lines(derived: np.ndarray, line_values: np.ndarray, lines: np.ndarray) -> np.ndarray:
+    """
+    Copy of a matrix with its derived lines (compute_derived_lines) after the
+    source `lines` of line_values changed: only the nodes depending on them
+    are computed again.
+    """
+    derived = derived.copy()
+    derived[lines] = line_values[lines]
+    PNL_GRAPH.evaluate(derived, changed=[int(line) for line in lines])
+    return derived
+
+
+def apply_overrides(line_values: np.ndarray, month_strs: List[str], overrides: Dict[str, Dict[str, float]] = None) -> None:
+    """Write user overrides into the matrix (only FINAL_LINES can be overridden)."""
+    if not overrides:
+        return
+    month_pos = {m: j for j, m in enumerate(month_strs)}
+    for line_str, months_data in overrides.items():
+        try:
+            line_num = int(line_str)
+            if line_num not in FINAL_LINES:
+                continue
+            for m, val in months_data.items():
+                if m in month_pos:
+                    line_values[line_num, month_pos[m]] = val
+        except:
+            continue
+
+
+def override_line(line_number: int) -> int:
+    """
+    Matrix line an override of `line_number` is stored on: the P&L display
+    rows of the overridable lines (as PnLTable sends them) resolve to their
+    line; any other number is kept as given.
+    """
+    line = PNL_GRAPH.node_line(line_number)
+    return line if line in FINAL_LINES else line_number
+
+
+def patch_pnl(pnl: PnLResponse, month: str, cells: List[PnLCell], alerts: List[ValidationAlert]) -> PnLResponse:
+    """Copy of a P&L with one month's cells and validation alerts replaced (PnLCube.month_cells)."""
+    values = {cell.line_number: cell.value for cell in cells}
+    rows = [
+        row.model_copy(update={"values": {**row.values, month: values[row.line_number]}})
+        if row.line_number in values else row
+        for row in pnl.rows
+    ]
+    position = {m: j for j, m in enumerate(pnl.headers)}
+    # Stable sort: alerts stay in month order, then check order
+    merged = sorted([a for a in pnl.validation_alerts or [] if a.month != month] + list(alerts),
+                    key=lambda a: position[a.month])
+    return PnLResponse(headers=pnl.headers, rows=rows, validation_alerts=merged or None)
+
+
+def build_pnl_response(line_values: np.ndarray, month_strs: List[str]) -> PnLResponse:
+    """Turn the lines x months matrix into the P&L display rows and validation alerts."""
+    rows = [
+        PnLItem(
+            line_number=row.line_number,
+            description=row.description,
+            values=dict(zip(month_strs, vals.tolist())),
+            is_header=row.is_header,
+            is_total=row.is_total,
+            editable=PNL_GRAPH.node_line(row.line_number) in FINAL_LINES
+        )
+        for row, vals in PNL_GRAPH.display_values(line_values)
+    ]
 
     # ========================================================================
     # MATHEMATICAL VALIDATION
     # ========================================================================
     validation_alerts = []
-    
-    for m in month_strs:
-        # Get values for validation
-        revenue = line_values[100].get(m, 0.0)
-        payment_proc = abs(line_values[102].get(m, 0.0))
-        cogs = abs(line_values[103].get(m, 0.0))
-        gross_profit_actual = line_values[104].get(m, 0.0)
-        
-        # Calculate expected Gross Profit
-        # Lucro Bruto = Receita Operacional Bruta - Payment Processing - COGS
-        expected_gross_profit = revenue - payment_proc - cogs
-        
-        # Check if there's a discrepancy (tolerance of R$ 0.01)
-        if abs(gross_profit_actual - expected_gross_profit) > 0.01:
-            validation_alerts.append(ValidationAlert(
-                month=m,
-                field="Lucro Bruto",
-                expected=round(expected_gross_profit, 2),
-                actual=round(gross_profit_actual, 2),
-                message=f"Lucro Bruto incorreto (esperado: R$ {expected_gross_profit:,.3f}, atual: R$ {gross_profit_actual:,.3f})"
-            ))
-        
-        # Validate EBITDA
-        marketing = abs(line_values[107].get(m, 0.0))
-        wages = abs(line_values[108].get(m, 0.0))
-        tech = abs(line_values[109].get(m, 0.0))
-        other = abs(line_values[110].get(m, 0.0))
-        total_opex = marketing + wages + tech + other
-        
-        ebitda_actual = line_values[106].get(m, 0.0)
-        expected_ebitda = gross_profit_actual - total_opex
-        
-        if abs(ebitda_actual - expected_ebitda) > 0.01:
+    value = PNL_GRAPH.reader(line_values, {})
+    checks = [(check, *PNL_GRAPH.check_values(value, check)) for check in PNL_GRAPH.checks if check.in_pnl]
+    # Check if there's a discrepancy (tolerance of R$ 0.01)
+    bad = [np.abs(actual - expected) > TOLERANCE for _, expected, actual in checks]
+
+    for j in np.flatnonzero(np.logical_or.reduce(bad)) if bad else []:
+        for (check, expected_values, actual_values), check_bad in zip(checks, bad):
+            if not check_bad[j]:
+                continue
+            expected, actual = float(expected_values[j]), float(actual_values[j])
             validation_alerts.append(ValidationAlert(
-                month=m,
-                field="EBITDA",
-                expected=round(expected_ebitda, 2),
-                actual=round(ebitda_actual, 2),
-                message=f"EBITDA incorreto (esperado: R$ {expected_ebitda:,.3f}, atual: R$ {ebitda_actual:,.3f})"
+                month=month_strs[j],
+                field=check.field,
+                expected=round(expected, 2),
+                actual=round(actual, 2),
+                message=f"{check.field} incorreto (esperado: R$ {expected:,.3f}, atual: R$ {actual:,.3f})"
             ))
 
     return PnLResponse(headers=month_strs, rows=rows, validation_alerts=validation_alerts if validation_alerts else None)
-def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None) -> DashboardData:
+
+
+# Dashboard cards: P&L graph nodes
+KPI_NODES = ['total_revenue', 'gross_profit', 'ebitda', 'net_result', 'ebitda_margin', 'gross_margin']
+COST_STRUCTURE_NODES = {
+    "payment_processing": 'payment_processing',
+    "cogs": 'cogs',
+    "marketing": 'marketing',
+    "wages": 'wages',
+    "tech": 'tech_support',
+    "other": 'other_expenses',
+}
+
+def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, pnl: PnLResponse = None, line_values: np.ndarray = None) -> DashboardData:
+    """
+    Build dashboard KPIs and charts.
+    Pass an already computed (e.g. cached) P&L as `pnl` to avoid recomputing it,
+    with the matrix it was built from (PnLCube.evaluate) as `line_values` for
+    the formula breakdowns.
+    """
     if df is None:
         return DashboardData(kpis={}, monthly_data=[], cost_structure={})
         
-    pnl = calculate_pnl(df, mappings, overrides)
+    if pnl is None and not df.empty:
+        line_values, month_strs = PnLCube(df, mappings).evaluate(overrides)
+        pnl = build_pnl_response(line_values, month_strs)
+    elif pnl is None:
+        pnl = calculate_pnl(df, mappings, overrides)
     
     # Extract latest month data
     if not pnl.headers:
         return DashboardData(kpis={}, monthly_data=[], cost_structure={})
         
+    # Display row of each P&L graph node
+    row_of = {row.node: row.line_number for row in PNL_GRAPH.rows}
+
     # Find the latest month with non-zero revenue
     latest_month = pnl.headers[-1]
     for m in reversed(pnl.headers):
         # Check revenue for this month (Line 1 is Gross Revenue)
         rev = 0
         for row in pnl.rows:
-            if row.line_number == 1: # RECEITA OPERACIONAL BRUTA
+            if row.line_number == row_of['total_revenue']:
                 rev = row.values.get(m, 0)
                 break
         
@@ -672,15 +1048,15 @@ def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides:
     
     # Iterate through all months to sum up values
     for m in pnl.headers:
-        total_revenue += get_val_by_line(1, m)       # RECEITA OPERACIONAL BRUTA
-        total_ebitda += get_val_by_line(13, m)       # EBITDA
-        total_gross_profit += get_val_by_line(7, m)  # LUCRO BRUTO
-        total_google += get_val_by_line(21, m)
-        total_apple += get_val_by_line(22, m)
+        total_revenue += get_val_by_line(row_of['total_revenue'], m)
+        total_ebitda += get_val_by_line(row_of['ebitda'], m)
+        total_gross_profit += get_val_by_line(row_of['gross_profit'], m)
+        total_google += get_val_by_line(row_of['google_revenue'], m)
+        total_apple += get_val_by_line(row_of['apple_revenue'], m)
     
     total_net_result = 0.0
     for m in pnl.headers:
-        total_net_result += get_val_by_line(16, m)      # (=) RESULTADO LÍQUIDO
+        total_net_result += get_val_by_line(row_of['net_result'], m)
     
     # Avoid division by zero
     ebitda_margin = (total_ebitda / total_revenue) if total_revenue > 0 else 0.0
@@ -703,12 +1079,12 @@ def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides:
     monthly_data = []
     for m in pnl.headers:
         # Get values for this month
-        month_revenue = get_val_by_line(1, m)
-        month_ebitda = get_val_by_line(13, m)
+        month_revenue = get_val_by_line(row_of['total_revenue'], m)
+        month_ebitda = get_val_by_line(row_of['ebitda'], m)
         
         # Costs and expenses are stored as negative, convert to positive for charts
-        month_cogs = abs(get_val_by_line(4, m))  # (-) CUSTOS DIRETOS total
-        month_opex = abs(get_val_by_line(8, m))  # (-) DESPESAS OPERACIONAIS total
+        month_cogs = abs(get_val_by_line(row_of['direct_costs'], m))
+        month_opex = abs(get_val_by_line(row_of['operating_expenses'], m))
         
         monthly_data.append({
             "month": m,
@@ -720,26 +1096,35 @@ def get_dashboard_data(df: pd.DataFrame, mappings: List[MappingItem], overrides:
         
     # Cost Structure (Latest Month) - all as positive values
     cost_structure = {
-        "payment_processing": abs(get_val_by_line(5, latest_month)),  # Payment Processing
-        "cogs": abs(get_val_by_line(6, latest_month)),  # COGS (Web Services)
-        "marketing": abs(get_val_by_line(9, latest_month)),  # Marketing
-        "wages": abs(get_val_by_line(10, latest_month)),  # Salários
-        "tech": abs(get_val_by_line(11, latest_month)),  # Tech Support
-        "other": abs(get_val_by_line(12, latest_month))  # Outras Despesas
+        name: abs(get_val_by_line(row_of[node], latest_month))
+        for name, node in COST_STRUCTURE_NODES.items()
     }
-    
-    
-    return DashboardData(kpis=kpis, monthly_data=monthly_data, cost_structure=cost_structure)
 
-def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, months_ahead: int = 3) -> Dict[str, Any]:
+    # Formula breakdowns, from the P&L graph: KPIs over every month,
+    # cost structure for the latest month
+    formulas = {}
+    if line_values is not None:
+        kpi_values = PNL_GRAPH.reader(line_values, {})
+        latest = pnl.headers.index(latest_month)
+        latest_values = PNL_GRAPH.reader(line_values[:, latest:latest + 1], {})
+        for node in KPI_NODES:
+            formulas[node] = PNL_GRAPH.formula(node, kpi_values)
+        for node in COST_STRUCTURE_NODES.values():
+            formulas[node] = PNL_GRAPH.formula(node, latest_values)
+
+    return DashboardData(kpis=kpis, monthly_data=monthly_data, cost_structure=cost_structure, formulas=formulas)
+
+def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides: Dict[str, Dict[str, float]] = None, months_ahead: int = 3, pnl: PnLResponse = None) -> Dict[str, Any]:
     """
     Predict future financial metrics (Revenue, EBITDA) using Linear Regression.
+    Pass an already computed (e.g. cached) P&L as `pnl` to avoid recomputing it.
     """
     if df is None:
         return {"forecast": []}
 
     # Get historical data
-    pnl = calculate_pnl(df, mappings, overrides)
+    if pnl is None:
+        pnl = calculate_pnl(df, mappings, overrides)
     
     if not pnl.headers:
         return {"forecast": []}
@@ -762,8 +1147,8 @@ def calculate_forecast(df: pd.DataFrame, mappings: List[MappingItem], overrides:
             series.append(val)
         return series
 
-    revenue_series = get_line_series(1) # Revenue
-    ebitda_series = get_line_series(13) # EBITDA
+    revenue_series = get_line_series(PNL_GRAPH.row_number('total_revenue'))
+    ebitda_series = get_line_series(PNL_GRAPH.row_number('ebitda'))
     
     # Ensure sufficient data points (at least 3 months for a trend)
     if len(months_str) < 3:
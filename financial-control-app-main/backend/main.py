@@ -3,16 +3,28 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import List
 import pandas as pd
-from models import MappingItem, MappingUpdate, DashboardData, PnLResponse
-from logic import process_upload, get_initial_mappings, calculate_pnl, get_dashboard_data, calculate_forecast
+from models import MappingItem, MappingPreview, MappingUpdate, DashboardData, PnLResponse, PnLCellsUpdate
+from logic import PnLCube, get_initial_mappings, calculate_pnl, get_dashboard_data, calculate_forecast, add_match_columns, has_match_columns, override_line, patch_pnl
 from ai_service import generate_insights
+from pnl_cache import PnLCache, CacheKey, hash_mappings, hash_overrides
+from warmup import CacheWarmer
+from app_state import AppState, StateHolder
+from journal import ChangeJournal
+from snapshot import SnapshotStore
+from sqlite_store import SqliteStore
+from upload_jobs import APPEND_FILE, UPLOAD_MODES, UploadJobs
+from store import concat_frames, read_frame, read_manifest, read_pickled_frame, read_segments, write_frame, write_json
+from dedup import fingerprint_frame
+from schema import ANALYSIS_COLUMNS, FREE_TEXT_COLUMNS, apply_schema, memory_report, month_label, parse_month_label, split_free_text
+from starlette.concurrency import run_in_threadpool
 from auth import Token, create_access_token, get_current_user, USERS_DB, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
 from dotenv import load_dotenv
 
 import os
 import json
-import pickle
+import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -67,73 +79,324 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 # Data persistence configuration
 DATA_DIR = Path("./data")
 DATA_DIR.mkdir(exist_ok=True)
-CSV_PATH = DATA_DIR / "current_data.pkl"
+SNAPSHOTS_DIR = DATA_DIR / "snapshots"  # Versioned transaction store, shared by the workers
+DATA_FILE = "current_data.arrow"
+TEXT_FILE = "current_text.arrow"  # Free-text columns, loaded on demand
+UNVERSIONED_CSV_PATH = DATA_DIR / DATA_FILE  # Single-file store, before snapshots
+UNVERSIONED_TEXT_PATH = DATA_DIR / TEXT_FILE
+LEGACY_CSV_PATH = DATA_DIR / "current_data.pkl"  # Pickle store of older versions
+LEGACY_TEXT_PATH = DATA_DIR / "current_text.pkl"
 MAPPINGS_PATH = DATA_DIR / "mappings.json"
 OVERRIDES_PATH = DATA_DIR / "overrides.json"
 METADATA_PATH = DATA_DIR / "metadata.json"
+JOURNAL_PATH = DATA_DIR / "changes.jsonl"  # Mapping/override edits since the last snapshot
+JOURNAL_HISTORY_DIR = DATA_DIR / "changes"  # Compacted journal segments (audit history)
+JOBS_DIR = DATA_DIR / "jobs"  # Upload job status files (and the uploads waiting for a job)
+UPLOAD_CACHE_DIR = DATA_DIR / "upload_cache"  # Processed uploads by content hash
+
+# Optional SQLite backend: transactions, mappings and overrides in one local
+# database (indexed P&L aggregation and drill-down) instead of the files above
+SQLITE_PATH = os.getenv("SQLITE_PATH")
+db = SqliteStore(Path(SQLITE_PATH)) if SQLITE_PATH else None
+
+# Uploads publish a new immutable snapshot; every worker reopens it when the
+# published version changes (see sync_state)
+snapshots = SnapshotStore(SNAPSHOTS_DIR)
+
+# Uploads are ingested by background jobs in a separate process; identical
+# files are served from the upload cache (file store only: the database
+# holds a single copy of the transactions)
+upload_jobs = UploadJobs(JOBS_DIR, SNAPSHOTS_DIR, DATA_FILE, TEXT_FILE, sqlite_path=db.path if db is not None else None,
+                         max_workers=int(os.getenv("UPLOAD_WORKERS", "1")),
+                         cache_root=UPLOAD_CACHE_DIR if db is None else None)
+
+# State (with persistence): frame, mappings and overrides, swapped as a whole
+# on every change. Requests read app_state.get() once and use only that state.
+app_state = StateHolder(AppState.initial())
+reload_lock = threading.Lock()  # One snapshot reload at a time
+
+# Shared P&L result cache, keyed on (data version, mappings hash, overrides hash, params)
+pnl_cache = PnLCache(max_bytes=int(os.getenv("PNL_CACHE_MB", "256")) * 1024 * 1024)
+DEFAULT_FORECAST_MONTHS = 3
+
+def cache_key(state: AppState, kind: str, *params) -> CacheKey:
+    return CacheKey(kind, state.data_version, hash_mappings(state.mappings), hash_overrides(state.overrides), params)
+
+def range_excludes(key: CacheKey, months) -> bool:
+    """Whether a cached P&L's date range lies outside all of `months` (codes)"""
+    if key.kind != "pnl" or not key.params or not all(key.params):
+        return False
+    start, end = (parse_month_label(pd.to_datetime(date).to_period("M")) for date in key.params)
+    return not any(start <= m <= end for m in months)
+
+def replace_frame(df, snapshot_version: int, segments=(), changed_months=None, appended=None) -> AppState:
+    """
+    Swap in a new dataset and invalidate everything computed from the previous
+    one; with `changed_months` (rows appended), P&Ls of date ranges outside
+    them are kept, and with the `appended` rows the cached cube is extended
+    with them instead of being rebuilt
+    """
+    previous = app_state.get()
+    cube_key = CacheKey("cube", previous.data_version, hash_mappings(previous.mappings), "")
+    base = pnl_cache.get(cube_key) if appended is not None else None
+    cube = base.append(appended) if base is not None else None
+    state = app_state.update(lambda s: s.with_frame(df, snapshot_version, segments))
+    if changed_months is None:
+        pnl_cache.invalidate(data_version=state.data_version - 1)
+        return state
+    if cube is not None and state.data_version == previous.data_version + 1:
+        # Under the mappings the state still has (else never looked up)
+        pnl_cache.put(cube_key._replace(data_version=state.data_version), cube)
+    pnl_cache.carry_over(state.data_version - 1, state.data_version, lambda key: range_excludes(key, changed_months))
+    return state
+
+def current_state() -> AppState:
+    """The state a request is served from (loaded from disk if no data is in memory)"""
+    state = app_state.get()
+    if state.df is None:
+        print("⚠️ Data missing in memory, attempting lazy load...")
+        load_data()
+        state = app_state.get()
+    return state
+
+def compute_pnl(state: AppState, start_date: str = None, end_date: str = None):
+    if db is not None and (start_date or end_date):
+        # Summed per matching keys and month in SQL, classified here
+        return calculate_pnl(db.pnl_groups(start_date, end_date), state.mappings, state.overrides)
+    if state.df is None or state.df.empty:
+        return calculate_pnl(state.df, state.mappings, state.overrides)
+    # Sliced from the dataset's cube: only months the range cuts are summed
+    return get_cached_cube(state).pnl(state.overrides, start_date, end_date)
+
+def get_cached_cube(state: AppState) -> PnLCube:
+    """
+    Lines x months cube of the state's data and mappings (overrides are
+    applied per query). From the database, built on the per-month groups:
+    whole-dataset queries only, date ranges are summed in SQL.
+    """
+    return pnl_cache.get_or_compute(
+        CacheKey("cube", state.data_version, hash_mappings(state.mappings), ""),
+        lambda: build_cube(state)
+    )
+
+def build_cube(state: AppState) -> PnLCube:
+    """The cube of the state; after a mapping edit, remapped from a cube of the same data"""
+    base = pnl_cache.find(lambda key: key.kind == "cube" and key.data_version == state.data_version)
+    if base is not None:
+        return base.remap(list(state.mappings))
+    return PnLCube(db.pnl_groups() if db is not None else state.df, state.mappings)
+
+def remap_cube(state: AppState):
+    """
+    Build the cube of edited mappings from the cached one before the entries
+    of the previous mappings are dropped
+    """
+    if state.df is not None and not state.df.empty:
+        get_cached_cube(state)
+
+def get_cached_pnl(state: AppState, start_date: str = None, end_date: str = None):
+    """P&L for the state, computed at most once per state and date range"""
+    return pnl_cache.get_or_compute(
+        cache_key(state, "pnl", start_date, end_date),
+        lambda: compute_pnl(state, start_date, end_date)
+    )
 
-# State (with persistence)
-current_df = None
-current_mappings = get_initial_mappings()
-current_overrides = {} # Format: {"line_num": {"month": value}}
+def load_free_text(state: AppState, index: pd.Index, months=None) -> pd.DataFrame:
+    """Free-text columns of the given rows of the state's frame (of `months`), read from disk on demand"""
+    directory = snapshots.directory(state.snapshot_version)
+    files = [s.text for s in state.segments if (directory / s.text).exists()]
+    if not files:
+        return pd.DataFrame(index=index)
+    return read_segments(directory, files, columns=FREE_TEXT_COLUMNS, months=months).reindex(index)
+
+def migrate_pickled_data():
+    """Convert the pickle store of older versions to the Arrow store"""
+    # Workers starting together: the first one to get the lock migrates
+    with snapshots.writer_lock():
+        if snapshots.current() != 0 or not LEGACY_CSV_PATH.exists():
+            return
+        df = read_pickled_frame(LEGACY_CSV_PATH)
+        df.columns = [c.strip() for c in df.columns]
+        # Data saved before match columns were persisted at ingest
+        if not has_match_columns(df):
+            df = add_match_columns(df)
+        df, text = split_free_text(apply_schema(df))
+        if LEGACY_TEXT_PATH.exists():
+            # Free text already split off by the previous version
+            text = read_pickled_frame(LEGACY_TEXT_PATH).join(df[['Mes_Competencia']])
+        with snapshots.publish() as snapshot_dir:
+            write_frame(snapshot_dir / TEXT_FILE, text)
+            write_frame(snapshot_dir / DATA_FILE, df)
+        os.remove(LEGACY_CSV_PATH)
+        if LEGACY_TEXT_PATH.exists():
+            os.remove(LEGACY_TEXT_PATH)
+    print(f"✅ Migrated pickled data to {snapshot_dir}")
+
+def migrate_unversioned_data():
+    """Publish the single-file Arrow store as the first snapshot"""
+    with snapshots.writer_lock():
+        if snapshots.current() != 0 or not UNVERSIONED_CSV_PATH.exists():
+            return
+        with snapshots.publish() as snapshot_dir:
+            if UNVERSIONED_TEXT_PATH.exists():
+                os.replace(UNVERSIONED_TEXT_PATH, snapshot_dir / TEXT_FILE)
+            os.replace(UNVERSIONED_CSV_PATH, snapshot_dir / DATA_FILE)
+    print(f"✅ Moved data to {snapshot_dir}")
 
 # Persistence helper functions
+# Small artifacts, each in its own JSON file and written only when changed.
+# The transaction frame is written by /upload alone; mappings and overrides
+# are snapshots, edits since the last one are appended to the journal.
+ARTIFACT_PATHS = {
+    "mappings": MAPPINGS_PATH,
+    "overrides": OVERRIDES_PATH,
+    "metadata": METADATA_PATH,
+}
+dirty_artifacts = set()
+
+def mark_dirty(*artifacts: str):
+    """Flag artifacts changed in memory; the next save_data() writes them"""
+    dirty_artifacts.update(artifacts)
+
+def artifact_payload(name: str):
+    state = app_state.get()
+    if name == "mappings":
+        return [m.model_dump() for m in state.mappings]
+    if name == "overrides":
+        return state.overrides
+    return {
+        "last_upload": datetime.now().isoformat(),
+        "rows": len(state.df) if state.df is not None else 0
+    }
+
+def write_snapshot():
+    """Snapshot of the journaled state (called by journal compaction)"""
+    if db is not None:
+        # Edits are written through to the database as they are applied
+        return
+    for name in ("mappings", "overrides"):
+        write_json(ARTIFACT_PATHS[name], artifact_payload(name))
+
+journal = ChangeJournal(JOURNAL_PATH, JOURNAL_HISTORY_DIR)
+
+def apply_change(change: dict) -> AppState:
+    """Swap in the state after one journaled edit (live edits, other workers' edits)"""
+    return app_state.update(lambda s: s.apply(change))
+
+def commit_change(change: dict):
+    """Apply an edit made here, written through to the SQLite backend"""
+    state = apply_change(change)
+    if db is not None:
+        write_through(change, state)
+
+def write_through(change: dict, state: AppState):
+    """Persist an applied edit to the SQLite backend"""
+    op = change["op"]
+    if op == "override":
+        db.set_override(change["line"], change["month"], change["value"])
+    elif op == "clear_overrides":
+        db.clear_overrides()
+    else:
+        db.save_mappings([m.model_dump() for m in state.mappings])
+
+def record_change(op: str, user: dict, **args):
+    """Apply an edit and persist it as one journal append"""
+    journal.commit({"op": op, **args}, commit_change, user=user.get("name") if user else None)
+    if journal.needs_compaction():
+        threading.Thread(target=journal.compact, args=(write_snapshot,), daemon=True).start()
+
 def save_data():
-    """Save current dataframe and mappings to disk"""
+    """Write the artifacts marked dirty to disk, each atomically"""
     try:
-        if current_df is not None:
-            with open(CSV_PATH, 'wb') as f:
-                pickle.dump(current_df, f)
-            
-        # Save mappings
-        mappings_dict = [m.model_dump() for m in current_mappings]
-        with open(MAPPINGS_PATH, 'w') as f:
-            json.dump(mappings_dict, f)
-            
-        # Save overrides
-        with open(OVERRIDES_PATH, 'w') as f:
-            json.dump(current_overrides, f)
-        
-        # Save metadata
-        metadata = {
-            "last_upload": datetime.now().isoformat(),
-            "rows": len(current_df) if current_df is not None else 0
-        }
-        with open(METADATA_PATH, 'w') as f:
-            json.dump(metadata, f)
-            
+        for name in sorted(dirty_artifacts):
+            write_json(ARTIFACT_PATHS[name], artifact_payload(name))
+            dirty_artifacts.discard(name)
         return True
     except Exception as e:
         print(f"Error saving data: {e}")
         return False
 
+def load_transactions():
+    """Load the frame of the published snapshot (or the SQLite backend)"""
+    version = snapshots.current()
+    df = None
+    # Only the columns the endpoints read, memory-mapped
+    if db is not None:
+        appended = read_db_append(version)
+        if appended is not None:
+            # Rows appended to the loaded snapshot: read only the new ones
+            state, start = app_state.get(), appended["start_row_id"]
+            rows = db.read_transactions(ANALYSIS_COLUMNS, start_row_id=start)
+            df = concat_frames([state.df, rows])
+            print(f"✅ Appended {len(rows)} rows from {db.path}: {len(df)} rows")
+            replace_frame(df, version, changed_months=set(appended["months"]), appended=db.pnl_groups(start_row_id=start))
+            return
+        if db.has_transactions():
+            df = db.read_transactions(ANALYSIS_COLUMNS)
+            print(f"✅ Loaded data from {db.path}: {len(df)} rows")
+        replace_frame(df, version)
+        return
+    directory = snapshots.directory(version)
+    segments = read_manifest(directory, DATA_FILE, TEXT_FILE)
+    state = app_state.get()
+    loaded = list(state.segments)
+    if state.df is not None and loaded and segments[:len(loaded)] == loaded:
+        # Rows appended to the loaded snapshot: read only the new segments
+        added = segments[len(loaded):]
+        rows = read_segments(directory, [s.data for s in added], columns=ANALYSIS_COLUMNS)
+        df = concat_frames([state.df, rows])
+        changed_months = {m for s in added for m in s.months}
+        print(f"✅ Appended {sum(s.rows for s in added)} rows (snapshot {version}): {len(df)} rows")
+        replace_frame(df, version, segments, changed_months, appended=rows)
+        return
+    if segments:
+        df = read_segments(directory, [s.data for s in segments], columns=ANALYSIS_COLUMNS)
+        print(f"✅ Loaded data (snapshot {version}): {len(df)} rows, {len(df.columns)} columns")
+    replace_frame(df, version, segments)
+
+def read_db_append(version: int):
+    """The append record of a SQLite snapshot, if it appended rows right after the loaded ones"""
+    path = snapshots.path(APPEND_FILE, version)
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        appended = json.load(f)
+    state = app_state.get()
+    if state.df is None or state.df.empty or appended["base"] != state.snapshot_version:
+        return None
+    # Rows written without publishing a snapshot in between: reload them all
+    return appended if state.df.index[-1] + 1 == appended["start_row_id"] else None
+
+def sync_state(reason: str = "sync"):
+    """Pick up what other workers published: a new snapshot, journaled edits"""
+    state = app_state.get()
+    if snapshots.current() != state.snapshot_version:
+        with reload_lock:
+            if snapshots.current() != app_state.get().snapshot_version:
+                load_transactions()
+    journal.sync(apply_change)
+    if app_state.get() is not state:
+        warmer.request(reason)
+
 def load_data():
     """Load dataframe and mappings from disk on startup"""
-    global current_df, current_mappings, current_overrides
-    
+    # In-memory state is replaced by what is on disk
+    dirty_artifacts.clear()
     try:
-        # Load dataframe
-        if CSV_PATH.exists():
-            with open(CSV_PATH, 'rb') as f:
-                current_df = pickle.load(f)
-            
-            # Clean columns of loaded data to match new logic
-            if current_df is not None:
-                current_df.columns = [c.strip() for c in current_df.columns]
-                print(f"✅ Loaded data: {len(current_df)} rows (Columns cleaned)")
+        if snapshots.current() == 0:
+            if LEGACY_CSV_PATH.exists():
+                migrate_pickled_data()
+            elif UNVERSIONED_CSV_PATH.exists():
+                migrate_unversioned_data()
+        if db is not None:
+            import_into_db()
+
+        with reload_lock:
+            load_transactions()
         
-        # Load mappings
-        if MAPPINGS_PATH.exists():
-            with open(MAPPINGS_PATH, 'r') as f:
-                mappings_dict = json.load(f)
-                current_mappings = [MappingItem(**m) for m in mappings_dict]
-            print(f"✅ Loaded {len(current_mappings)} mappings")
-            
-        # Load overrides
-        if OVERRIDES_PATH.exists():
-            with open(OVERRIDES_PATH, 'r') as f:
-                current_overrides = json.load(f)
-            print(f"✅ Loaded overrides for {len(current_overrides)} lines")
+        # Snapshot and journal are read together: no compaction in between
+        with journal.locked():
+            app_state.update(load_mappings_and_overrides)
         
         # Load metadata
         if METADATA_PATH.exists():
@@ -143,48 +406,132 @@ def load_data():
                 
     except Exception as e:
         print(f"⚠️ Error loading data: {e}")
-        current_df = None
-        current_mappings = get_initial_mappings()
-        current_overrides = {}
+        replace_frame(None, app_state.get().snapshot_version)
+        app_state.update(lambda s: s.with_mappings(get_initial_mappings())._replace(overrides={}))
+
+def load_mappings_and_overrides(state: AppState) -> AppState:
+    """The state with the mappings and overrides on disk: last snapshot, then the journaled edits made after it"""
+    # Load mappings
+    if db is not None:
+        mappings_dict = db.load_mappings()
+        if mappings_dict:
+            state = state.with_mappings(MappingItem(**m) for m in mappings_dict)
+        state = state._replace(overrides=db.load_overrides())
+    elif MAPPINGS_PATH.exists():
+        with open(MAPPINGS_PATH, 'r') as f:
+            mappings_dict = json.load(f)
+            state = state.with_mappings(MappingItem(**m) for m in mappings_dict)
+        print(f"✅ Loaded {len(state.mappings)} mappings")
+
+    # Load overrides
+    if db is None and OVERRIDES_PATH.exists():
+        with open(OVERRIDES_PATH, 'r') as f:
+            state = state._replace(overrides=json.load(f))
+        print(f"✅ Loaded overrides for {len(state.overrides)} lines")
+
+    # Edits made after the snapshot (already in the database: replaying
+    # them is harmless, each one is a full replacement). Applied to the new
+    # state before it is swapped in: readers never see the snapshot alone.
+    def replay(change: dict):
+        nonlocal state
+        state = state.apply(change)
+
+    replayed = journal.replay(replay)
+    if replayed:
+        print(f"✅ Replayed {replayed} journaled changes")
+        if db is not None:
+            # Edits journaled before the database was enabled
+            db.save_mappings([m.model_dump() for m in state.mappings])
+            db.save_overrides(state.overrides)
+    return state
+
+def import_into_db():
+    """Copy the file store into an empty SQLite database (first start with SQLITE_PATH)"""
+    directory = snapshots.directory()
+    segments = read_manifest(directory, DATA_FILE, TEXT_FILE)
+    if segments and not db.has_transactions():
+        with db.transaction_writer() as writer:
+            for segment in segments:
+                df = read_frame(directory / segment.data).sort_index()
+                if (directory / segment.text).exists():
+                    df = df.join(read_frame(directory / segment.text, columns=FREE_TEXT_COLUMNS))
+                # Fingerprints per segment, as append uploads computed them
+                fingerprints, keys = fingerprint_frame(df)
+                writer.write(df.assign(fingerprint=fingerprints, match_key=keys))
+        print(f"✅ Imported {writer.rows} rows into {db.path}")
+    if MAPPINGS_PATH.exists() and not db.load_mappings():
+        with open(MAPPINGS_PATH, 'r') as f:
+            db.save_mappings(json.load(f))
+    if OVERRIDES_PATH.exists() and not db.load_overrides():
+        with open(OVERRIDES_PATH, 'r') as f:
+            db.save_overrides(json.load(f))
 
 @app.on_event("startup")
 async def startup_event():
-    """Load persisted data on startup"""
+    """Load persisted data on startup, then warm the caches in the background"""
     load_data()
+    warmer.request("startup")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Let running upload jobs finish"""
+    upload_jobs.shutdown()
 
+@app.middleware("http")
+async def sync_shared_state(request, call_next):
+    """Serve every request from the state the other workers published"""
+    await run_in_threadpool(sync_state)
+    return await call_next(request)
 
-@app.post("/pnl/override")
-def update_pnl_override(data: dict):
-    """Update a specific cell in the P&L"""
-    global current_overrides
-    
-    line_num = str(data.get("line_number"))
+
+
+@app.post("/pnl/override", response_model=PnLCellsUpdate)
+def update_pnl_override(data: dict, current_user: dict = Depends(get_current_user)):
+    """
+    Update a specific cell in the P&L. Returns the cells of its month the
+    override changed and the month's validation alerts, computed on that
+    month's column; the cached whole-dataset P&L is patched the same way.
+    """
     month = data.get("month")
     value = data.get("value")
     
-    if not line_num or not month:
+    if data.get("line_number") is None or not month:
         raise HTTPException(status_code=400, detail="Missing line_number or month")
+    try:
+        line_num = str(override_line(int(data["line_number"])))
+        value = float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid line_number or value")
         
-    if line_num not in current_overrides:
-        current_overrides[line_num] = {}
-        
-    current_overrides[line_num][month] = float(value)
-    save_data()
-    return {"message": "Override saved"}
+    stale = app_state.get()
+    record_change("override", current_user, line=line_num, month=month, value=value)
+    state = app_state.get()
+
+    cells, alerts = [], []
+    if state.df is not None and not state.df.empty:
+        cells, alerts = get_cached_cube(state).month_cells(month, state.overrides, [int(line_num)])
+    previous = pnl_cache.get(cache_key(stale, "pnl", None, None))
+    pnl_cache.invalidate(overrides_hash=hash_overrides(stale.overrides))
+    # Patched only if this edit is the only change since the cached P&L
+    if previous is not None and cache_key(stale.with_override(line_num, month, value), "pnl", None, None) == cache_key(state, "pnl", None, None):
+        pnl_cache.put(cache_key(state, "pnl", None, None), patch_pnl(previous, month, cells, alerts))
+    warmer.request("overrides")
+    return PnLCellsUpdate(message="Override saved", cells=cells, validation_alerts=alerts)
 
 @app.delete("/api/pnl/overrides")
 def clear_pnl_overrides(current_user: dict = Depends(get_current_user)):
     """Clear all P&L overrides"""
-    global current_overrides
-    current_overrides = {}
-    save_data()
+    stale_hash = hash_overrides(app_state.get().overrides)
+    record_change("clear_overrides", current_user)
+    pnl_cache.invalidate(overrides_hash=stale_hash)
+    warmer.request("overrides")
     return {"message": "All overrides cleared"}
 
 @app.get("/status")
 def get_status():
     """Health check endpoint that returns data availability status"""
-    has_data = current_df is not None
+    state = app_state.get()
+    has_data = state.df is not None
     metadata = {}
     
     if METADATA_PATH.exists():
@@ -197,51 +544,125 @@ def get_status():
     return {
         "status": "healthy",
         "data_loaded": has_data,
-        "rows": len(current_df) if has_data else 0,
+        "rows": len(state.df) if has_data else 0,
         "last_upload": metadata.get("last_upload"),
-        "mappings_count": len(current_mappings)
+        "mappings_count": len(state.mappings),
+        "data_version": state.data_version,
+        "memory": memory_report(state.df) if has_data else None,
+        "cache": pnl_cache.stats(),
+        "warmup": warmer.stats(),
+        "journal": journal.stats(),
+        "snapshot": {"version": state.snapshot_version, "published": snapshots.current(), "worker": os.getpid()},
+        "storage": {"backend": "sqlite", **db.stats()} if db is not None else {"backend": "files"}
     }
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
-    global current_df
-    content = await file.read()
+@app.get("/api/changes")
+def get_change_history(limit: int = 100, current_user: dict = Depends(get_current_user)):
+    """Audit history of mapping and override edits, newest first"""
+    return journal.history(limit)
+
+def upload_finished(job: dict):
+    """A job of this worker ended: load the snapshot it published"""
+    if job["status"] == "done":
+        sync_state("upload")
+        mark_dirty("metadata")
+        save_data()
+        result = job["result"]
+        print(f"✅ Upload job {job['id']} ({job['mode']}{', cached' if job['cache_hit'] else ''}): {result['inserted']} rows stored, "
+              f"{result['duplicates']} duplicates, {result['conflicts']} conflicts")
+    else:
+        print(f"⚠️ Upload job {job['id']} failed: {job['error']}")
+
+def store_upload(file: UploadFile, job_id: str) -> str:
+    """Copy the spooled upload to the job's file; returns its SHA-256"""
+    digest = hashlib.sha256()
+    with open(upload_jobs.upload_path(job_id), 'wb') as f:
+        for block in iter(lambda: file.file.read(1 << 20), b''):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+@app.post("/upload", status_code=status.HTTP_202_ACCEPTED)
+async def upload_file(file: UploadFile = File(...), mode: str = "replace", current_user: dict = Depends(get_current_user)):
+    """
+    Queue the ingestion of an upload; poll /upload/jobs/{job_id} for its progress.
+    mode=replace swaps the stored transactions for the file's, mode=append
+    merges the transactions not stored yet.
+    """
+    if mode not in UPLOAD_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode: {mode} (expected one of {', '.join(UPLOAD_MODES)})")
     try:
-        current_df = process_upload(content)
-        save_data()  # Persist to disk
-        return {"message": "File processed successfully", "rows": len(current_df)}
+        job_id = upload_jobs.create()
+        digest = await run_in_threadpool(store_upload, file, job_id)
+        job = await run_in_threadpool(upload_jobs.submit, job_id, mode, upload_finished, digest)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "message": "File already processed: dataset reused" if job["cache_hit"] else "File queued for processing",
+        "job_id": job["id"],
+        "mode": job["mode"],
+        "status": job["status"],
+        "cache_hit": job["cache_hit"],
+        "status_url": f"/upload/jobs/{job['id']}",
+    }
+
+@app.get("/upload/jobs/{job_id}")
+def get_upload_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Progress of an upload job: stage, rows through each stage, result or error"""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
 
 @app.delete("/api/data")
 def clear_data(current_user: dict = Depends(get_current_user)):
     """Clear all uploaded data"""
-    global current_df
-    current_df = None
+    # An empty snapshot: the other workers drop their data too
+    with snapshots.writer_lock(), snapshots.publish() as snapshot_dir:
+        if db is not None:
+            db.clear_transactions()
+    replace_frame(None, int(snapshot_dir.name))
     # Also clear metadata
-    if CSV_PATH.exists():
-        os.remove(CSV_PATH)
+    for legacy_path in (UNVERSIONED_CSV_PATH, UNVERSIONED_TEXT_PATH, LEGACY_CSV_PATH, LEGACY_TEXT_PATH):
+        if legacy_path.exists():
+            os.remove(legacy_path)
     if METADATA_PATH.exists():
         os.remove(METADATA_PATH)
     return {"message": "Data cleared successfully"}
 
 @app.get("/mappings", response_model=List[MappingItem])
 def get_mappings(current_user: dict = Depends(get_current_user)):
-    return current_mappings
+    return list(app_state.get().mappings)
 
 @app.post("/mappings")
 def update_mappings(update: MappingUpdate, current_user: dict = Depends(get_current_user)):
-    global current_mappings
-    current_mappings = update.mappings
-    save_data()  # Persist to disk
+    stale_hash = hash_mappings(app_state.get().mappings)
+    record_change("set_mappings", current_user, mappings=[m.model_dump() for m in update.mappings])
+    remap_cube(app_state.get())
+    pnl_cache.invalidate(mappings_hash=stale_hash)
+    warmer.request("mappings")
     return {"message": "Mappings updated"}
 
+@app.post("/mappings/preview", response_model=MappingPreview)
+def preview_mappings(update: MappingUpdate, current_user: dict = Depends(get_current_user)):
+    """
+    P&L impact of a proposed mapping list, without saving it: the P&L cells
+    that would change and the rows moving between lines. Only the cost
+    centers the proposal changes are reclassified, on the cached cube.
+    """
+    state = current_state()
+    if state.df is None or state.df.empty:
+        raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
+    return get_cached_cube(state).preview(update.mappings, state.overrides)
+
 @app.delete("/api/mappings")
 def reset_mappings(current_user: dict = Depends(get_current_user)):
     """Reset mappings to default"""
-    global current_mappings
-    current_mappings = get_initial_mappings()
-    save_data()
+    stale_hash = hash_mappings(app_state.get().mappings)
+    record_change("reset_mappings", current_user)
+    remap_cube(app_state.get())
+    pnl_cache.invalidate(mappings_hash=stale_hash)
+    warmer.request("mappings")
     return {"message": "Mappings reset to default"}
 
 @app.get("/pnl", response_model=PnLResponse)
@@ -250,17 +671,38 @@ def get_pnl(
     end_date: str = None,
     current_user: dict = Depends(get_current_user)
 ):
-    global current_df, current_overrides
-    
     # Lazy load if data is missing but might exist on disk
-    if current_df is None:
-        print("⚠️ Data missing in memory, attempting lazy load...")
-        load_data()
+    state = current_state()
         
-    if current_df is None or current_df.empty:
+    if state.df is None or state.df.empty:
         raise HTTPException(status_code=404, detail="No data loaded. Please upload a CSV file.")
     
-    return calculate_pnl(current_df, current_mappings, current_overrides, start_date, end_date)
+    return get_cached_pnl(state, start_date, end_date)
+
+def filter_line_transactions(df: pd.DataFrame, line_mapping: MappingItem, month_code: int = None) -> pd.DataFrame:
+    """Rows of a mapping's cost center and supplier (and month), in upload order"""
+    filtered_df = df
+    if month_code is not None:
+        filtered_df = filtered_df[filtered_df['Mes_Competencia'] == month_code]
+
+    # Apply Centro de Custo filter
+    if line_mapping.centro_custo:
+        filtered_df = filtered_df[
+            filtered_df['Centro de Custo 1'].astype(str).str.contains(
+                line_mapping.centro_custo, case=False, na=False, regex=False
+            )
+        ]
+
+    # Apply Fornecedor/Cliente filter
+    if line_mapping.fornecedor_cliente and line_mapping.fornecedor_cliente != "Diversos":
+        filtered_df = filtered_df[
+            filtered_df['Nome do fornecedor/cliente'].astype(str).str.contains(
+                line_mapping.fornecedor_cliente, case=False, na=False, regex=False
+            )
+        ]
+
+    # A frame loaded from the store is grouped by month; list in upload order
+    return filtered_df.sort_index()
 
 @app.get("/pnl/transactions/{line_number}")
 def get_pnl_line_transactions(
@@ -278,17 +720,14 @@ def get_pnl_line_transactions(
     Returns:
         JSON with line details and list of transactions
     """
-    global current_df, current_mappings
-    
-    if current_df is None:
-        load_data()
+    state = current_state()
     
-    if current_df is None or current_df.empty:
+    if state.df is None or state.df.empty:
         raise HTTPException(status_code=404, detail="No data loaded")
     
     # Find mapping for this line number  
     line_mapping = None
-    for mapping in current_mappings:
+    for mapping in state.mappings:
         try:
             if int(mapping.linha_pl) == line_number:
                 line_mapping = mapping
@@ -302,40 +741,29 @@ def get_pnl_line_transactions(
             detail=f"No mapping found for line {line_number}"
         )
     
-    # Filter dataframe
-    filtered_df = current_df.copy()
-    
-    # Apply month filter if provided
+    month_code = None
     if month:
         try:
-            if '-' in str(month):  # Format: 'YYYY-MM'
-                filtered_df = filtered_df[filtered_df['Mes_Competencia'].astype(str) == month]
-            else:  # Could be Period object comparison
-                filtered_df = filtered_df[filtered_df['Mes_Competencia'] == month]
+            # Format: 'YYYY-MM' or month code
+            month_code = parse_month_label(month) if '-' in str(month) else int(month)
         except Exception as e:
             print(f"Month filter error: {e}")
-    
-    # Apply Centro de Custo filter
-    if line_mapping.centro_custo:
-        filtered_df = filtered_df[
-            filtered_df['Centro de Custo 1'].astype(str).str.contains(
-                line_mapping.centro_custo, case=False, na=False, regex=False
-            )
-        ]
-    
-    # Apply Fornecedor/Cliente filter
-    if line_mapping.fornecedor_cliente and line_mapping.fornecedor_cliente != "Diversos":
-        filtered_df = filtered_df[
-            filtered_df['Nome do fornecedor/cliente'].astype(str).str.contains(
-                line_mapping.fornecedor_cliente, case=False, na=False, regex=False
-            )
-        ]
-    
+
+    fornecedor = line_mapping.fornecedor_cliente if line_mapping.fornecedor_cliente != "Diversos" else None
+    if db is not None:
+        # Indexed lookup, notes included
+        filtered_df = db.line_transactions(month_code, line_mapping.centro_custo, fornecedor)
+        notes = filtered_df['Observações']
+    else:
+        filtered_df = filter_line_transactions(state.df, line_mapping, month_code)
+        # Free-text columns live on disk; load them only for the selected rows
+        notes = load_free_text(state, filtered_df.index, months=filtered_df['Mes_Competencia'].unique()).get('Observações')
+
     # Build transaction list
     transactions = []
     total = 0.0
     
-    for _, row in filtered_df.iterrows():
+    for idx, row in filtered_df.iterrows():
         try:
             date_val = row.get('Data de competência')
             date_str = date_val.strftime('%Y-%m-%d') if pd.notna(date_val) else ''
@@ -344,10 +772,11 @@ def get_pnl_line_transactions(
             
         transaction = {
             "date": date_str,
-            "month": str(row.get('Mes_Competencia', '')),
+            "month": month_label(row['Mes_Competencia']) if row.get('Mes_Competencia', -1) >= 0 else '',
             "centro_custo": str(row.get('Centro de Custo 1', '')),
             "fornecedor": str(row.get('Nome do fornecedor/cliente', '')),
             "descricao": str(row.get('Descrição', '')),
+            "observacoes": str(notes[idx]) if notes is not None and pd.notna(notes[idx]) else '',
             "valor": float(row.get('Valor_Num', 0)),
             "categoria": str(row.get('Plano de contas', ''))
         }
@@ -356,7 +785,7 @@ def get_pnl_line_transactions(
     
     return {
         "line_number": line_number,
-        "description": line_mapping.descricao,
+        "description": line_mapping.observacoes,
         "centro_custo_filter": line_mapping.centro_custo,
         "fornecedor_filter": line_mapping.fornecedor_cliente,
         "month": month if month else "all",
@@ -371,19 +800,20 @@ def validate_data(current_user: dict = Depends(get_current_user)):
     Validate calculation consistency between Dashboard and P&L.
     Returns validation results and any errors found.
     """
-    from validation import validate_dashboard_pnl_consistency, validate_calculation_logic
-    
-    global current_df, current_mappings, current_overrides
-    
-    if current_df is None:
-        load_data()
+    state = current_state()
     
-    if current_df is None or current_df.empty:
+    if state.df is None or state.df.empty:
         raise HTTPException(status_code=404, detail="No data loaded")
     
-    # Calculate P&L and Dashboard
-    pnl_data = calculate_pnl(current_df, current_mappings, current_overrides)
-    dashboard_data = get_dashboard()
+    return get_cached_validation(state)
+
+def compute_validation(state: AppState) -> dict:
+    from validation import validate_dashboard_pnl_consistency, validate_calculation_logic
+
+    # Calculate P&L and Dashboard (both served from the shared cache)
+    # validation.py works on plain dicts
+    pnl_data = get_cached_pnl(state).model_dump()
+    dashboard_data = get_cached_dashboard(state).model_dump()
     
     # Run validations
     dashboard_valid, dashboard_errors = validate_dashboard_pnl_consistency(
@@ -410,6 +840,9 @@ def validate_data(current_user: dict = Depends(get_current_user)):
         }
     }
 
+def get_cached_validation(state: AppState) -> dict:
+    return pnl_cache.get_or_compute(cache_key(state, "validation"), lambda: compute_validation(state))
+
 @app.post("/api/insights")
 def get_ai_insights(request: dict, current_user: dict = Depends(get_current_user)):
     """
@@ -428,34 +861,57 @@ def get_ai_insights(request: dict, current_user: dict = Depends(get_current_user
         print(f"Error in /api/insights: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_cached_dashboard(state: AppState) -> DashboardData:
+    return pnl_cache.get_or_compute(
+        cache_key(state, "dashboard"),
+        lambda: get_dashboard_data(state.df, state.mappings, state.overrides, pnl=get_cached_pnl(state),
+                                   line_values=get_cached_cube(state).evaluate(state.overrides)[0])
+    )
+
 @app.get("/dashboard", response_model=DashboardData)
 def get_dashboard(current_user: dict = Depends(get_current_user)):
-    global current_df, current_mappings, current_overrides
-    
     # Lazy load if data is missing but might exist on disk
-    if current_df is None:
-        print("⚠️ Data missing in memory, attempting lazy load...")
-        load_data()
+    state = current_state()
         
-    if current_df is None:
+    if state.df is None:
         # Return empty structure
         return DashboardData(kpis={}, monthly_data=[], cost_structure={})
     
-    # Note: get_dashboard_data needs to be updated to accept overrides too if we want charts to reflect edits
-    # For now, let's update logic.py signature for get_dashboard_data as well
-    return get_dashboard_data(current_df, current_mappings, current_overrides)
+    return get_cached_dashboard(state)
 
 @app.get("/api/forecast")
-def get_forecast(months: int = 3, current_user: dict = Depends(get_current_user)):
+def get_forecast(months: int = DEFAULT_FORECAST_MONTHS, current_user: dict = Depends(get_current_user)):
     """
     Get financial forecast for the next N months.
     """
-    global current_df, current_mappings, current_overrides
-    
-    if current_df is None:
-        load_data()
-        
-    return calculate_forecast(current_df, current_mappings, current_overrides, months_ahead=months)
+    state = current_state()
+
+    if state.df is None:
+        return calculate_forecast(state.df, state.mappings, state.overrides, months_ahead=months)
+
+    return get_cached_forecast(state, months)
+
+def get_cached_forecast(state: AppState, months: int = DEFAULT_FORECAST_MONTHS):
+    return pnl_cache.get_or_compute(
+        cache_key(state, "forecast", months),
+        lambda: calculate_forecast(state.df, state.mappings, state.overrides, months_ahead=months, pnl=get_cached_pnl(state))
+    )
+
+def warmup_steps() -> dict:
+    """What the UI asks for first, for the current state (warmed by `warmer`)"""
+    state = app_state.get()
+    if state.df is None or state.df.empty:
+        return {}
+    return {
+        "pnl": lambda: get_cached_pnl(state),
+        "dashboard": lambda: get_cached_dashboard(state),
+        "forecast": lambda: get_cached_forecast(state),
+        "validation": lambda: get_cached_validation(state),
+    }
+
+# Payloads of the current state precomputed in the background after startup,
+# uploads and edits
+warmer = CacheWarmer(warmup_steps)
 
 # Serve the built frontend (Vite) from the dist folder
 from fastapi.responses import FileResponse, HTMLResponse
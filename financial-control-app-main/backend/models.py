@@ -17,6 +17,7 @@ class DashboardData(BaseModel):
     kpis: Dict[str, Any]
     monthly_data: List[Dict[str, Any]]
     cost_structure: Dict[str, Any]
+    formulas: Dict[str, Any] = {}  # Node key -> breakdown of its formula (pnl_graph.PnLGraph.formula)
 
 class PnLItem(BaseModel):
     line_number: int
@@ -24,6 +25,7 @@ class PnLItem(BaseModel):
     values: Dict[str, float]  # month -> value
     is_header: bool = False
     is_total: bool = False
+    editable: bool = False  # Can be overridden (/pnl/override)
 
 class ValidationAlert(BaseModel):
     month: str
@@ -36,3 +38,35 @@ class PnLResponse(BaseModel):
     headers: List[str]
     rows: List[PnLItem]
     validation_alerts: Optional[List[ValidationAlert]] = None
+
+class PnLCell(BaseModel):
+    line_number: int
+    month: str
+    value: float
+
+class PnLCellsUpdate(BaseModel):
+    """Cells of one month an override changed, with that month's validation alerts"""
+    message: str
+    cells: List[PnLCell]
+    validation_alerts: List[ValidationAlert]
+
+class PnLDelta(BaseModel):
+    line_number: int
+    description: str
+    month: str
+    before: float
+    after: float
+    delta: float
+
+class LineMove(BaseModel):
+    from_line: int  # 0: unmapped
+    to_line: int
+    rows: int
+    amount: float
+
+class MappingPreview(BaseModel):
+    """P&L impact of a proposed mapping list (/mappings/preview)"""
+    cells: List[PnLDelta]
+    moves: List[LineMove]
+    rows_moved: int
+    amount_moved: float  # Sum of the absolute amount of each move
@@ -0,0 +1,184 @@
+"""
+Shared result cache for P&L-derived payloads.
+
+/pnl, /dashboard, /validate and /api/forecast all start from the same
+calculate_pnl result. Entries are keyed on everything that result depends on
+(data version, mappings hash, overrides hash, date range), kept in LRU order
+and bounded both by entry count and by an approximate byte budget.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+
+from models import MappingItem
+
+
+class CacheKey(NamedTuple):
+    kind: str                 # 'pnl', 'cube', 'dashboard', 'forecast', ...
+    data_version: int
+    mappings_hash: str
+    overrides_hash: str
+    params: Tuple = ()        # e.g. (start_date, end_date)
+
+
+def _digest(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def hash_mappings(mappings: List[MappingItem]) -> str:
+    """Stable content hash of a mapping list (order matters for matching)."""
+    return _digest([m.model_dump() for m in mappings])
+
+
+def hash_overrides(overrides: Optional[Dict[str, Dict[str, float]]]) -> str:
+    """Stable content hash of the overrides dict."""
+    return _digest(overrides or {})
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a cached payload, in bytes."""
+    if isinstance(value, BaseModel):
+        return len(value.model_dump_json())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)  # Arrays, PnLCube
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class PnLCache:
+    """Thread-safe LRU cache with an entry limit and a byte budget."""
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pending: Dict[CacheKey, threading.Event] = {}  # Keys being computed
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: CacheKey) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: CacheKey, value: Any) -> None:
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def find(self, match: Callable[[CacheKey], bool]) -> Any:
+        """Most recently used value whose key matches (None: no such entry)."""
+        with self._lock:
+            for key in reversed(self._entries):
+                if match(key):
+                    return self._entries[key][0]
+        return None
+
+    def get_or_compute(self, key: CacheKey, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, computing and storing it on a miss.
+        A key is computed by one thread at a time: concurrent callers (a
+        request arriving during the warm-up) wait for that result.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Computed elsewhere: use its result (or compute it if that failed)
+            pending.wait()
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def invalidate(
+        self,
+        data_version: Optional[int] = None,
+        mappings_hash: Optional[str] = None,
+        overrides_hash: Optional[str] = None,
+    ) -> int:
+        """
+        Drop every entry built from the given (superseded) state component.
+        Returns the number of evicted entries.
+        """
+        def stale(key: CacheKey) -> bool:
+            return (
+                (data_version is not None and key.data_version == data_version)
+                or (mappings_hash is not None and key.mappings_hash == mappings_hash)
+                or (overrides_hash is not None and key.overrides_hash == overrides_hash)
+            )
+
+        with self._lock:
+            doomed = [key for key in self._entries if stale(key)]
+            for key in doomed:
+                _, size = self._entries.pop(key)
+                self._bytes -= size
+            return len(doomed)
+
+    def carry_over(self, data_version: int, new_version: int, keep: Callable[[CacheKey], bool]) -> int:
+        """
+        Re-key the entries of data_version still valid for new_version
+        (keep(key) is true) and drop the others. Entries already built for
+        new_version are not replaced. Returns the number kept.
+        """
+        with self._lock:
+            kept = 0
+            for key in [key for key in self._entries if key.data_version == data_version]:
+                value, size = self._entries.pop(key)
+                new_key = key._replace(data_version=new_version)
+                if keep(key) and new_key not in self._entries:
+                    self._entries[new_key] = (value, size)
+                    kept += 1
+                else:
+                    self._bytes -= size
+            return kept
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
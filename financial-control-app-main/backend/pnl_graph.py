@@ -0,0 +1,338 @@
+"""
+Declarative P&L structure.
+
+The derived P&L lines (revenue, payment processing, gross profit, EBITDA,
+...) are nodes of a graph: each one sums terms (source lines of the mapping,
+or other nodes) with a sign rule, optionally scaled by a rate and stored
+negated (costs are shown as negative values). A vectorized evaluator
+computes every node over all months at once, in dependency order, and can
+recompute only the dependents of the inputs that changed.
+
+The same graph drives the P&L display rows, the consistency checks (P&L
+validation alerts and /validate) and the formula breakdowns of the
+dashboard, so a formula is defined here and nowhere else.
+
+Terms are evaluated left to right, so a node written as a sum of nodes keeps
+the grouping (and the exact floating-point result) of its formula.
+"""
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+import numpy as np
+
+PAYMENT_PROCESSING_RATE = 0.1765
+
+
+class Term(NamedTuple):
+    ref: Union[int, str]   # Source line number, or node key
+    sign: int = 1          # +1 or -1
+    absolute: bool = False  # Sign-insensitive source (revenue booked with either sign)
+
+
+class Node(NamedTuple):
+    key: str
+    label: str
+    terms: Tuple[Term, ...] = ()
+    line: Optional[int] = None      # P&L matrix row holding the value (None: intermediate)
+    rate: float = 1.0               # Applied to the sum of the terms
+    negate: bool = False            # Stored negated (costs and expenses)
+    ratio: Optional[Tuple[str, str]] = None  # Percentage numerator / denominator (0 without denominator)
+    after_overrides: bool = False   # Computed from the overridden values (margins)
+
+
+class DisplayRow(NamedTuple):
+    line_number: int
+    description: str
+    node: str
+    is_header: bool = False
+    is_total: bool = False
+
+
+class Check(NamedTuple):
+    """An identity the P&L must satisfy: node == terms (within TOLERANCE)."""
+    node: str
+    terms: Tuple[Term, ...]
+    field: str             # P&L validation alert field
+    name: str              # /validate error label
+    in_pnl: bool = True    # Reported as a P&L validation alert
+    message: str = "{name} calculation error: Expected={expected:.2f}, Actual={actual:.2f}"
+
+
+def _sources(*lines: int) -> Tuple[Term, ...]:
+    return tuple(Term(line, absolute=True) for line in lines)
+
+
+NODES = [
+    # Revenue (enforced positive)
+    Node('google_revenue', 'Google Play Revenue', _sources(25), line=112),
+    Node('apple_revenue', 'App Store Revenue', _sources(33), line=113),
+    Node('revenue_no_tax', 'Receita de Vendas (Google + Apple)', (Term('google_revenue'), Term('apple_revenue')), line=101),
+    # Line 38 (Rendimentos) + Line 49 (Possible misc revenue)
+    Node('investment_income', 'Rendimentos de Aplicações', _sources(38, 49)),
+    Node('total_revenue', 'RECEITA OPERACIONAL BRUTA', (Term('revenue_no_tax'), Term('investment_income')), line=100),
+    # Refunds ('Devoluções e Estornos') are mapped to Line 90 (Other Expenses),
+    # so Revenue stays purely Gross Sales ("No Negative Revenue").
+    Node('payment_processing', 'Payment Processing (17.65%)', (Term('revenue_no_tax'),), line=102,
+         rate=PAYMENT_PROCESSING_RATE, negate=True),
+    Node('cogs', 'COGS (Web Services)', _sources(43, 44, 45, 46, 47, 48), line=103, negate=True),
+    Node('direct_costs', '(-) CUSTOS DIRETOS', (Term('payment_processing'), Term('cogs'))),
+    Node('gross_profit', '(=) LUCRO BRUTO', (Term('total_revenue'), Term('payment_processing'), Term('cogs')), line=104),
+    # Opex
+    Node('marketing', 'Marketing', _sources(56), line=107, negate=True),
+    Node('wages', 'Salários (Wages)', _sources(62), line=108, negate=True),
+    Node('tech_support', 'Tech Support & Services', _sources(68, 65), line=109, negate=True),
+    Node('other_expenses', 'Outras Despesas', _sources(90), line=110, negate=True),
+    Node('sga', 'SG&A', (Term('marketing'), Term('wages'), Term('tech_support')), line=105),
+    Node('operating_expenses', '(-) DESPESAS OPERACIONAIS', (Term('sga'), Term('other_expenses'))),
+    Node('ebitda', '(=) EBITDA', (Term('gross_profit'), Term('operating_expenses')), line=106),
+    Node('net_result', '(=) RESULTADO LÍQUIDO', (Term('ebitda'),), line=111),
+    # Margins, from the overridden revenue and results
+    Node('ebitda_margin', 'Margem EBITDA %', ratio=('ebitda', 'total_revenue'), after_overrides=True),
+    Node('gross_margin', 'Margem Bruta %', ratio=('gross_profit', 'total_revenue'), after_overrides=True),
+]
+
+DISPLAY_ROWS = [
+    DisplayRow(1, "RECEITA OPERACIONAL BRUTA", 'total_revenue', is_header=True),
+    DisplayRow(2, "Receita de Vendas (Google + Apple)", 'revenue_no_tax'),
+    DisplayRow(21, "Google Play Revenue", 'google_revenue'),
+    DisplayRow(22, "App Store Revenue", 'apple_revenue'),
+    DisplayRow(3, "Rendimentos de Aplicações", 'line_38'),
+    DisplayRow(4, "(-) CUSTOS DIRETOS", 'direct_costs', is_header=True),
+    DisplayRow(5, "Payment Processing (17.65%)", 'payment_processing'),
+    DisplayRow(6, "COGS (Web Services)", 'cogs'),
+    DisplayRow(7, "(=) LUCRO BRUTO", 'gross_profit', is_total=True),
+    DisplayRow(8, "(-) DESPESAS OPERACIONAIS", 'operating_expenses', is_header=True),
+    DisplayRow(9, "Marketing", 'marketing'),
+    DisplayRow(10, "Salários (Wages)", 'wages'),
+    DisplayRow(11, "Tech Support & Services", 'tech_support'),
+    DisplayRow(12, "Outras Despesas", 'other_expenses'),
+    DisplayRow(13, "(=) EBITDA", 'ebitda', is_total=True),
+    DisplayRow(16, "(=) RESULTADO LÍQUIDO", 'net_result', is_total=True),
+    DisplayRow(14, "Margem EBITDA %", 'ebitda_margin'),
+    DisplayRow(15, "Margem Bruta %", 'gross_margin'),
+]
+
+CHECKS = [
+    # Lucro Bruto = Receita Operacional Bruta - Payment Processing - COGS
+    Check('gross_profit', (Term('total_revenue'), Term('payment_processing', -1, True), Term('cogs', -1, True)),
+          field="Lucro Bruto", name="Gross Profit"),
+    # EBITDA = Lucro Bruto - OpEx
+    Check('ebitda', (Term('gross_profit'), Term('total_opex', -1)), field="EBITDA", name="EBITDA"),
+    # No financial expenses or taxes yet
+    Check('net_result', (Term('ebitda'),), field="Resultado Líquido", name="Net Result", in_pnl=False,
+          message="Net Result should equal EBITDA: EBITDA={expected:.2f}, Net Result={actual:.2f}"),
+]
+# OpEx as the checks add it up: each expense line, sign-insensitive
+CHECK_NODES = [
+    Node('total_opex', 'OpEx', (Term('marketing', absolute=True), Term('wages', absolute=True),
+                                Term('tech_support', absolute=True), Term('other_expenses', absolute=True))),
+]
+
+TOLERANCE = 0.01  # R$
+
+Values = Callable[[str], np.ndarray]
+
+
+def source_key(line: int) -> str:
+    return f'line_{line}'
+
+
+class PnLGraph:
+    """Evaluator of the P&L nodes over a (lines x months) matrix."""
+
+    def __init__(self, nodes: List[Node], rows: List[DisplayRow], checks: List[Check], check_nodes: List[Node] = ()):
+        self.nodes: Dict[str, Node] = {}
+        for node in list(nodes) + list(check_nodes):
+            if node.key in self.nodes:
+                raise ValueError(f"Duplicate P&L node {node.key}")
+            self.nodes[node.key] = node
+        self.rows = rows
+        self.checks = checks
+        self.order = self._topological_order()
+        self.check_nodes = {node.key for node in check_nodes}
+        self._rows_by_node = {row.node: row for row in rows}
+        self._rows_by_number = {row.line_number: row for row in rows}
+
+    # -- structure --------------------------------------------------------
+
+    def inputs(self, key: str) -> List[str]:
+        """Direct inputs of a node: node keys and source keys (line_N)."""
+        node = self.nodes[key]
+        refs = [t.ref for t in node.terms] + list(node.ratio or ())
+        return [source_key(ref) if isinstance(ref, int) else ref for ref in refs]
+
+    def _topological_order(self) -> List[str]:
+        order, state = [], {}
+
+        def visit(key: str, path: Tuple[str, ...]):
+            if state.get(key) == 'done' or key not in self.nodes:
+                return
+            if state.get(key) == 'visiting':
+                raise ValueError(f"Cycle in the P&L graph: {' -> '.join(path + (key,))}")
+            state[key] = 'visiting'
+            for ref in self.inputs(key):
+                visit(ref, path + (key,))
+            state[key] = 'done'
+            order.append(key)
+
+        for key in self.nodes:
+            visit(key, ())
+        return order
+
+    def dependents(self, changed: Iterable[str]) -> Set[str]:
+        """Nodes whose value depends (transitively) on any of the changed nodes or sources."""
+        dirty = set(changed)
+        for key in self.order:
+            if dirty.intersection(self.inputs(key)):
+                dirty.add(key)
+        return dirty & set(self.nodes)
+
+    def override_rows(self, lines: Iterable[int]) -> Set[int]:
+        """
+        Display rows an override of the matrix `lines` changes: the rows of
+        their nodes and of the nodes computed from overridden values.
+        """
+        lines = set(lines)
+        pinned = {key for key, node in self.nodes.items() if node.line in lines}
+        changed = pinned | {key for key in self.dependents(pinned) if self.nodes[key].after_overrides}
+        return {row.line_number for row in self.rows if row.node in changed}
+
+    def node_line(self, row_number: int) -> Optional[int]:
+        """Matrix line of the node a display row shows (None: not stored in the matrix)."""
+        row = self._rows_by_number.get(row_number)
+        if row is None or row.node not in self.nodes:
+            return None
+        return self.nodes[row.node].line
+
+    def row_number(self, key: str) -> int:
+        """Display line number of a node (its row in the P&L response)."""
+        return self._rows_by_node[key].line_number
+
+    def source_lines(self) -> Set[int]:
+        return {t.ref for node in self.nodes.values() for t in node.terms if isinstance(t.ref, int)}
+
+    # -- evaluation -------------------------------------------------------
+
+    def _compute(self, node: Node, value: Values) -> np.ndarray:
+        if node.ratio is not None:
+            numerator, denominator = (value(key) for key in node.ratio)
+            has_denominator = denominator != 0
+            safe = np.where(has_denominator, denominator, 1.0)
+            return np.where(has_denominator, numerator / safe * 100, 0.0)
+        total = None
+        for term in node.terms:
+            v = value(source_key(term.ref) if isinstance(term.ref, int) else term.ref)
+            if term.absolute:
+                v = np.abs(v)
+            if total is None:
+                total = v if term.sign > 0 else -v
+            else:
+                total = total + v if term.sign > 0 else total - v
+        if node.rate != 1.0:
+            total = total * node.rate
+        return -total if node.negate else total
+
+    def evaluate(self, line_values: np.ndarray, changed: Optional[Iterable[Union[int, str]]] = None,
+                 after_overrides: bool = False) -> Dict[str, np.ndarray]:
+        """
+        Compute the nodes into the matrix rows they own, for every month at
+        once. With `changed` (source lines or node keys), only their
+        dependents are recomputed, and the nodes owning a changed line;
+        `after_overrides` selects the nodes computed from overridden values
+        (margins) instead of the lines.
+        Returns the values of the nodes computed (intermediates included).
+        """
+        dirty = None
+        if changed is not None:
+            changed = list(changed)
+            lines = {c for c in changed if isinstance(c, int)}
+            owners = [key for key, node in self.nodes.items() if node.line in lines]
+            dirty = self.dependents([source_key(c) if isinstance(c, int) else c for c in changed] + owners)
+        computed: Dict[str, np.ndarray] = {}
+        value = self.reader(line_values, computed)
+        for key in self.order:
+            node = self.nodes[key]
+            if key in self.check_nodes or node.after_overrides != after_overrides:
+                continue
+            if dirty is not None and key not in dirty:
+                continue
+            computed[key] = self._compute(node, value)
+            if node.line is not None:
+                line_values[node.line] = computed[key]
+        return computed
+
+    def reader(self, line_values: np.ndarray, computed: Dict[str, np.ndarray]) -> Values:
+        """Node and source values: matrix rows, else computed on demand."""
+        def value(key: str) -> np.ndarray:
+            if key.startswith('line_'):
+                return line_values[int(key[5:])]
+            node = self.nodes[key]
+            if node.line is not None:
+                return line_values[node.line]
+            if key not in computed:
+                computed[key] = self._compute(node, value)
+            return computed[key]
+        return value
+
+    def row_reader(self, row_values: Dict[int, np.ndarray]) -> Values:
+        """Node values read from P&L display rows (by line number), else computed from their terms."""
+        computed: Dict[str, np.ndarray] = {}
+
+        def value(key: str) -> np.ndarray:
+            row = self._rows_by_node.get(key)
+            if row is not None:
+                return row_values[row.line_number]
+            if key not in computed:
+                computed[key] = self._compute(self.nodes[key], value)
+            return computed[key]
+        return value
+
+    def display_values(self, line_values: np.ndarray) -> List[Tuple[DisplayRow, np.ndarray]]:
+        value = self.reader(line_values, {})
+        return [(row, value(row.node)) for row in self.rows]
+
+    def check_values(self, value: Values, check: Check) -> Tuple[np.ndarray, np.ndarray]:
+        """(expected, actual) of a check."""
+        expected = self._compute(Node(check.node, check.name, check.terms), value)
+        return expected, value(check.node)
+
+    # -- formulas ---------------------------------------------------------
+
+    def formula(self, key: str, value: Values) -> Dict[str, object]:
+        """
+        A node's value with the value of each of its terms, summed over the
+        months `value` reads, for formula breakdowns. Negated nodes (costs)
+        are given as the positive amount their terms add up to.
+        """
+        node = self.nodes[key]
+        if node.ratio is not None:
+            parts = [Term(node.ratio[0]), Term(node.ratio[1])]
+        else:
+            parts = list(node.terms)
+        terms = []
+        for term in parts:
+            ref_key = source_key(term.ref) if isinstance(term.ref, int) else term.ref
+            v = value(ref_key)
+            label = self.nodes[ref_key].label if ref_key in self.nodes else f"Linha {term.ref}"
+            terms.append({
+                "key": ref_key,
+                "label": label,
+                "sign": term.sign,
+                "value": float(np.sum(np.abs(v) if term.absolute else v)),
+            })
+        if node.ratio is not None:
+            numerator, denominator = terms[0]["value"], terms[1]["value"]
+            total = numerator / denominator * 100 if denominator else 0.0
+        else:
+            total = float(np.sum(value(key)))
+        return {
+            "key": key,
+            "label": node.label,
+            "operation": "ratio" if node.ratio is not None else "sum",
+            "rate": node.rate,
+            "value": -total if node.negate else total,
+            "terms": terms,
+        }
+
+
+PNL_GRAPH = PnLGraph(NODES, DISPLAY_ROWS, CHECKS, CHECK_NODES)
@@ -3,6 +3,7 @@ from typing import List, Optional
 import pandas as pd
 from datetime import datetime
 from auth import get_current_user
+from schema import month_label, parse_month_label
 
 router = APIRouter()
 
@@ -28,7 +29,9 @@ async def get_pnl_line_transactions(
             "transactions": [...]
         }
     """
-    from main import current_df, current_mappings
+    from main import app_state
+    state = app_state.get()
+    current_df, current_mappings = state.df, state.mappings
     
     if current_df is None or current_df.empty:
         raise HTTPException(status_code=404, detail="No data loaded")
@@ -52,8 +55,8 @@ async def get_pnl_line_transactions(
     # Apply month filter if provided
     if month:
         if '-' in str(month):  # Format: 'YYYY-MM'
-            filtered_df = filtered_df[filtered_df['Mes_Competencia'] == month]
-        else:  # Integer month
+            filtered_df = filtered_df[filtered_df['Mes_Competencia'] == parse_month_label(month)]
+        else:  # Month code
             filtered_df = filtered_df[filtered_df['Mes_Competencia'] == int(month)]
     
     # Apply Centro de Custo filter
@@ -72,6 +75,9 @@ async def get_pnl_line_transactions(
             )
         ]
     
+    # current_df loaded from the store is grouped by month; list in upload order
+    filtered_df = filtered_df.sort_index()
+
     # Build transaction list
     transactions = []
     total = 0.0
@@ -79,7 +85,7 @@ async def get_pnl_line_transactions(
     for _, row in filtered_df.iterrows():
         transaction = {
             "date": row.get('Data de competência', '').strftime('%Y-%m-%d') if pd.notna(row.get('Data de competência')) else '',
-            "month": str(row.get('Mes_Competencia', '')),
+            "month": month_label(row['Mes_Competencia']) if row.get('Mes_Competencia', -1) >= 0 else '',
             "centro_custo": str(row.get('Centro de Custo 1', '')),
             "fornecedor": str(row.get('Nome do fornecedor/cliente', '')),
             "descricao": str(row.get('Descrição', '')),
@@ -91,7 +97,7 @@ async def get_pnl_line_transactions(
     
     return {
         "line_number": line_number,
-        "description": line_mapping.descricao,
+        "description": line_mapping.observacoes,
         "centro_custo_filter": line_mapping.centro_custo,
         "fornecedor_filter": line_mapping.fornecedor_cliente,
         "month": month if month else "all",
@@ -0,0 +1,140 @@
+"""
+Typed schema of the in-memory transaction frame (current_df).
+
+Applied at the end of process_upload: repeated text columns become
+categoricals, Mes_Competencia becomes an int32 month code and rarely used
+text (Observações, raw amounts) can be split off into a separate frame that is
+stored on disk and only loaded when a request needs it. The same goes for
+export columns no endpoint reads (see ANALYSIS_COLUMNS).
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ingest import MONEY_COLUMNS
+
+# Low-cardinality text columns of the Conta Azul export
+CATEGORICAL_COLUMNS = [
+    'Centro de Custo 1',
+    'Nome do fornecedor/cliente',
+    'Identificador do fornecedor/cliente',
+    'Categoria 1',
+    'Conta bancária',
+    'Situação',
+    'Descrição',
+    'Tipo',
+    'Tipo da operação',
+    'Forma de pgto/recbto',
+    'Recorrência',
+    'Agendado',
+]
+
+# Text nobody aggregates on, kept out of current_df (see store.py): free-form
+# notes and the amount as exported (already parsed into Valor_Num)
+FREE_TEXT_COLUMNS = ['Observações', 'Valor (R$)']
+
+# Columns read by the P&L, dashboard and drill-down endpoints; only these are
+# loaded into current_df, the rest of the export stays on disk
+ANALYSIS_COLUMNS = [
+    'Data de competência',
+    'Mes_Competencia',
+    'Valor_Num',
+    'Centro de Custo 1',
+    'Nome do fornecedor/cliente',
+    'Descrição',
+    'Categoria 1',
+    'cc_norm',
+    'supp_norm',
+    'desc_norm',
+    'match_text',
+    'cat_norm',
+]
+
+# Parsed amounts
+AMOUNT_COLUMNS = [col for col in MONEY_COLUMNS if col != 'Valor (R$)'] + ['Valor_Num']
+
+# Mes_Competencia: months since year 0 (year * 12 + month - 1); NO_MONTH for
+# rows without a competence date
+MONTH_CODE_DTYPE = np.int32
+NO_MONTH = -1
+
+
+def month_code(dates: pd.Series) -> pd.Series:
+    """int32 month code of a datetime column (NO_MONTH for NaT)."""
+    codes = dates.dt.year * 12 + dates.dt.month - 1
+    return codes.fillna(NO_MONTH).astype(MONTH_CODE_DTYPE)
+
+
+def month_label(code: int) -> str:
+    """'YYYY-MM' label of a month code (same text as str(pd.Period(..., 'M')))."""
+    year, month = divmod(int(code), 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+def parse_month_label(label) -> int:
+    """Month code of a 'YYYY-MM' label or Period; NO_MONTH when not a month."""
+    if isinstance(label, pd.Period):
+        return label.year * 12 + label.month - 1
+    try:
+        year, month = str(label).strip().split('-')[:2]
+        year, month = int(year), int(month)
+    except (TypeError, ValueError):
+        return NO_MONTH
+    return year * 12 + month - 1 if 1 <= month <= 12 else NO_MONTH
+
+
+def to_month_codes(month_col: pd.Series) -> np.ndarray:
+    """
+    Month codes of a Mes_Competencia column, whatever its representation:
+    int codes (current schema), Periods (frames saved before it) or 'YYYY-MM'
+    strings. Each distinct value is converted once.
+    """
+    if pd.api.types.is_integer_dtype(month_col.dtype):
+        return month_col.to_numpy(dtype=MONTH_CODE_DTYPE)
+    codes, uniques = pd.factorize(month_col)
+    lookup = np.array([parse_month_label(u) for u in uniques] + [NO_MONTH], dtype=MONTH_CODE_DTYPE)
+    return lookup[codes]
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a cleaned transaction frame to the compact schema (in place)."""
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in AMOUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(np.float64)
+    if 'Mes_Competencia' in df.columns:
+        df['Mes_Competencia'] = to_month_codes(df['Mes_Competencia'])
+    return df
+
+
+def has_schema(df: pd.DataFrame) -> bool:
+    """True when the frame already uses the compact schema."""
+    return 'Mes_Competencia' not in df.columns or pd.api.types.is_integer_dtype(df['Mes_Competencia'].dtype)
+
+
+def split_free_text(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    (frame without the free-text columns, free-text columns) sharing the index.
+    The text frame also carries Mes_Competencia so it can be read by month.
+    """
+    text_cols = [col for col in FREE_TEXT_COLUMNS if col in df.columns]
+    key_cols = ['Mes_Competencia'] if 'Mes_Competencia' in df.columns else []
+    return df.drop(columns=text_cols), df[text_cols + key_cols]
+
+
+def analysis_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """The ANALYSIS_COLUMNS of a transaction frame (those it has)."""
+    return df[[col for col in ANALYSIS_COLUMNS if col in df.columns]]
+
+
+def memory_report(df: pd.DataFrame) -> Dict[str, float]:
+    """Deep memory usage in MB: total plus the five largest columns."""
+    usage = df.memory_usage(deep=True, index=False) / 2**20
+    report = {'total_mb': round(float(usage.sum()), 2)}
+    for col, mb in usage.sort_values(ascending=False).head(5).items():
+        report[col] = round(float(mb), 2)
+    return report
@@ -0,0 +1,113 @@
+"""
+Versioned, immutable snapshots of the transaction store, shared by the
+uvicorn workers of one machine (data/snapshots/).
+
+An upload writes its files into a new directory snapshots/<version>/ and
+publishes it by atomically rewriting snapshots/CURRENT. A published snapshot
+is never modified, so every worker memory-maps it without coordination: each
+one compares CURRENT with the version it has loaded (one stat() per request)
+and reopens the snapshot when it changed. Older snapshots are pruned after
+publishing; a worker still mapping one keeps reading it (an unlinked file
+stays valid while it is mapped).
+
+An upload that builds on the published snapshot (an append) reads it and
+publishes its successor under writer_lock(), so no other publisher can slip
+in between and have its snapshot overwritten.
+"""
+
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from store import write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: publishers are serialized within the process only
+    fcntl = None
+
+
+class SnapshotStore:
+    """Publish and locate versioned snapshot directories."""
+
+    def __init__(self, root: Path, keep: int = 2):
+        self.root = Path(root)
+        self.current_path = self.root / 'CURRENT'
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._stat: Optional[Tuple[int, int, int]] = None
+        self._version = 0
+
+    def current(self) -> int:
+        """Published version (0: nothing published). Re-read only when CURRENT changed."""
+        try:
+            st = os.stat(self.current_path)
+        except FileNotFoundError:
+            return 0
+        stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stat != self._stat:
+                with open(self.current_path, 'r') as f:
+                    self._version = json.load(f)['version']
+                self._stat = stat
+            return self._version
+
+    def directory(self, version: Optional[int] = None) -> Path:
+        """Directory of the given snapshot (default: the published one)."""
+        return self.root / str(self.current() if version is None else version)
+
+    def path(self, name: str, version: Optional[int] = None) -> Path:
+        """A file of the given snapshot (default: the published one)."""
+        return self.directory(version) / name
+
+    def _versions(self) -> List[int]:
+        if not self.root.exists():
+            return []
+        return sorted(int(p.name) for p in self.root.iterdir() if p.is_dir() and p.name.isdigit())
+
+    def _allocate(self) -> Tuple[int, Path]:
+        # mkdir is atomic: concurrent publishers never share a directory
+        self.root.mkdir(parents=True, exist_ok=True)
+        while True:
+            version = max(self._versions() + [self.current()]) + 1
+            directory = self.root / str(version)
+            try:
+                directory.mkdir()
+                return version, directory
+            except FileExistsError:
+                continue
+
+    @contextmanager
+    def writer_lock(self) -> Iterator[None]:
+        """Exclusive right to read-then-publish, across threads and worker processes."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._writer_lock, open(self.root / '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def publish(self) -> Iterator[Path]:
+        """
+        Yield a new snapshot directory (named after its version) to write;
+        it is published when the block succeeds and discarded if it raises.
+        """
+        version, directory = self._allocate()
+        try:
+            yield directory
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        write_json(self.current_path, {'version': version})
+        self._prune(version)
+
+    def _prune(self, published: int):
+        """Remove snapshots older than the last `keep` (in-progress, newer ones are kept)."""
+        older = [v for v in self._versions() if v < published]
+        for version in older[:max(len(older) - self.keep + 1, 0)]:
+            shutil.rmtree(self.root / str(version), ignore_errors=True)
@@ -0,0 +1,339 @@
+"""
+Optional SQLite storage backend (enabled with the SQLITE_PATH env var).
+
+One local database file holds the transactions, the mapping table and the
+overrides. Transactions are indexed on month, cost center and supplier, so
+the P&L is pre-aggregated with GROUP BY (one row per matching key and month)
+and the drill-down is an indexed lookup instead of a scan of current_df.
+Fingerprint and key columns (see dedup.py) are indexed too, so an append
+upload looks its rows up without scanning the stored history.
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema
+
+# current_df column -> transactions column
+TRANSACTION_COLUMNS = {
+    'Data de competência': 'date',
+    'Mes_Competencia': 'month',
+    'Valor_Num': 'amount',
+    'Centro de Custo 1': 'cost_center',
+    'Nome do fornecedor/cliente': 'supplier',
+    'Descrição': 'description',
+    'Categoria 1': 'category',
+    'Observações': 'notes',
+    'cc_norm': 'cc_norm',
+    'supp_norm': 'supp_norm',
+    'desc_norm': 'desc_norm',
+    'match_text': 'match_text',
+    'cat_norm': 'cat_norm',
+    'fingerprint': 'fingerprint',
+    'match_key': 'match_key',
+}
+FRAME_COLUMNS = {sql: col for col, sql in TRANSACTION_COLUMNS.items()}
+
+# Keys the mapping classifier reads; the P&L groups on them
+MATCH_KEYS = ['cc_norm', 'supp_norm', 'desc_norm', 'match_text', 'cat_norm']
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    row_id INTEGER PRIMARY KEY,  -- current_df index
+    date TEXT,
+    month INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    cost_center TEXT,
+    supplier TEXT,
+    description TEXT,
+    category TEXT,
+    notes TEXT,
+    cc_norm TEXT,
+    supp_norm TEXT,
+    desc_norm TEXT,
+    match_text TEXT,
+    cat_norm TEXT,
+    fingerprint INTEGER,  -- dedup.py, NULL for rows stored before fingerprints
+    match_key INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_month ON transactions (month);
+CREATE INDEX IF NOT EXISTS idx_transactions_cost_center ON transactions (cost_center, month);
+CREATE INDEX IF NOT EXISTS idx_transactions_supplier ON transactions (supplier, month);
+CREATE TABLE IF NOT EXISTS mappings (
+    position INTEGER PRIMARY KEY,
+    mapping TEXT NOT NULL  -- MappingItem as JSON
+);
+CREATE TABLE IF NOT EXISTS overrides (
+    line TEXT NOT NULL,
+    month TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (line, month)
+);
+"""
+
+# Created once the columns exist (databases created before them are altered)
+FINGERPRINT_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_transactions_fingerprint ON transactions (fingerprint);
+CREATE INDEX IF NOT EXISTS idx_transactions_match_key ON transactions (match_key);
+"""
+
+LOOKUP_BATCH = 500  # Parameters per IN (...) lookup
+
+
+def _sql_values(col: pd.Series) -> List[Any]:
+    """Column values as SQLite parameters (None for missing)."""
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        col = col.dt.strftime(DATE_FORMAT)
+    values = col.astype(object)
+    return values.where(col.notna(), None).tolist()
+
+
+def _contains(values: List[Optional[str]], needle: str) -> List[str]:
+    """
+    The distinct values containing `needle`, case-insensitively, as
+    Series.astype(str).str.contains(needle, case=False, na=False, regex=False)
+    matches them (missing values never match).
+    """
+    needle = needle.upper()
+    return [v for v in values if v is not None and needle in str(v).upper()]
+
+
+class TransactionWriter:
+    """
+    Replace the stored transactions (or append to them) with chunks written
+    in one SQLite transaction: committed on success, rolled back if the block
+    raises.
+    """
+
+    def __init__(self, store: 'SqliteStore', append: bool = False):
+        self.store = store
+        self.append = append
+        self.rows = 0
+        self._conn = None
+
+    def __enter__(self) -> 'TransactionWriter':
+        self._conn = self.store.connect()
+        self._conn.execute('BEGIN IMMEDIATE')
+        if not self.append:
+            self._conn.execute('DELETE FROM transactions')
+        return self
+
+    def next_row_id(self) -> int:
+        """First free row_id (index label of the next appended row)."""
+        return self._conn.execute('SELECT COALESCE(MAX(row_id) + 1, 0) FROM transactions').fetchone()[0]
+
+    def write(self, chunk: pd.DataFrame):
+        cols = [col for col in TRANSACTION_COLUMNS if col in chunk.columns]
+        names = ['row_id'] + [TRANSACTION_COLUMNS[col] for col in cols]
+        rows = zip(chunk.index.tolist(), *(_sql_values(chunk[col]) for col in cols))
+        self._conn.executemany(
+            f"INSERT INTO transactions ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            rows,
+        )
+        self.rows += len(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self._conn.close()
+        return False
+
+
+class SqliteStore:
+    """Transactions, mappings and overrides in one local SQLite database."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            # WAL: readers keep working while an upload is being written
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(transactions)')}
+            for column in ('fingerprint', 'match_key'):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE transactions ADD COLUMN {column} INTEGER')
+            conn.executescript(FINGERPRINT_INDEXES)
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # Transactions
+
+    def transaction_writer(self, append: bool = False) -> TransactionWriter:
+        return TransactionWriter(self, append)
+
+    def write_transactions(self, df: pd.DataFrame):
+        with self.transaction_writer() as writer:
+            writer.write(df)
+
+    def has_transactions(self) -> bool:
+        with self._connection() as conn:
+            return conn.execute('SELECT 1 FROM transactions LIMIT 1').fetchone() is not None
+
+    def clear_transactions(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM transactions')
+
+    def has_unfingerprinted(self) -> bool:
+        """Rows stored before fingerprints, which append uploads can't match."""
+        with self._connection() as conn:
+            return conn.execute('SELECT 1 FROM transactions WHERE fingerprint IS NULL LIMIT 1').fetchone() is not None
+
+    def lookup_fingerprints(self, fingerprints: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(fingerprint stored?, key stored?) per row, by indexed lookups."""
+        found = []
+        with self._connection() as conn:
+            for column, values in (('fingerprint', fingerprints), ('match_key', keys)):
+                unique = np.unique(values).tolist()
+                stored = set()
+                for i in range(0, len(unique), LOOKUP_BATCH):
+                    batch = unique[i:i + LOOKUP_BATCH]
+                    stored.update(row[0] for row in conn.execute(
+                        f"SELECT {column} FROM transactions WHERE {column} IN ({', '.join('?' * len(batch))})", batch))
+                found.append(np.isin(values, np.fromiter(stored, dtype=np.int64, count=len(stored))))
+        return found[0], found[1]
+
+    def _query_frame(self, sql: str, params=()) -> pd.DataFrame:
+        with self._connection() as conn:
+            df = pd.read_sql_query(sql, conn, params=params, index_col='row_id')
+        df.index.name = None
+        df = df.rename(columns=FRAME_COLUMNS)
+        if 'Data de competência' in df.columns:
+            df['Data de competência'] = pd.to_datetime(df['Data de competência'], format=DATE_FORMAT)
+        return df
+
+    def read_transactions(self, columns: Optional[List[str]] = None, start_row_id: Optional[int] = None) -> pd.DataFrame:
+        """Stored transactions (from `start_row_id` on) as a current_df frame (compact schema)."""
+        wanted = [TRANSACTION_COLUMNS[col] for col in (columns or TRANSACTION_COLUMNS) if col in TRANSACTION_COLUMNS]
+        where = ' WHERE row_id >= ?' if start_row_id is not None else ''
+        params = (start_row_id,) if start_row_id is not None else ()
+        df = self._query_frame(f"SELECT row_id, {', '.join(wanted)} FROM transactions{where} ORDER BY row_id", params)
+        return apply_schema(df)
+
+    def pnl_groups(self, start_date: str = None, end_date: str = None, start_row_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Transactions summed (and counted) per (matching keys, month), within
+        the date range (and from `start_row_id` on). calculate_pnl accepts
+        the result in place of current_df: every row of a group is classified
+        to the same line, so the line x month totals match.
+        """
+        where, params = [], []
+        if start_row_id is not None:
+            where.append('row_id >= ?')
+            params.append(start_row_id)
+        if start_date:
+            where.append('date >= ?')
+            params.append(pd.to_datetime(start_date).strftime(DATE_FORMAT))
+        if end_date:
+            where.append('date <= ?')
+            params.append(pd.to_datetime(end_date).strftime(DATE_FORMAT))
+        keys = ', '.join(MATCH_KEYS)
+        sql = (
+            f"SELECT {keys}, month AS Mes_Competencia, SUM(amount) AS Valor_Num, COUNT(*) AS Qtd_Transacoes FROM transactions"
+            + (f" WHERE {' AND '.join(where)}" if where else '')
+            + f" GROUP BY {keys}, month"
+        )
+        with self._connection() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        if df['cat_norm'].isna().all():
+            # Export without a category column
+            df = df.drop(columns='cat_norm')
+        return df.fillna('')
+
+    def _distinct(self, column: str) -> List[Optional[str]]:
+        # Index-only scan of (column, month)
+        with self._connection() as conn:
+            return [row[0] for row in conn.execute(f'SELECT DISTINCT {column} FROM transactions')]
+
+    def line_transactions(self, month: Optional[int] = None, cost_center: str = None, supplier: str = None) -> pd.DataFrame:
+        """
+        Drill-down rows: month equal to `month`, cost center and supplier
+        containing the given filters (case-insensitive), in upload order.
+        The filters are resolved against the distinct values first, so the
+        query itself is an index lookup.
+        """
+        where, params = [], []
+        for column, needle in (('cost_center', cost_center), ('supplier', supplier)):
+            if not needle:
+                continue
+            values = _contains(self._distinct(column), needle)
+            where.append(f"{column} IN ({', '.join('?' * len(values))})" if values else '0')
+            params.extend(values)
+        if month is not None:
+            where.append('month = ?')
+            params.append(int(month))
+        cols = ['date', 'month', 'amount', 'cost_center', 'supplier', 'description', 'category', 'notes']
+        sql = f"SELECT row_id, {', '.join(cols)} FROM transactions"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        return self._query_frame(sql + ' ORDER BY row_id', params)
+
+    # Mappings and overrides
+
+    def load_mappings(self) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            return [json.loads(row[0]) for row in conn.execute('SELECT mapping FROM mappings ORDER BY position')]
+
+    def save_mappings(self, mappings: List[Dict[str, Any]]):
+        with self._lock, self._connection() as conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM mappings')
+            conn.executemany(
+                'INSERT INTO mappings (position, mapping) VALUES (?, ?)',
+                [(i, json.dumps(m)) for i, m in enumerate(mappings)],
+            )
+            conn.execute('COMMIT')
+
+    def load_overrides(self) -> Dict[str, Dict[str, float]]:
+        overrides: Dict[str, Dict[str, float]] = {}
+        with self._connection() as conn:
+            for line, month, value in conn.execute('SELECT line, month, value FROM overrides'):
+                overrides.setdefault(line, {})[month] = value
+        return overrides
+
+    def save_overrides(self, overrides: Dict[str, Dict[str, float]]):
+        with self._lock, self._connection() as conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM overrides')
+            conn.executemany(
+                'INSERT INTO overrides (line, month, value) VALUES (?, ?, ?)',
+                [(line, month, value) for line, months in overrides.items() for month, value in months.items()],
+            )
+            conn.execute('COMMIT')
+
+    def set_override(self, line: str, month: str, value: float):
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO overrides (line, month, value) VALUES (?, ?, ?)', (line, month, value))
+
+    def clear_overrides(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM overrides')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connection() as conn:
+            rows = conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+        return {'path': str(self.path), 'transactions': rows}
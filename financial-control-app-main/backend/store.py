@@ -0,0 +1,289 @@
+"""
+On-disk store for the transaction frame (data/current_data.arrow).
+
+Frames are stored as Arrow IPC files (Feather v2, uncompressed) and read back
+memory-mapped, so opening the store is zero-copy and only the columns asked
+for are converted to pandas. Every chunk written is split into one record
+batch per month (Mes_Competencia): an upload can be written incrementally
+while it is being processed and readers can skip the months they don't need.
+
+A snapshot may hold several segments: the frame written by a full upload
+plus one per append upload, listed in its manifest.json (see Segment).
+Readers concatenate them in order; the rows of an appended segment carry
+index labels after those of the segments before it.
+
+Small JSON artifacts (mappings, overrides, metadata) are written with
+write_json, atomically as well.
+
+Pickle files of the previous format (a stream of pickled DataFrame chunks)
+can still be read with read_pickled_frame, to migrate them.
+"""
+
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ingest import concat_chunks
+
+MONTH_COLUMN = 'Mes_Competencia'
+MANIFEST_FILE = 'manifest.json'
+
+
+def _stored_type(field: pa.Field, column: pa.ChunkedArray) -> pa.DataType:
+    """
+    Arrow type a column keeps for the whole file. Dictionary indices are
+    widened to int32 (later chunks may add categories). A column with no
+    values, which pandas reads as float64, is stored as plain text: an IPC
+    file can't grow an empty dictionary (read_frame restores the categorical).
+    """
+    value_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+    if column.null_count == len(column) and (pa.types.is_floating(value_type) or pa.types.is_null(value_type)):
+        return pa.large_string()
+    if pa.types.is_dictionary(field.type):
+        return pa.dictionary(pa.int32(), value_type)
+    return value_type
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """
+    Cast a chunk's table to the file schema. All-missing columns become typed
+    nulls, except dictionaries: theirs must stay the file's dictionary.
+    """
+    columns = []
+    for field in schema:
+        column = table.column(field.name)
+        if column.type != field.type:
+            if column.null_count == len(column) and not pa.types.is_dictionary(field.type):
+                column = pa.nulls(len(column), field.type)
+            else:
+                try:
+                    column = column.cast(field.type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                    raise ValueError(f"Column '{field.name}' changed type between chunks: {e}")
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _month_batches(chunk: pd.DataFrame) -> List[np.ndarray]:
+    """Row positions of each month of the chunk, in row order within a month."""
+    if MONTH_COLUMN not in chunk.columns or chunk.empty:
+        return [np.arange(len(chunk))]
+    months = chunk[MONTH_COLUMN].to_numpy()
+    order = np.argsort(months, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(months[order])) + 1)
+
+
+class FrameChunkWriter:
+    """
+    Append DataFrame chunks (same columns) to a temporary Arrow file and
+    atomically replace the target on success. If the block raises, the
+    previous file is left intact.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+        # Categories of each categorical column so far; chunks are re-coded
+        # against them so every batch only appends to the file's dictionaries
+        self._categories: Dict[str, pd.Index] = {}
+
+    def __enter__(self) -> 'FrameChunkWriter':
+        self._file = pa.OSFile(str(self.tmp_path), 'wb')
+        return self
+
+    def _extend_categories(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        recoded = {}
+        for col in chunk.columns:
+            if not isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                continue
+            categories = chunk[col].cat.categories
+            known = self._categories.get(col)
+            if known is None or known.empty:
+                known = categories
+            elif not categories.empty:
+                known = known.append(categories[~categories.isin(known)])
+            self._categories[col] = known
+            if not categories.equals(known):
+                recoded[col] = chunk[col].cat.set_categories(known)
+        return chunk.assign(**recoded) if recoded else chunk
+
+    def _open(self, table: pa.Table):
+        # The first chunk fixes the schema (and the pandas metadata)
+        schema = pa.schema(
+            [pa.field(f.name, _stored_type(f, table.column(f.name))) for f in table.schema],
+            metadata=table.schema.metadata,
+        )
+        options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        self._writer = pa.ipc.new_file(self._file, schema, options=options)
+        self._schema = schema
+
+    def write(self, chunk: pd.DataFrame):
+        table = pa.Table.from_pandas(self._extend_categories(chunk), preserve_index=True)
+        if self._writer is None:
+            self._open(table)
+        table = _conform(table, self._schema)
+        for rows in _month_batches(chunk):
+            self._writer.write_table(table.take(rows))
+        self.rows += len(chunk)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._writer is None and exc_type is None:
+            # Nothing written: store an empty frame
+            self._open(pa.table({}))
+        if self._writer is not None:
+            self._writer.close()
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+        return False
+
+
+def write_frame(path: Path, df: pd.DataFrame):
+    """Write a whole frame (one record batch per month)."""
+    with FrameChunkWriter(path) as writer:
+        writer.write(df)
+
+
+def write_json(path: Path, obj):
+    """Write a JSON file atomically: a crash mid-write leaves the previous file."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _categorical_columns(schema: pa.Schema) -> List[str]:
+    pandas_metadata = schema.pandas_metadata or {}
+    return [col['name'] for col in pandas_metadata.get('columns', []) if col.get('pandas_type') == 'categorical']
+
+
+def _index_columns(schema: pa.Schema) -> List[str]:
+    pandas_metadata = schema.pandas_metadata or {}
+    return [col for col in pandas_metadata.get('index_columns', []) if isinstance(col, str)]
+
+
+def read_frame(path: Path, columns: Optional[List[str]] = None, months: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """
+    Load the stored frame, memory-mapped. `columns` restricts the columns
+    converted (missing ones are ignored) and `months` the Mes_Competencia
+    codes: record batches of other months are not read.
+
+    Rows keep their index but come back grouped by month within each chunk
+    written. Rows of the same month stay in order, so per-month sums (the P&L
+    line x month aggregation) are identical to those over the written frame.
+    """
+    reader = pa.ipc.open_file(pa.memory_map(str(path)))
+    batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+    if months is not None:
+        wanted = {int(m) for m in months}
+        batches = [b for b in batches if b.num_rows and b.column(MONTH_COLUMN)[0].as_py() in wanted]
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+
+    if columns is not None:
+        index_cols = _index_columns(table.schema)
+        table = table.select([col for col in columns if col in table.column_names] + index_cols)
+    df = table.to_pandas()
+    for col in _categorical_columns(table.schema):
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def iter_pickled_chunks(path: Path) -> Iterator[pd.DataFrame]:
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def read_pickled_frame(path: Path) -> pd.DataFrame:
+    """Load a frame stored as pickled chunks (or a single pickle) by older versions."""
+    return concat_chunks(list(iter_pickled_chunks(path)))
+
+
+class Segment(NamedTuple):
+    """Rows of a snapshot written by one upload (the full one or an append)."""
+    version: int                   # Snapshot that wrote it (files are linked into later ones)
+    data: str                      # Frame file
+    text: str                      # Free-text file
+    fingerprints: Optional[str]    # Sorted fingerprints and keys (.npy), None: not computed
+    rows: int
+    end: int                       # One past the largest index label
+    months: List[int]              # Mes_Competencia codes of its rows
+    source: Optional[str] = None   # SHA-256 of the uploaded file
+
+
+def _describe_frame(path: Path, version: int, data: str, text: str) -> Segment:
+    """Segment of a frame file written before manifests, from its metadata and index."""
+    reader = pa.ipc.open_file(pa.memory_map(str(path)))
+    batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]
+    batches = [b for b in batches if b.num_rows]
+    index_cols = _index_columns(reader.schema)
+    months = sorted({b.column(MONTH_COLUMN)[0].as_py() for b in batches}) if MONTH_COLUMN in reader.schema.names else []
+    end = max((pc.max(b.column(index_cols[0])).as_py() + 1 for b in batches), default=0) if index_cols else 0
+    return Segment(version, data, text, None, sum(b.num_rows for b in batches), end, months)
+
+
+def read_manifest(directory: Path, data_file: str, text_file: str) -> List[Segment]:
+    """Segments of a snapshot directory, in order (a frame file without manifest is one segment)."""
+    directory = Path(directory)
+    manifest_path = directory / MANIFEST_FILE
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            return [Segment(**segment) for segment in json.load(f)]
+    if not (directory / data_file).exists():
+        return []
+    return [_describe_frame(directory / data_file, int(directory.name), data_file, text_file)]
+
+
+def link_file(source: Path, target: Path):
+    """Share an immutable file between snapshots (hard link, or a copy where links fail)."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def write_manifest(directory: Path, segments: Sequence[Segment]):
+    write_json(Path(directory) / MANIFEST_FILE, [segment._asdict() for segment in segments])
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """concat_chunks keeping the index labels (the frames are not consumed)."""
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    index = frames[0].index.append([frame.index for frame in frames[1:]])
+    df = concat_chunks([frame.copy(deep=False) for frame in frames])
+    df.index = index
+    return df
+
+
+def read_segments(directory: Path, files: Iterable[str], columns: Optional[List[str]] = None,
+                  months: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """read_frame of several segment files of a snapshot, concatenated in order."""
+    months = None if months is None else list(months)
+    return concat_frames([read_frame(Path(directory) / name, columns=columns, months=months) for name in files])
@@ -0,0 +1,254 @@
+"""
+Tests for the immutable application state and its read-copy-update holder,
+including a stress test of the API under concurrent uploads and edits.
+Run with: pytest backend/test_app_state.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app_state import AppState, StateHolder
+from benchmark_ingest import make_extrato_bytes
+from logic import calculate_pnl, get_initial_mappings, process_upload
+from models import MappingItem, PnLResponse
+from pnl_cache import CacheKey, hash_mappings
+
+
+class TestAppState:
+
+    def test_edits_build_new_states(self):
+        state = AppState.initial()
+        edited = state.apply({'op': 'override', 'line': '106', 'month': '2025-01', 'value': 1.0})
+        edited = edited.apply({'op': 'override', 'line': '106', 'month': '2025-02', 'value': 2.0})
+
+        assert state.overrides == {}
+        assert edited.overrides == {'106': {'2025-01': 1.0, '2025-02': 2.0}}
+        assert edited.apply({'op': 'clear_overrides'}).overrides == {}
+        assert edited.overrides == {'106': {'2025-01': 1.0, '2025-02': 2.0}}
+
+        first = get_initial_mappings()[0].model_dump()
+        assert edited.apply({'op': 'set_mappings', 'mappings': [first]}).mappings[0].model_dump() == first
+        assert len(edited.mappings) == len(get_initial_mappings())
+
+    def test_with_frame_bumps_data_version(self):
+        state = AppState.initial().with_frame(None, snapshot_version=3)
+        assert (state.data_version, state.snapshot_version) == (1, 3)
+
+    def test_concurrent_updates_are_not_lost(self):
+        holder = StateHolder(AppState.initial())
+
+        def edit(worker):
+            for i in range(200):
+                holder.update(lambda s: s.with_override(str(worker), str(i), float(i)))
+
+        threads = [threading.Thread(target=edit, args=(w,)) for w in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert sum(len(months) for months in holder.get().overrides.values()) == 8 * 200
+
+
+def same_pnl(actual: PnLResponse, expected: PnLResponse) -> bool:
+    return (
+        actual.headers == expected.headers
+        and [r.line_number for r in actual.rows] == [r.line_number for r in expected.rows]
+        and all(a.values == pytest.approx(e.values, abs=1e-6) for a, e in zip(actual.rows, expected.rows))
+    )
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # main keeps its data under ./data: run it in an empty directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('SQLITE_PATH', raising=False)
+    from fastapi.testclient import TestClient
+
+    import main
+    from auth import get_current_user
+
+    main.app.dependency_overrides[get_current_user] = lambda: {'name': 'Stress Test'}
+    main.replace_frame(None, 0)
+    main.app_state.update(lambda s: s.with_mappings(get_initial_mappings())._replace(overrides={}))
+    with TestClient(main.app) as client:
+        yield client
+    main.app.dependency_overrides.clear()
+
+
+def upload_and_wait(api, data: bytes):
+    r = api.post('/upload', files={'file': ('extrato.csv', data, 'text/csv')})
+    while api.get(r.json()['status_url']).json()['status'] not in ('done', 'failed'):
+        time.sleep(0.02)
+
+
+class TestOverrideApi:
+
+    def test_override_returns_the_changed_cells(self, api):
+        data = make_extrato_bytes(400)
+        upload_and_wait(api, data)
+        pnl = PnLResponse.model_validate(api.get('/pnl').json())
+        month = pnl.headers[0]
+        assert [row.line_number for row in pnl.rows if row.editable] == [1, 13, 16]
+
+        # The grid sends the display row of EBITDA; the override pins line 106
+        r = api.post('/pnl/override', json={'line_number': 13, 'month': month, 'value': 0.0})
+        assert r.status_code == 200
+        cells = {cell['line_number']: cell['value'] for cell in r.json()['cells']}
+        assert cells == {13: 0.0, 14: 0.0}
+
+        expected = calculate_pnl(process_upload(data), get_initial_mappings(), {'106': {month: 0.0}})
+        assert PnLResponse.model_validate(api.get('/pnl').json()) == expected
+        assert r.json()['validation_alerts'] == [
+            a.model_dump() for a in expected.validation_alerts if a.month == month
+        ]
+
+    def test_invalid_override_is_rejected(self, api):
+        assert api.post('/pnl/override', json={'month': '2025-01', 'value': 1.0}).status_code == 400
+        assert api.post('/pnl/override', json={'line_number': 'x', 'month': '2025-01', 'value': 1.0}).status_code == 400
+
+
+class TestMappingApi:
+
+    def test_mapping_edit_remaps_the_cached_cube(self, api):
+        import main
+
+        data = make_extrato_bytes(400)
+        upload_and_wait(api, data)
+        api.get('/pnl')
+        mappings = [m.model_dump() for m in get_initial_mappings()]
+        for m in mappings:
+            if m['centro_custo'] == 'Marketing & Growth Expenses':
+                m['linha_pl'] = '90'
+        assert api.post('/mappings', json={'mappings': mappings}).status_code == 200
+
+        # Built from the previous mappings' cube, before its entries were dropped
+        state = main.app_state.get()
+        assert main.pnl_cache.get(CacheKey('cube', state.data_version, hash_mappings(state.mappings), '')) is not None
+        pnl = PnLResponse.model_validate(api.get('/pnl').json())
+        edited = [MappingItem(**m) for m in mappings]
+        assert pnl == calculate_pnl(process_upload(data), edited)
+
+    def test_preview_does_not_change_the_mappings(self, api):
+        upload_and_wait(api, make_extrato_bytes(400))
+        before = api.get('/pnl').json()
+        mappings = [m.model_dump() for m in get_initial_mappings()]
+        for m in mappings:
+            if m['centro_custo'] == 'Marketing & Growth Expenses':
+                m['linha_pl'] = '90'
+
+        r = api.post('/mappings/preview', json={'mappings': mappings})
+        assert r.status_code == 200
+        preview = r.json()
+        assert preview['rows_moved'] > 0
+        assert {(m['from_line'], m['to_line']) for m in preview['moves']} == {(56, 90)}
+        assert {c['line_number'] for c in preview['cells']} >= {9, 12}  # Marketing, Outras Despesas
+
+        assert api.get('/mappings').json() == [m.model_dump() for m in get_initial_mappings()]
+        assert api.get('/pnl').json() == before
+
+
+class TestMigration:
+
+    def test_workers_starting_together_migrate_once(self, api):
+        import main
+        from store import write_frame
+
+        frame = process_upload(make_extrato_bytes(200))
+        main.DATA_DIR.mkdir(exist_ok=True)
+        write_frame(main.UNVERSIONED_CSV_PATH, frame)
+        failures = []
+
+        def start_worker():
+            try:
+                main.migrate_unversioned_data()
+            except Exception as e:
+                failures.append(repr(e))
+
+        workers = [threading.Thread(target=start_worker) for _ in range(4)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        assert failures == []
+        assert main.snapshots.current() == 1
+        assert not main.UNVERSIONED_CSV_PATH.exists()
+        assert (main.snapshots.directory(1) / main.DATA_FILE).exists()
+
+
+class TestConcurrentApi:
+
+    def test_reads_see_whole_states_during_uploads_and_edits(self, api):
+        uploads = [make_extrato_bytes(400), make_extrato_bytes(800)]
+        frames = [process_upload(data) for data in uploads]
+        mappings = get_initial_mappings()
+        month = calculate_pnl(frames[0], mappings).headers[0]
+        edits = 30
+
+        # Every P&L a reader may see: either dataset, with any override value
+        # the edits went through (or none yet)
+        expected = [
+            calculate_pnl(frame, mappings, {'106': {month: float(i)}} if i is not None else None)
+            for frame in frames
+            for i in [None] + list(range(edits))
+        ]
+
+        writers_done = threading.Event()
+        failures = []
+
+        def upload(k):
+            r = api.post('/upload', files={'file': ('extrato.csv', uploads[k], 'text/csv')})
+            if r.status_code != 202:
+                failures.append(r.text)
+                return
+            # Wait for the job, as the frontend does
+            while api.get(r.json()['status_url']).json()['status'] not in ('done', 'failed'):
+                time.sleep(0.02)
+
+        upload(0)
+
+        def uploader():
+            for i in range(6):
+                upload((i + 1) % 2)
+
+        def editor():
+            for i in range(edits):
+                r = api.post('/pnl/override', json={'line_number': 106, 'month': month, 'value': i})
+                if r.status_code != 200:
+                    failures.append(r.text)
+
+        def reader():
+            reads = 0
+            while not writers_done.is_set() or reads < 5:
+                r = api.get('/pnl')
+                reads += 1
+                if r.status_code != 200:
+                    failures.append(r.text)
+                    continue
+                pnl = PnLResponse.model_validate(r.json())
+                if not any(same_pnl(pnl, e) for e in expected):
+                    failures.append(f'inconsistent P&L: {pnl.headers}')
+                if api.get('/dashboard').status_code != 200:
+                    failures.append('dashboard failed')
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        writers = [threading.Thread(target=uploader), threading.Thread(target=editor)]
+        for t in readers + writers:
+            t.start()
+        for t in writers:
+            t.join()
+        writers_done.set()
+        for t in readers:
+            t.join()
+
+        assert failures == []
+        final = PnLResponse.model_validate(api.get('/pnl').json())
+        # Last upload: dataset 0, last edit: value edits - 1
+        assert same_pnl(final, expected[edits])
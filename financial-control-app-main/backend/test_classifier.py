@@ -0,0 +1,131 @@
+"""
+Tests for the vectorized mapping classifier.
+Run with: pytest backend/test_classifier.py -v
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_pnl import legacy_classify, legacy_match_columns, make_synthetic_frame
+from classifier import MappingClassifier, UNMAPPED
+from logic import add_match_columns, get_initial_mappings
+from models import MappingItem
+
+
+def create_mapping(fornecedor: str, linha_pl: str, centro_custo: str) -> MappingItem:
+    return MappingItem(
+        grupo_financeiro=centro_custo,
+        centro_custo=centro_custo,
+        fornecedor_cliente=fornecedor,
+        linha_pl=linha_pl,
+        tipo="Despesa",
+        ativo="Sim"
+    )
+
+
+def classify(df, mappings):
+    df = add_match_columns(df)
+    return MappingClassifier(mappings).classify(df)
+
+
+class TestMappingClassifier:
+
+    def test_matches_legacy_loop_on_synthetic_data(self):
+        """Vectorized classification must be identical to the original row loop"""
+        mappings = get_initial_mappings()
+        df = add_match_columns(make_synthetic_frame(3000, seed=7))
+
+        expected = legacy_classify(df, mappings)
+        actual = MappingClassifier(mappings).classify_indices(df['cc_norm'], df['match_text'], df['cat_norm'])
+
+        assert np.array_equal(actual, expected)
+
+    def test_longest_supplier_wins(self):
+        """'AWS SES' must beat 'AWS' when both are substrings"""
+        df = pd.DataFrame({
+            'Centro de Custo 1': ['Web Services Expenses', 'Web Services Expenses'],
+            'Nome do fornecedor/cliente': ['AWS SES', 'AWS'],
+            'Descrição': ['', ''],
+            'Categoria 1': ['', ''],
+        })
+        lines = classify(df, get_initial_mappings())
+
+        assert lines.tolist() == [48, 43]
+
+    def test_categoria_fallback(self):
+        """Unknown cost center falls back to 'Categoria 1'"""
+        df = pd.DataFrame({
+            'Centro de Custo 1': ['nan'],
+            'Nome do fornecedor/cliente': ['Someone'],
+            'Descrição': ['Pix'],
+            'Categoria 1': ['Marketing & Growth Expenses'],
+        })
+        lines = classify(df, get_initial_mappings())
+
+        assert lines.tolist() == [56]
+
+    def test_invalid_line_is_not_accumulated(self):
+        """A matched mapping with a non-numeric line yields 0 and blocks the fallback"""
+        mappings = [
+            create_mapping("Diversos", "abc", "Marketing"),
+            create_mapping("Diversos", "56", "Other"),
+        ]
+        df = pd.DataFrame({
+            'Centro de Custo 1': ['Marketing', 'Nowhere'],
+            'Nome do fornecedor/cliente': ['X', 'Y'],
+            'Descrição': ['', ''],
+            'Categoria 1': ['Other', 'Other'],
+        })
+        df = add_match_columns(df)
+        classifier = MappingClassifier(mappings)
+        indices = classifier.classify_indices(df['cc_norm'], df['match_text'], df['cat_norm'])
+
+        assert indices.tolist() == [0, 1]
+        assert classifier.line_numbers(indices).tolist() == [0, 56]
+        assert classifier.line_numbers(np.array([UNMAPPED])).tolist() == [0]
+
+    def test_changed_keys(self):
+        """Only cost centers whose rules give other lines are reported"""
+        mappings = get_initial_mappings()
+        edited = [m.model_copy() for m in mappings]
+        edited.insert(0, create_mapping("Diversos", "90", "Office Expenses"))  # Same line, shifts every index
+        edited = [m for m in edited if m.fornecedor_cliente != "Cloudflare"]
+        for m in edited:
+            if m.fornecedor_cliente == "MGA MARKETING LTDA":
+                m.linha_pl = "90"
+        edited.append(create_mapping("Acme", "68", "Brand New Center"))
+
+        changed = MappingClassifier(mappings).changed_keys(MappingClassifier(edited))
+        assert changed == {'web services expenses', 'marketing & growth expenses', 'brand new center'}
+
+
+class TestMatchColumns:
+
+    def test_dictionary_encoded_columns_match_per_row_apply(self):
+        """add_match_columns must produce the same keys as the per-row normalization"""
+        df = make_synthetic_frame(2000, seed=11)
+        df.loc[::7, 'Descrição'] = None
+        df.loc[::13, 'Categoria 1'] = np.nan
+
+        expected = legacy_match_columns(df)
+        actual = add_match_columns(df.copy())
+
+        for col in ['cc_norm', 'supp_norm', 'desc_norm', 'match_text', 'cat_norm']:
+            assert actual[col].dtype == 'category'
+            assert actual[col].astype(object).tolist() == expected[col].tolist(), col
+
+    def test_accents_and_case_are_folded_once_per_value(self):
+        df = pd.DataFrame({
+            'Centro de Custo 1': ['Salários', 'SALÁRIOS', 'Salários'],
+            'Nome do fornecedor/cliente': ['João', None, 'João'],
+        })
+        add_match_columns(df)
+
+        assert df['cc_norm'].tolist() == ['salarios'] * 3
+        assert df['match_text'].tolist() == ['joao', '', 'joao']
+        assert 'cat_norm' not in df.columns
@@ -0,0 +1,82 @@
+"""
+Tests for transaction fingerprints and append deduplication.
+Run with: pytest backend/test_dedup.py -v
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dedup import Deduplicator, FingerprintIndex, fingerprint_frame
+
+
+def transactions(amounts, suppliers=None) -> pd.DataFrame:
+    n = len(amounts)
+    return pd.DataFrame({
+        'Data de competência': pd.to_datetime(['2025-01-15'] * n),
+        'Valor_Num': amounts,
+        'Nome do fornecedor/cliente': pd.Categorical(suppliers or [f'Fornecedor {i}' for i in range(n)]),
+        'Descrição': ['Pagamento'] * n,
+        'Mes_Competencia': np.full(n, 2025 * 12, dtype=np.int32),
+    })
+
+
+def stored(df: pd.DataFrame) -> FingerprintIndex:
+    return FingerprintIndex([FingerprintIndex.build(*fingerprint_frame(df))])
+
+
+class TestDeduplicator:
+
+    def test_reupload_matches_every_row(self):
+        df = transactions([10.0, 20.0, 30.0])
+        dedup = Deduplicator(stored(df).lookup)
+        rows, _, _ = dedup.filter(df)
+        assert rows.empty
+        assert dedup.counts() == {"inserted": 0, "duplicates": 3, "conflicts": 0}
+
+    def test_identical_rows_are_counted_per_occurrence(self):
+        stored_rows = transactions([10.0, 10.0], ['A', 'A'])
+        upload = transactions([10.0, 10.0, 10.0], ['A', 'A', 'A'])
+        dedup = Deduplicator(stored(stored_rows).lookup)
+        # Occurrences are numbered across chunks
+        dedup.filter(upload.iloc[:2])
+        rows, _, _ = dedup.filter(upload.iloc[2:])
+        assert rows.index.tolist() == [2]
+        assert dedup.counts() == {"inserted": 1, "duplicates": 2, "conflicts": 0}
+
+    def test_edited_amount_is_a_conflict(self):
+        df = transactions([10.0, 20.0])
+        edited = transactions([10.0, 25.0])
+        new = transactions([10.0, 25.0, 5.0], ['Fornecedor 0', 'Fornecedor 1', 'Novo'])
+        dedup = Deduplicator(stored(df).lookup)
+        rows, _, _ = dedup.filter(new)
+        assert rows['Nome do fornecedor/cliente'].tolist() == ['Novo']
+        assert dedup.counts() == {"inserted": 1, "duplicates": 1, "conflicts": 1}
+        assert Deduplicator(stored(df).lookup).filter(edited)[0].empty
+
+    def test_outcome_does_not_depend_on_row_order(self):
+        # Stored: A paid 10. Upload: A paid 10 again (re-sent) and a new A of 20
+        stored_rows = transactions([10.0], ['A'])
+        for amounts in ([20.0, 10.0], [10.0, 20.0]):
+            dedup = Deduplicator(stored(stored_rows).lookup)
+            rows, _, _ = dedup.filter(transactions(amounts, ['A', 'A']))
+            assert rows['Valor_Num'].tolist() == [20.0]
+            assert dedup.counts() == {"inserted": 1, "duplicates": 1, "conflicts": 0}
+
+        # Stored: A paid 10 and 20. Upload: 20 re-sent, 10 edited to 15
+        stored_rows = transactions([10.0, 20.0], ['A', 'A'])
+        for amounts in ([15.0, 20.0], [20.0, 15.0]):
+            dedup = Deduplicator(stored(stored_rows).lookup)
+            assert dedup.filter(transactions(amounts, ['A', 'A']))[0].empty
+            assert dedup.counts() == {"inserted": 0, "duplicates": 1, "conflicts": 1}
+
+    def test_fingerprints_ignore_storage_dtypes(self):
+        df = transactions([10.0, 20.0])
+        as_text = df.astype({'Nome do fornecedor/cliente': str, 'Data de competência': 'datetime64[ms]'})
+        for a, b in zip(fingerprint_frame(df), fingerprint_frame(as_text)):
+            assert (a == b).all()
+        assert Deduplicator().filter(df)[1].dtype == np.int64
@@ -22,7 +22,17 @@ import os
 # Add backend to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from logic import calculate_pnl, get_dashboard_data, get_initial_mappings, process_upload
+from benchmark_pnl import make_synthetic_frame
+from logic import (
+    PnLCube,
+    aggregate_line_months,
+    calculate_pnl,
+    compute_derived_lines,
+    get_dashboard_data,
+    get_initial_mappings,
+    patch_pnl,
+    process_upload,
+)
 from models import MappingItem, PnLResponse, DashboardData
 
 
@@ -298,6 +308,187 @@ class TestEdgeCases:
             pytest.fail(f"Should handle null values gracefully: {e}")
 
 
+class TestLineMonthMatrix:
+    """Test the dense lines x months aggregation and derived lines"""
+
+    def test_aggregate_ignores_unmapped_and_unknown_months(self):
+        lines = np.array([25, 25, 0, 43, 25])
+        months = np.array([0, 1, 0, 1, -1])
+        values = np.array([100.0, 50.0, 999.0, -10.0, 777.0])
+
+        matrix = aggregate_line_months(lines, months, values, 2)
+
+        assert matrix.shape == (121, 2)
+        assert matrix[25].tolist() == [100.0, 50.0]
+        assert matrix[43].tolist() == [0.0, -10.0]
+        assert matrix.sum() == pytest.approx(140.0)
+
+    def test_derived_lines(self):
+        matrix = np.zeros((121, 1))
+        matrix[25, 0] = 1000.0
+        matrix[33, 0] = 500.0
+        matrix[38, 0] = 10.0
+        matrix[43, 0] = -100.0
+        matrix[56, 0] = -50.0
+
+        compute_derived_lines(matrix)
+
+        payment = 1500.0 * 0.1765
+        assert matrix[100, 0] == pytest.approx(1510.0)
+        assert matrix[102, 0] == pytest.approx(-payment)
+        assert matrix[103, 0] == pytest.approx(-100.0)
+        assert matrix[104, 0] == pytest.approx(1510.0 - payment - 100.0)
+        assert matrix[106, 0] == pytest.approx(1510.0 - payment - 150.0)
+        assert matrix[111, 0] == matrix[106, 0]
+
+
+class TestPnLCube:
+    """Test date ranges sliced from the materialized lines x months cube"""
+
+    @staticmethod
+    def spread_frame():
+        df = make_synthetic_frame(3000, seed=3)
+        hours = np.random.default_rng(3).integers(0, 28 * 24, len(df))
+        df['Data de competência'] = df['Data de competência'] + pd.to_timedelta(hours, unit='h')
+        df.loc[df.index[:20], 'Data de competência'] = pd.NaT
+        return df
+
+    @pytest.mark.parametrize("start,end", [
+        (None, None),
+        ('2024-01-01', '2024-06-30'),    # Whole months
+        ('2024-01-15', '2024-06-10'),    # Ragged first and last month
+        ('2024-03-10', '2024-03-20'),    # Inside one month
+        ('2025-02-20', None),
+        (None, '2023-04-02'),
+        ('2030-01-01', '2030-12-31'),    # No rows
+    ])
+    def test_range_matches_filtered_frame(self, start, end):
+        df = self.spread_frame()
+        mappings = get_initial_mappings()
+        overrides = {"106": {"2024-03": 12.5}}
+
+        dates = df['Data de competência']
+        keep = pd.Series(True, index=df.index)
+        if start:
+            keep &= dates >= pd.to_datetime(start)
+        if end:
+            keep &= dates <= pd.to_datetime(end)
+        filtered = df[keep]
+        expected = calculate_pnl(filtered, mappings, overrides) if len(filtered) else PnLResponse(headers=[], rows=[])
+
+        actual = PnLCube(df, mappings).pnl(overrides, start, end)
+        assert actual.headers == expected.headers
+        if expected.rows:
+            assert actual == expected
+
+    def test_whole_months_are_sliced(self):
+        df = self.spread_frame().iloc[20:]  # Every month fully dated
+        cube = PnLCube(df, get_initial_mappings())
+        matrix, months = cube.line_values_between('2024-01-01', '2024-12-31')
+        assert months == [f'2024-{m:02d}' for m in range(1, 13)]
+        first = cube.month_strs.index('2024-01')
+        assert np.array_equal(matrix, cube.line_values[:, first:first + 12])
+
+    @staticmethod
+    def edited_mappings():
+        mappings = [m.model_copy() for m in get_initial_mappings()]
+        for m in mappings:
+            if m.fornecedor_cliente == "MGA MARKETING LTDA":
+                m.linha_pl = "90"
+        mappings = [m for m in mappings if not (m.centro_custo == "Travel" and m.fornecedor_cliente == "Diversos")]
+        mappings.append(MappingItem(grupo_financeiro="X", centro_custo="Unknown Center", fornecedor_cliente="Fornecedor 7",
+                                    linha_pl="56", tipo="Despesa", ativo="Sim"))
+        return mappings
+
+    def test_remap_matches_a_new_cube(self):
+        df = self.spread_frame()
+        edited = self.edited_mappings()
+        cube = PnLCube(df, get_initial_mappings())
+        remapped = cube.remap(edited)
+        fresh = PnLCube(df, edited)
+
+        assert np.array_equal(remapped.lines, fresh.lines)
+        # The lines rows moved between are summed again in row order: exactly equal
+        assert np.array_equal(remapped.line_values, fresh.line_values)
+        assert np.array_equal(remapped.derived, fresh.derived)
+        assert not np.array_equal(remapped.line_values, cube.line_values)
+        for start, end in [(None, None), ('2024-01-15', '2024-06-10')]:
+            assert remapped.pnl(None, start, end) == fresh.pnl(None, start, end)
+        # The original cube is left as it was
+        assert cube.pnl() == PnLCube(df, get_initial_mappings()).pnl()
+
+    def test_remap_without_changes_shares_the_matrix(self):
+        cube = PnLCube(self.spread_frame(), get_initial_mappings())
+        reordered = list(reversed(get_initial_mappings()))
+        assert cube.remap(reordered).line_values is cube.line_values
+
+    def test_append_matches_a_new_cube(self):
+        df = self.spread_frame()
+        # New months, and rows in months the cube already has
+        later = make_synthetic_frame(600, seed=4)
+        later['Mes_Competencia'] = later['Mes_Competencia'] + 12
+        later['Data de competência'] = later['Mes_Competencia'].dt.to_timestamp()
+        later.loc[later.index[:5], 'Data de competência'] = pd.NaT
+        later = pd.concat([later, df.iloc[2500:]], ignore_index=True)
+        whole = pd.concat([df.iloc[:2500], later], ignore_index=True)
+        mappings = get_initial_mappings()
+
+        appended = PnLCube(df.iloc[:2500], mappings).append(later)
+        fresh = PnLCube(whole, mappings)
+
+        assert appended.month_strs == fresh.month_strs
+        # Months with new rows are summed again in row order: exactly equal
+        assert np.array_equal(appended.line_values, fresh.line_values)
+        assert np.array_equal(appended.derived, fresh.derived)
+        assert np.array_equal(appended.order, fresh.order)
+        for mine, theirs in zip(appended.key_values(), fresh.key_values()):
+            assert (mine[appended.key_codes] == theirs[fresh.key_codes]).all()
+        for start, end in [(None, None), ('2024-01-15', '2026-06-10')]:
+            assert appended.pnl(None, start, end) == fresh.pnl(None, start, end)
+        edited = self.edited_mappings()
+        assert appended.remap(edited).pnl() == PnLCube(whole, edited).pnl()
+
+    def test_preview_lists_the_changes_of_a_remap(self):
+        df = self.spread_frame()
+        edited = self.edited_mappings()
+        overrides = {"106": {"2024-03": 12.5}}
+        cube = PnLCube(df, get_initial_mappings())
+        preview = cube.preview(edited, overrides)
+
+        before, after = cube.pnl(overrides), PnLCube(df, edited).pnl(overrides)
+        expected = {
+            (a.line_number, month): a.values[month] - b.values[month]
+            for b, a in zip(before.rows, after.rows) for month in before.headers
+            if abs(a.values[month] - b.values[month]) > 1e-6
+        }
+        assert {(c.line_number, c.month): c.delta for c in preview.cells} == pytest.approx(expected, abs=1e-6)
+        # The overridden EBITDA stays pinned
+        assert (13, '2024-03') not in expected
+
+        fresh = PnLCube(df, edited)
+        moved = (cube.lines != fresh.lines) & (cube.month_idx >= 0)
+        assert preview.rows_moved == moved.sum() == sum(m.rows for m in preview.moves)
+        for move in preview.moves:
+            rows = moved & (cube.lines == move.from_line) & (fresh.lines == move.to_line)
+            assert move.amount == pytest.approx(cube.values[rows].sum())
+
+        assert cube.preview(get_initial_mappings()).moves == []
+
+    def test_override_cells_patch_the_pnl(self):
+        df = self.spread_frame()
+        mappings = get_initial_mappings()
+        cube = PnLCube(df, mappings)
+        before = {"111": {"2024-02": 5.0}}
+        after = {**before, "106": {"2024-03": 12.5}}
+
+        cells, alerts = cube.month_cells('2024-03', after, [106])
+        # EBITDA and the EBITDA margin, which follows it
+        assert sorted(cell.line_number for cell in cells) == [13, 14]
+        assert [a.field for a in alerts] == ['EBITDA']
+        assert patch_pnl(cube.pnl(before), '2024-03', cells, alerts) == calculate_pnl(df, mappings, after)
+        assert cube.month_cells('1999-01', after, [106]) == ([], [])
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
 
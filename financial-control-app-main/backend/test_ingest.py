@@ -0,0 +1,344 @@
+"""
+Tests for the vectorized upload parsing kernels.
+Run with: pytest backend/test_ingest.py -v
+"""
+
+import glob
+import io
+import os
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ingest import (
+    DATE_COLUMNS,
+    MONEY_COLUMNS,
+    CsvChunkReader,
+    concat_chunks,
+    converter_valor_br,
+    detect_encoding,
+    infer_date_format,
+    parse_currency_column,
+    parse_date_column,
+    parse_date_value,
+    read_csv_upload,
+    sniff_dialect,
+)
+from benchmark_ingest import legacy_enforce_wages, legacy_read_csv, make_extrato_bytes
+from benchmark_pnl import make_synthetic_frame
+from logic import add_match_columns, process_upload, process_upload_stream, route_payroll_cost_center, stream_upload
+
+SAMPLE_EXTRATO = next(iter(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Extrato*.csv'))), None)
+
+
+def assert_same_amounts(values):
+    col = pd.Series(values, dtype=object)
+    expected = np.array([converter_valor_br(v) for v in values], dtype=np.float64)
+    actual = parse_currency_column(col).to_numpy()
+
+    for v, e, a in zip(values, expected, actual):
+        if np.isnan(e):
+            assert np.isnan(a), repr(v)
+        else:
+            assert a == e and np.signbit(a) == np.signbit(e), f"{v!r}: expected {e!r}, got {a!r}"
+
+
+class TestCurrencyParser:
+
+    def test_known_formats(self):
+        cases = {
+            'R$ 1.234,56': 1234.56,
+            '1,234.56': 1234.56,
+            '(1.234,56)': -1234.56,
+            '1.234,56-': -1234.56,
+            '-74,00': -74.0,
+            '991.579,32': 991579.32,
+            'R$ 10000.00': 10000.0,
+            '': 0.0,
+            '   ': 0.0,
+            'abc': 0.0,
+            None: 0.0,
+        }
+        parsed = parse_currency_column(pd.Series(list(cases), dtype=object))
+        assert parsed.tolist() == list(cases.values())
+
+    def test_numeric_input_column(self):
+        col = pd.Series([10.5, np.nan, -3.0, 1e20])
+        assert parse_currency_column(col).tolist() == [10.5, 0.0, -3.0, 1e20]
+
+    def test_empty_column(self):
+        assert parse_currency_column(pd.Series([], dtype=object)).tolist() == []
+
+    def test_matches_reference_on_fuzzed_inputs(self):
+        rng = random.Random(1234)
+        alphabet = '0123456789' * 4 + '.,-() R$' + 'e+_a '
+        values = []
+        for _ in range(5000):
+            n = rng.randint(0, 12)
+            values.append(''.join(rng.choice(alphabet) for _ in range(n)))
+        for _ in range(2000):
+            amount = rng.uniform(-1e7, 1e7)
+            br = f"{abs(amount):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+            values.append(rng.choice([
+                br, f"R$ {br}", f"({br})", f"{br}-", f"-{br}", f"{amount:,.2f}", f"{amount:.2f}",
+            ]))
+        values += ['nan', 'inf', '-inf', '1_000', '()', '(-)', '--5', '+5', '1e5', '1,2,3', '١٢٣']
+
+        assert_same_amounts(values)
+
+    @pytest.mark.skipif(SAMPLE_EXTRATO is None, reason="sample extrato not available")
+    def test_matches_reference_on_sample_extrato(self):
+        df = pd.read_csv(SAMPLE_EXTRATO, dtype=str, keep_default_na=False)
+        money = [col for col in MONEY_COLUMNS if col in df.columns]
+        assert 'Valor (R$)' in money
+
+        for col in money:
+            assert_same_amounts(df[col].tolist())
+
+
+def assert_same_dates(values):
+    col = pd.Series(values, dtype=object)
+    expected = col.apply(parse_date_value)
+    actual = parse_date_column(col)
+    assert actual.isna().tolist() == expected.isna().tolist()
+    assert (actual.dropna() == expected.dropna()).all()
+
+
+class TestDateParser:
+
+    def test_formats_and_missing_values(self):
+        col = pd.Series(['15/01/2024', ' 2024-02-20 ', None, 'garbage', '20-03-2024', ''], dtype=object)
+        parsed = parse_date_column(col)
+
+        assert parsed.dtype == 'datetime64[us]'
+        assert parsed.iloc[0] == pd.Timestamp('2024-01-15')
+        assert parsed.iloc[1] == pd.Timestamp('2024-02-20')
+        assert parsed.iloc[4] == pd.Timestamp('2024-03-20')
+        assert parsed.isna().tolist() == [False, False, True, True, False, True]
+
+    def test_ambiguous_dates_default_to_brazilian_order(self):
+        """With no evidence either way, dd/mm/yyyy wins (same priority as before)"""
+        assert infer_date_format(pd.Series(['01/02/2024', '03/04/2024'])) == '%d/%m/%Y'
+        assert parse_date_column(pd.Series(['01/02/2024'])).iloc[0] == pd.Timestamp('2024-02-01')
+
+    def test_dominant_us_format_is_inferred(self):
+        col = pd.Series(['12/31/2024', '11/25/2024', '01/02/2024'])
+        assert infer_date_format(col) == '%m/%d/%Y'
+        assert parse_date_column(col).iloc[2] == pd.Timestamp('2024-01-02')
+
+    def test_matches_reference_on_fuzzed_inputs(self):
+        rng = random.Random(99)
+        values = []
+        for _ in range(3000):
+            d, m, y = rng.randint(0, 32), rng.randint(0, 13), rng.choice([1999, 2024, 2025, 24])
+            values.append(rng.choice([
+                f"{d:02d}/{m:02d}/{y}", f"{y}-{m:02d}-{d:02d}", f"{d}-{m}-{y}", f"{d}/{m}/{y}",
+                f" {d:02d}/{m:02d}/{y} ", f"{d}.{m}.{y}", "", None,
+            ]))
+        assert_same_dates(values)
+
+    @pytest.mark.skipif(SAMPLE_EXTRATO is None, reason="sample extrato not available")
+    def test_matches_reference_on_sample_extrato(self):
+        df = pd.read_csv(SAMPLE_EXTRATO, dtype=str)
+        dates = [col for col in DATE_COLUMNS if col in df.columns]
+        assert 'Data de competência' in dates
+
+        for col in dates:
+            assert_same_dates(df[col].tolist())
+
+
+class TestPayrollRouting:
+
+    def test_matches_legacy_apply_on_synthetic_data(self):
+        df = make_synthetic_frame(3000, seed=3)
+        df.loc[::5, 'Descrição'] = 'Pró-labore sócios'
+        df.loc[::11, 'Nome do fornecedor/cliente'] = 'HOLERITE Maria'
+        df.loc[::17, 'Descrição'] = None
+        df.loc[::19, 'Centro de Custo 1'] = 'WAGES EXPENSES '
+        expected = legacy_enforce_wages(df)
+
+        actual = route_payroll_cost_center(add_match_columns(df))
+
+        assert actual.tolist() == expected.tolist()
+
+    def test_keywords_can_span_fields(self):
+        """Matching runs over "category description supplier", like the row loop did"""
+        df = pd.DataFrame({
+            'Centro de Custo 1': ['Office Expenses', 'Office Expenses'],
+            'Nome do fornecedor/cliente': ['pagamento Acme', 'Acme'],
+            'Descrição': ['Folha de', ''],
+        })
+        routed = route_payroll_cost_center(add_match_columns(df), ['folha de pagamento'])
+
+        assert routed.tolist() == ['Wages Expenses', 'Office Expenses']
+        assert routed.tolist() == legacy_enforce_wages(df, ['folha de pagamento']).tolist()
+
+    def test_keyword_list_is_configurable(self):
+        df = add_match_columns(pd.DataFrame({
+            'Centro de Custo 1': ['Office Expenses', 'Wages Expenses'],
+            'Nome do fornecedor/cliente': ['Bonus Q1', 'Acme'],
+            'Descrição': ['Salário', ''],
+        }))
+
+        assert route_payroll_cost_center(df, ['bonus']).tolist() == ['Wages Expenses', 'Wages Expenses']
+        assert route_payroll_cost_center(df, []).tolist() == ['Office Expenses', 'Wages Expenses']
+
+
+class TestCsvSniffing:
+
+    def test_detect_encoding(self):
+        assert detect_encoding('Descrição,Valor'.encode('utf-8')) == 'utf-8'
+        assert detect_encoding(b'\xef\xbb\xbfData,Valor') == 'utf-8-sig'
+        assert detect_encoding('Descrição,Valor'.encode('utf-16')) == 'utf-16'
+        assert detect_encoding('Descrição,Valor'.encode('latin-1')) == 'latin-1'
+        assert detect_encoding('“Descrição” – R$'.encode('cp1252')) == 'cp1252'
+
+    def test_sniff_delimiter_and_quotechar(self):
+        assert sniff_dialect('a;b;c\n1,5;2;3\n4;5,5;6\n') == (';', '"')
+        assert sniff_dialect('a,b,c\n"1,5",2,3\n"x, y",5,6\n') == (',', '"')
+        assert sniff_dialect('a\tb\n1,5\t2\n') == ('\t', '"')
+        # Apostrophes inside values do not make ' the quote character
+        assert sniff_dialect("a,b\nMcDonald's,1\nO'Brien,2\n") == (',', '"')
+        assert sniff_dialect("a;b\n'x;y';1\n'z';2\n") == (';', "'")
+
+    def test_sniff_rejects_single_column_content(self):
+        with pytest.raises(ValueError):
+            sniff_dialect('just some text\nwithout delimiters\n')
+        with pytest.raises(ValueError):
+            sniff_dialect('')
+
+    def test_matches_legacy_reader_across_dialects(self):
+        for sep, encoding in [(',', 'utf-8'), (';', 'latin-1'), ('\t', 'utf-8'), (';', 'utf-8-sig')]:
+            content = make_extrato_bytes(300, sep=sep, encoding=encoding)
+            df, dialect = read_csv_upload(content)
+
+            assert dialect.delimiter == sep
+            assert 'Data de competência' in df.columns
+            pd.testing.assert_frame_equal(df, legacy_read_csv(content))
+
+    def test_windows_export_is_decoded_as_cp1252(self):
+        """The retry loop decoded cp1252 files as latin-1, turning “ ” – into control characters"""
+        content = make_extrato_bytes(300, sep=';', encoding='cp1252')
+        df, dialect = read_csv_upload(content)
+
+        assert dialect.encoding == 'cp1252'
+        pd.testing.assert_frame_equal(df, pd.read_csv(io.BytesIO(content), sep=';', encoding='cp1252'))
+
+    def test_malformed_lines_are_skipped_and_counted(self):
+        content = b'Data de compet\xc3\xaancia;Valor (R$)\n01/01/2025;10,00\n1;2;3;4\n02/01/2025;5,00\n'
+        df, dialect = read_csv_upload(content)
+
+        assert df['Valor (R$)'].tolist() == ['10,00', '5,00']
+        assert dialect.skipped_lines == 1
+
+    @pytest.mark.skipif(SAMPLE_EXTRATO is None, reason="sample extrato not available")
+    def test_process_upload_reports_dialect(self):
+        with open(SAMPLE_EXTRATO, 'rb') as f:
+            df = process_upload(f.read())
+
+        assert df.attrs['csv_dialect'] == {
+            'encoding': 'utf-8', 'delimiter': ',', 'quotechar': '"', 'skipped_lines': 0,
+        }
+
+
+def assert_same_transactions(left, right):
+    assert list(left.columns) == list(right.columns)
+    for col in left.columns:
+        a, b = left[col], right[col]
+        if isinstance(a.dtype, pd.CategoricalDtype):
+            a, b = a.astype(object), b.astype(object)
+        pd.testing.assert_series_equal(a, b, check_names=False)
+
+
+class TestStreamingUpload:
+
+    def test_chunk_reader_matches_single_read(self):
+        content = make_extrato_bytes(1000, sep=';', encoding='latin-1')
+        reader = CsvChunkReader(io.BytesIO(content), chunk_bytes=32 * 1024)
+        chunks = list(reader)
+
+        assert len(chunks) > 5
+        assert reader.dialect == read_csv_upload(content)[1]
+        pd.testing.assert_frame_equal(concat_chunks(chunks), read_csv_upload(content)[0])
+
+    def test_quoted_newlines_do_not_split_records(self):
+        rows = [f'{i},"linha 1\nlinha 2, com ""aspas""\n",{i}.5' for i in range(200)]
+        content = ('id,obs,valor\n' + '\n'.join(rows) + '\n').encode('utf-8')
+        chunks = list(CsvChunkReader(io.BytesIO(content), chunk_bytes=100))
+
+        assert len(chunks) > 20
+        pd.testing.assert_frame_equal(concat_chunks(chunks), read_csv_upload(content)[0])
+
+    def test_chunk_reader_skips_malformed_lines_at_any_position(self):
+        rows = [f'{i};{i}' for i in range(20)]
+        rows[5], rows[12] = '5;5;5', '12;12;12'
+        content = ('a;b\n' + '\n'.join(rows) + '\n').encode('utf-8')
+
+        for chunk_bytes in [4, 8, 16, 30, 1000]:
+            reader = CsvChunkReader(io.BytesIO(content), chunk_bytes=chunk_bytes)
+            df = concat_chunks(list(reader))
+
+            assert df['a'].tolist() == [i for i in range(20) if i not in (5, 12)], chunk_bytes
+            assert reader.dialect.skipped_lines == 2
+
+    def test_concat_chunks_keeps_dtypes(self):
+        chunks = [
+            pd.DataFrame({'cat': pd.Categorical(['a', 'b']), 'text': pd.Series(['x', 'y'], dtype='str')}),
+            pd.DataFrame({'cat': pd.Categorical(['c']), 'text': pd.Series([np.nan])}, index=[2]),
+        ]
+        df = concat_chunks(chunks)
+
+        assert df['cat'].dtype == 'category'
+        assert df['cat'].tolist() == ['a', 'b', 'c']
+        assert df['text'].dtype == 'str'
+        assert df['text'].isna().tolist() == [False, False, True]
+
+    def test_concat_chunks_all_missing_categorical(self):
+        """A chunk where a categorical column is empty has float64 categories"""
+        chunks = [
+            pd.DataFrame({'cat': pd.Categorical([np.nan, np.nan])}),
+            pd.DataFrame({'cat': pd.Categorical(['a'])}, index=[2]),
+        ]
+        df = concat_chunks(chunks)
+
+        assert df['cat'].dtype == 'category'
+        assert df['cat'].isna().tolist() == [True, True, False]
+
+    def test_stream_matches_process_upload(self):
+        content = make_extrato_bytes(2000)
+        written = []
+        streamed = process_upload_stream(io.BytesIO(content), on_chunk=written.append, chunk_bytes=64 * 1024)
+
+        assert len(written) > 5
+        assert sum(len(c) for c in written) == 2000
+        assert streamed.attrs['csv_dialect']['delimiter'] == ','
+        assert_same_transactions(streamed, process_upload(content))
+
+    def test_stream_upload_hands_off_every_chunk(self):
+        content = make_extrato_bytes(2000)
+        written = []
+        rows, dialect = stream_upload(io.BytesIO(content), on_chunk=written.append, chunk_bytes=64 * 1024)
+
+        assert rows == 2000
+        assert dialect.delimiter == ','
+        assert_same_transactions(concat_chunks(written), process_upload(content))
+
+    def test_free_text_is_split_off(self):
+        content = make_extrato_bytes(1000)
+        texts = []
+        streamed = process_upload_stream(io.BytesIO(content), on_text_chunk=texts.append, chunk_bytes=64 * 1024)
+        text = concat_chunks(texts)
+        full = process_upload(content)
+
+        assert 'Observações' not in streamed.columns
+        assert text.index.equals(streamed.index)
+        pd.testing.assert_series_equal(text['Observações'], full['Observações'])
+
+    def test_stream_rejects_missing_columns(self):
+        with pytest.raises(ValueError, match="Missing required columns"):
+            process_upload_stream(io.BytesIO(b'a,b\n1,2\n'))
@@ -0,0 +1,163 @@
+"""
+Tests for the append-only change journal.
+Run with: pytest backend/test_journal.py -v
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from journal import ChangeJournal
+
+
+class OverrideState:
+    """Minimal stand-in for main's override state."""
+
+    def __init__(self):
+        self.overrides = {}
+        self.snapshot = {}
+
+    def apply(self, change):
+        if change['op'] == 'override':
+            self.overrides.setdefault(change['line'], {})[change['month']] = change['value']
+        elif change['op'] == 'clear_overrides':
+            self.overrides = {}
+
+    def write_snapshot(self):
+        self.snapshot = {line: dict(months) for line, months in self.overrides.items()}
+
+
+def make_journal(tmp_path, **kwargs) -> ChangeJournal:
+    return ChangeJournal(tmp_path / 'changes.jsonl', tmp_path / 'changes', **kwargs)
+
+
+class TestChangeJournal:
+
+    def test_replay_rebuilds_state(self, tmp_path):
+        state = OverrideState()
+        journal = make_journal(tmp_path)
+        journal.commit({'op': 'override', 'line': '56', 'month': '2025-09', 'value': 1.0}, state.apply, user='Ana')
+        journal.commit({'op': 'clear_overrides'}, state.apply)
+        journal.commit({'op': 'override', 'line': '9', 'month': '2025-10', 'value': 2.5}, state.apply)
+
+        restarted = OverrideState()
+        assert make_journal(tmp_path).replay(restarted.apply) == 3
+        assert restarted.overrides == state.overrides == {'9': {'2025-10': 2.5}}
+
+    def test_failed_write_is_not_applied(self, tmp_path, monkeypatch):
+        state = OverrideState()
+        journal = make_journal(tmp_path)
+        journal.commit({'op': 'override', 'line': '56', 'month': '2025-09', 'value': 1.0}, state.apply)
+
+        real_open = open
+
+        def full_disk(path, mode='r', *args, **kwargs):
+            if 'a' in mode:
+                raise OSError(28, 'No space left on device')
+            return real_open(path, mode, *args, **kwargs)
+
+        monkeypatch.setattr('builtins.open', full_disk)
+        with pytest.raises(OSError):
+            journal.commit({'op': 'override', 'line': '56', 'month': '2025-10', 'value': 2.0}, state.apply)
+        monkeypatch.undo()
+        assert state.overrides == {'56': {'2025-09': 1.0}}
+
+        # No gap in the sequence
+        record = journal.commit({'op': 'clear_overrides'}, state.apply)
+        assert [r['seq'] for r in journal.read()] == [1, 2] and record['seq'] == 2
+
+    def test_compaction_folds_journal_into_snapshot(self, tmp_path):
+        state = OverrideState()
+        journal = make_journal(tmp_path, compact_bytes=200)
+        for i in range(3):
+            journal.commit({'op': 'override', 'line': '56', 'month': f'2025-0{i + 1}', 'value': float(i)}, state.apply, user='Ana')
+        assert journal.needs_compaction()
+
+        assert journal.compact(state.write_snapshot)
+        assert state.snapshot == state.overrides
+        assert not journal.path.exists()
+
+        journal.commit({'op': 'override', 'line': '9', 'month': '2025-01', 'value': 7.0}, state.apply)
+
+        # Restart: snapshot + tail, sequence numbers keep growing
+        restarted = OverrideState()
+        restarted.overrides = {line: dict(months) for line, months in state.snapshot.items()}
+        reopened = make_journal(tmp_path)
+        assert reopened.replay(restarted.apply) == 1
+        assert restarted.overrides == state.overrides
+        assert reopened.commit({'op': 'clear_overrides'}, restarted.apply)['seq'] == 5
+
+        history = reopened.history()
+        assert [c['seq'] for c in history] == [5, 4, 3, 2, 1]
+        assert history[-1]['user'] == 'Ana'
+
+    def test_torn_last_line_is_dropped(self, tmp_path):
+        state = OverrideState()
+        journal = make_journal(tmp_path)
+        journal.commit({'op': 'override', 'line': '56', 'month': '2025-09', 'value': 1.0}, state.apply)
+        with open(journal.path, 'a') as f:
+            f.write('{"seq": 2, "op": "overr')  # crash mid-append
+
+        restarted = OverrideState()
+        reopened = make_journal(tmp_path)
+        assert reopened.replay(restarted.apply) == 1
+        reopened.commit({'op': 'override', 'line': '9', 'month': '2025-09', 'value': 3.0}, restarted.apply)
+
+        assert [c['line'] for c in reopened.read()] == ['56', '9']
+
+    def test_concurrent_commits_replay_in_applied_order(self, tmp_path):
+        state = OverrideState()
+        journal = make_journal(tmp_path, compact_bytes=2000)
+
+        def edit(worker):
+            for i in range(50):
+                journal.commit({'op': 'override', 'line': '56', 'month': '2025-09', 'value': float(worker * 100 + i)}, state.apply)
+                if journal.needs_compaction():
+                    journal.compact(state.write_snapshot)
+
+        threads = [threading.Thread(target=edit, args=(w,)) for w in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        restarted = OverrideState()
+        restarted.overrides = state.snapshot
+        make_journal(tmp_path).replay(restarted.apply)
+
+        assert restarted.overrides == state.overrides
+        assert len(journal.history(limit=1000)) == 200
+
+    def test_workers_sync_each_others_edits(self, tmp_path):
+        # Two processes sharing the journal: each has its own state and journal object
+        a_state, b_state = OverrideState(), OverrideState()
+        a, b = make_journal(tmp_path, compact_bytes=200), make_journal(tmp_path, compact_bytes=200)
+        a.replay(a_state.apply)
+        b.replay(b_state.apply)
+
+        a.commit({'op': 'override', 'line': '56', 'month': '2025-09', 'value': 1.0}, a_state.apply)
+        assert b.sync(b_state.apply) == 1
+        assert b.sync(b_state.apply) == 0
+        assert b_state.overrides == a_state.overrides
+
+        # b catches up before appending, so sequence numbers never collide
+        a.commit({'op': 'override', 'line': '9', 'month': '2025-09', 'value': 2.0}, a_state.apply)
+        assert b.commit({'op': 'clear_overrides'}, b_state.apply)['seq'] == 3
+        assert [c['seq'] for c in a.read()] == [1, 2, 3]
+
+        # a is behind: it must not compact a snapshot missing b's edit
+        assert not a.compact(a_state.write_snapshot)
+        a.sync(a_state.apply)
+        assert a_state.overrides == b_state.overrides == {}
+
+        # Records b compacted away are read back from the history
+        for i in range(3):
+            b.commit({'op': 'override', 'line': '56', 'month': f'2025-0{i + 1}', 'value': float(i)}, b_state.apply)
+        assert b.compact(b_state.write_snapshot)
+        b.commit({'op': 'override', 'line': '9', 'month': '2025-01', 'value': 7.0}, b_state.apply)
+        assert a.sync(a_state.apply) == 4
+        assert a_state.overrides == b_state.overrides
@@ -0,0 +1,132 @@
+"""
+Tests for the shared P&L result cache.
+Run with: pytest backend/test_pnl_cache.py -v
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from logic import get_initial_mappings
+from pnl_cache import CacheKey, PnLCache, estimate_size, hash_mappings, hash_overrides
+
+
+def key(kind="pnl", version=1, mappings="m1", overrides="o1", params=()):
+    return CacheKey(kind, version, mappings, overrides, params)
+
+
+class TestPnLCache:
+
+    def test_get_or_compute_runs_once(self):
+        cache = PnLCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"rows": [1, 2, 3]}
+
+        assert cache.get_or_compute(key(), compute) == {"rows": [1, 2, 3]}
+        assert cache.get_or_compute(key(), compute) == {"rows": [1, 2, 3]}
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+
+    def test_concurrent_callers_share_one_computation(self):
+        cache = PnLCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "pnl"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(key(), compute)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == ["pnl"] * 4
+        assert len(calls) == 1
+
+    def test_failed_computation_is_retried_by_the_next_caller(self):
+        cache = PnLCache()
+
+        def fail():
+            raise ValueError("boom")
+
+        try:
+            cache.get_or_compute(key(), fail)
+        except ValueError:
+            pass
+        assert cache.get_or_compute(key(), lambda: "pnl") == "pnl"
+
+    def test_lru_eviction_by_entry_count(self):
+        cache = PnLCache(max_entries=2)
+        cache.put(key(params=("a",)), "A")
+        cache.put(key(params=("b",)), "B")
+        cache.get(key(params=("a",)))  # 'a' is now most recent
+        cache.put(key(params=("c",)), "C")
+
+        assert cache.get(key(params=("b",))) is None
+        assert cache.get(key(params=("a",))) == "A"
+        assert cache.get(key(params=("c",))) == "C"
+
+    def test_byte_budget(self):
+        cache = PnLCache(max_bytes=100)
+        cache.put(key(params=("a",)), "x" * 60)
+        cache.put(key(params=("b",)), "y" * 60)
+
+        assert cache.get(key(params=("a",))) is None
+        assert cache.stats()["bytes"] <= 100
+
+        # Oversized payloads are never stored
+        cache.put(key(params=("big",)), "z" * 500)
+        assert cache.get(key(params=("big",))) is None
+
+    def test_invalidate_only_superseded_state(self):
+        cache = PnLCache()
+        cache.put(key(overrides="old"), "stale")
+        cache.put(key(kind="dashboard", overrides="old"), "stale")
+        cache.put(key(overrides="other"), "fresh")
+
+        assert cache.invalidate(overrides_hash="old") == 2
+        assert cache.get(key(overrides="other")) == "fresh"
+
+        cache.put(key(version=1), "v1")
+        cache.put(key(version=2, params=("x",)), "v2")
+        cache.invalidate(data_version=1)
+        assert cache.get(key(version=2, params=("x",))) == "v2"
+        assert cache.stats()["entries"] == 1
+
+    def test_carry_over_keeps_unaffected_entries(self):
+        cache = PnLCache()
+        cache.put(key(version=1, params=("2024-01-01", "2024-06-30")), "first half")
+        cache.put(key(version=1, params=("2024-07-01", "2024-12-31")), "second half")
+        cache.put(key(version=3), "other version")
+
+        assert cache.carry_over(1, 2, lambda k: k.params[0] < "2024-07") == 1
+        assert cache.get(key(version=2, params=("2024-01-01", "2024-06-30"))) == "first half"
+        assert cache.get(key(version=1, params=("2024-07-01", "2024-12-31"))) is None
+        assert cache.stats()["entries"] == 2
+
+    def test_carry_over_does_not_replace_newer_entries(self):
+        cache = PnLCache()
+        cache.put(key(version=1, params=("2024-01-01", "2024-06-30")), "carried")
+        cache.put(key(version=2, params=("2024-01-01", "2024-06-30")), "recomputed")
+
+        assert cache.carry_over(1, 2, lambda k: True) == 0
+        assert cache.get(key(version=2, params=("2024-01-01", "2024-06-30"))) == "recomputed"
+        assert cache.stats()["entries"] == 1
+        assert cache.stats()["bytes"] == estimate_size("recomputed")
+
+    def test_hashes_follow_content(self):
+        mappings = get_initial_mappings()
+        assert hash_mappings(mappings) == hash_mappings(get_initial_mappings())
+        assert hash_mappings(mappings) != hash_mappings(mappings[:-1])
+
+        assert hash_overrides(None) == hash_overrides({})
+        assert hash_overrides({"100": {"2024-01": 1.0}}) != hash_overrides({"100": {"2024-01": 2.0}})
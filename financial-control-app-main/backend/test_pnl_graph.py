@@ -0,0 +1,145 @@
+"""
+Tests for the declarative P&L graph.
+Run with: pytest backend/test_pnl_graph.py -v
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from logic import N_LINES, apply_overrides, build_pnl_response
+from pnl_graph import PAYMENT_PROCESSING_RATE, PNL_GRAPH, Node, PnLGraph, Term
+from validation import validate_calculation_logic
+
+
+def sample_lines(n_months=2):
+    line_values = np.zeros((N_LINES, n_months))
+    line_values[25] = [1000.0, 2000.0]   # Google
+    line_values[33] = [-500.0, 800.0]    # Apple, booked negative
+    line_values[38] = [10.0, 0.0]
+    line_values[43] = [-100.0, -50.0]    # COGS
+    line_values[56] = [-200.0, -300.0]   # Marketing
+    line_values[62] = [-150.0, -150.0]   # Wages
+    line_values[90] = [-20.0, -40.0]     # Other expenses
+    return line_values
+
+
+class TestGraphStructure:
+
+    def test_inputs_come_before_their_nodes(self):
+        position = {key: i for i, key in enumerate(PNL_GRAPH.order)}
+        for key in PNL_GRAPH.order:
+            for ref in PNL_GRAPH.inputs(key):
+                if ref in position:
+                    assert position[ref] < position[key]
+
+    def test_cycle_is_rejected(self):
+        nodes = [Node('a', 'A', (Term('b'),)), Node('b', 'B', (Term('a'),))]
+        with pytest.raises(ValueError, match="Cycle"):
+            PnLGraph(nodes, [], [])
+
+    def test_dependents_of_a_source_line(self):
+        dependents = PNL_GRAPH.dependents(['line_25'])
+        assert {'google_revenue', 'revenue_no_tax', 'payment_processing', 'gross_profit',
+                'ebitda', 'net_result', 'ebitda_margin'} <= dependents
+        assert 'apple_revenue' not in dependents
+        assert 'marketing' not in dependents
+
+
+class TestEvaluation:
+
+    def test_derived_lines(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        revenue = np.array([1500.0, 2800.0])
+        payment = -revenue * PAYMENT_PROCESSING_RATE
+        gross = revenue + np.array([10.0, 0.0]) + payment - np.array([100.0, 50.0])
+        np.testing.assert_allclose(line_values[101], revenue)
+        np.testing.assert_allclose(line_values[102], payment)
+        np.testing.assert_allclose(line_values[104], gross)
+        np.testing.assert_allclose(line_values[106], gross - [370.0, 490.0])
+        np.testing.assert_allclose(line_values[111], line_values[106])
+
+    def test_changed_recomputes_only_dependents(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        line_values[56] = [-1000.0, -1000.0]
+        line_values[107] = 12345.0  # Stale value that must be recomputed
+        line_values[112] = 999.0    # Not a dependent of line 56: left alone
+        computed = PNL_GRAPH.evaluate(line_values, changed=[56])
+        assert 'google_revenue' not in computed
+        np.testing.assert_allclose(line_values[107], [-1000.0, -1000.0])
+        assert list(line_values[112]) == [999.0, 999.0]
+
+        full = sample_lines()
+        full[56] = [-1000.0, -1000.0]
+        PNL_GRAPH.evaluate(full)
+        np.testing.assert_array_equal(line_values[106], full[106])
+
+    def test_changed_line_owned_by_a_node_is_recomputed(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        expected = line_values.copy()
+        line_values[104] = 777.0  # Rows mapped onto the gross profit line
+        PNL_GRAPH.evaluate(line_values, changed=[104])
+        np.testing.assert_array_equal(line_values, expected)
+
+    def test_formula_terms_add_up(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        value = PNL_GRAPH.reader(line_values, {})
+        for key in ('total_revenue', 'gross_profit', 'ebitda', 'tech_support'):
+            formula = PNL_GRAPH.formula(key, value)
+            total = sum(t["sign"] * t["value"] for t in formula["terms"]) * formula["rate"]
+            if PNL_GRAPH.nodes[key].negate:
+                total = -total
+            assert formula["value"] == pytest.approx(total)
+
+        margin = PNL_GRAPH.formula('ebitda_margin', value)
+        ebitda, revenue = (t["value"] for t in margin["terms"])
+        assert margin["value"] == pytest.approx(ebitda / revenue * 100)
+
+
+class TestChecks:
+
+    def test_consistent_pnl_has_no_alerts(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        assert build_pnl_response(line_values, ['2024-01', '2024-02']).validation_alerts is None
+
+    def test_overridden_ebitda_is_flagged(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        apply_overrides(line_values, ['2024-01', '2024-02'], {"106": {"2024-02": 0.0}})
+        alerts = build_pnl_response(line_values, ['2024-01', '2024-02']).validation_alerts
+        assert [(a.month, a.field) for a in alerts] == [('2024-02', 'EBITDA')]
+
+    def test_validation_matches_rows_by_description(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        rows = build_pnl_response(line_values, ['2024-01', '2024-02']).model_dump()["rows"]
+        for row in rows:
+            row["line_number"] = None
+        assert validate_calculation_logic({"rows": rows}, '2024-01') == (True, [])
+
+        for row in rows:
+            if row["description"] == "(=) EBITDA":
+                row["values"]['2024-01'] += 100
+        is_valid, errors = validate_calculation_logic({"rows": rows}, '2024-01')
+        assert not is_valid
+        assert errors[0].startswith("EBITDA calculation error")
+
+    def test_net_result_keeps_its_error_message(self):
+        line_values = sample_lines()
+        PNL_GRAPH.evaluate(line_values)
+        rows = build_pnl_response(line_values, ['2024-01', '2024-02']).model_dump()["rows"]
+        for row in rows:
+            if row["description"] == "(=) RESULTADO LÍQUIDO":
+                row["values"]['2024-01'] += 100
+        is_valid, errors = validate_calculation_logic({"rows": rows}, '2024-01')
+        assert not is_valid
+        assert errors[0].startswith("Net Result should equal EBITDA: EBITDA=")
@@ -0,0 +1,91 @@
+"""
+Tests for the compact transaction schema.
+Run with: pytest backend/test_schema.py -v
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_pnl import make_synthetic_frame
+from logic import calculate_pnl, get_initial_mappings
+from schema import (
+    NO_MONTH,
+    apply_schema,
+    has_schema,
+    memory_report,
+    month_code,
+    month_label,
+    parse_month_label,
+    split_free_text,
+    to_month_codes,
+)
+
+
+class TestMonthCodes:
+
+    def test_round_trip(self):
+        dates = pd.Series(pd.to_datetime(['2024-01-15', '2025-12-31', None]))
+        codes = month_code(dates)
+
+        assert codes.dtype == np.int32
+        assert codes.tolist() == [2024 * 12, 2025 * 12 + 11, NO_MONTH]
+        assert [month_label(c) for c in codes[:2]] == ['2024-01', '2025-12']
+        assert month_label(codes[0]) == str(pd.Period('2024-01', 'M'))
+
+    def test_parse_labels(self):
+        assert parse_month_label('2024-10') == 2024 * 12 + 9
+        assert parse_month_label(pd.Period('2024-10', 'M')) == 2024 * 12 + 9
+        assert parse_month_label('2024-13') == NO_MONTH
+        assert parse_month_label('garbage') == NO_MONTH
+        assert parse_month_label(None) == NO_MONTH
+
+    def test_any_month_representation(self):
+        expected = [2024 * 12, 2024 * 12 + 1, NO_MONTH]
+        as_periods = pd.Series([pd.Period('2024-01', 'M'), pd.Period('2024-02', 'M'), pd.NaT])
+
+        assert to_month_codes(as_periods).tolist() == expected
+        assert to_month_codes(pd.Series(['2024-01', '2024-02', None])).tolist() == expected
+        assert to_month_codes(pd.Series(expected, dtype=np.int32)).tolist() == expected
+
+
+class TestApplySchema:
+
+    def test_dtypes(self):
+        df = apply_schema(make_synthetic_frame(500, seed=5))
+
+        assert has_schema(df)
+        assert df['Mes_Competencia'].dtype == np.int32
+        assert df['Centro de Custo 1'].dtype == 'category'
+        assert df['Categoria 1'].dtype == 'category'
+        assert df['Valor_Num'].dtype == np.float64
+
+    def test_pnl_is_unchanged(self):
+        """The P&L of a Period-based frame and of its compact form must match exactly"""
+        mappings = get_initial_mappings()
+        legacy = make_synthetic_frame(3000, seed=8)
+        compact = apply_schema(legacy.copy())
+
+        assert not has_schema(legacy)
+        assert calculate_pnl(compact, mappings) == calculate_pnl(legacy, mappings)
+        assert (calculate_pnl(compact, mappings, start_date='2024-03-01', end_date='2024-09-30')
+                == calculate_pnl(legacy, mappings, start_date='2024-03-01', end_date='2024-09-30'))
+
+    def test_split_free_text(self):
+        df = pd.DataFrame({'Valor_Num': [1.0, 2.0], 'Observações': ['nota', None]}, index=[10, 11])
+        frame, text = split_free_text(df)
+
+        assert list(frame.columns) == ['Valor_Num']
+        assert list(text.columns) == ['Observações']
+        assert text.index.tolist() == [10, 11]
+
+    def test_categoricals_shrink_memory(self):
+        df = make_synthetic_frame(20000, seed=1)
+        before = memory_report(df)['total_mb']
+        after = memory_report(apply_schema(df))['total_mb']
+
+        assert after < before / 2
@@ -0,0 +1,59 @@
+"""
+Tests for the versioned snapshot store shared by the workers.
+Run with: pytest backend/test_snapshot.py -v
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from snapshot import SnapshotStore
+
+
+def publish_file(store: SnapshotStore, content: str) -> int:
+    with store.publish() as directory:
+        (directory / 'data.txt').write_text(content)
+    return int(directory.name)
+
+
+class TestSnapshotStore:
+
+    def test_publish_is_seen_by_other_workers(self, tmp_path):
+        writer, reader = SnapshotStore(tmp_path), SnapshotStore(tmp_path)
+        assert reader.current() == 0
+
+        assert publish_file(writer, 'first') == 1
+        assert reader.current() == 1
+        assert reader.path('data.txt').read_text() == 'first'
+
+        assert publish_file(writer, 'second') == 2
+        assert reader.current() == 2
+        assert reader.path('data.txt').read_text() == 'second'
+
+    def test_failed_publish_keeps_current_snapshot(self, tmp_path):
+        store = SnapshotStore(tmp_path)
+        publish_file(store, 'first')
+        with pytest.raises(RuntimeError):
+            with store.publish() as directory:
+                (directory / 'data.txt').write_text('partial')
+                raise RuntimeError('upload failed')
+
+        assert store.current() == 1
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['1', 'CURRENT']
+
+    def test_old_snapshots_are_pruned(self, tmp_path):
+        store = SnapshotStore(tmp_path, keep=2)
+        for i in range(4):
+            publish_file(store, str(i))
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['3', '4', 'CURRENT']
+
+    def test_open_snapshot_stays_readable_after_pruning(self, tmp_path):
+        store = SnapshotStore(tmp_path, keep=1)
+        publish_file(store, 'first')
+        with open(store.path('data.txt')) as f:
+            publish_file(store, 'second')
+            assert not (tmp_path / '1').exists()
+            assert f.read() == 'first'
@@ -0,0 +1,109 @@
+"""
+Tests for the optional SQLite storage backend.
+Run with: pytest backend/test_sqlite_store.py -v
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_pnl import make_synthetic_frame
+from logic import PnLCube, add_match_columns, calculate_pnl, get_initial_mappings
+from schema import apply_schema
+from sqlite_store import SqliteStore
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    return add_match_columns(apply_schema(make_synthetic_frame(3000, seed=3)))
+
+
+@pytest.fixture
+def db(tmp_path, frame) -> SqliteStore:
+    store = SqliteStore(tmp_path / 'finance.db')
+    store.write_transactions(frame)
+    return store
+
+
+def assert_same_pnl(actual, expected):
+    assert actual.headers == expected.headers
+    assert [r.line_number for r in actual.rows] == [r.line_number for r in expected.rows]
+    for a, e in zip(actual.rows, expected.rows):
+        assert a.values == pytest.approx(e.values, abs=1e-6)
+
+
+class TestSqliteStore:
+
+    def test_transactions_round_trip(self, db, frame):
+        df = db.read_transactions()
+        assert df.index.tolist() == frame.index.tolist()
+        assert df['Valor_Num'].tolist() == frame['Valor_Num'].tolist()
+        assert df['Centro de Custo 1'].astype(str).tolist() == frame['Centro de Custo 1'].astype(str).tolist()
+        assert (df['Mes_Competencia'] == frame['Mes_Competencia']).all()
+        assert db.stats()['transactions'] == len(frame)
+
+    def test_grouped_pnl_matches_frame_pnl(self, db, frame):
+        mappings = get_initial_mappings()
+        overrides = {'56': {'2024-02': 10.0}}
+        assert_same_pnl(calculate_pnl(db.pnl_groups(), mappings, overrides),
+                        calculate_pnl(frame, mappings, overrides))
+        assert_same_pnl(calculate_pnl(db.pnl_groups('2024-02-10', '2024-05-20'), mappings),
+                        calculate_pnl(frame, mappings, None, '2024-02-10', '2024-05-20'))
+
+    def test_grouped_preview_counts_transactions(self, db, frame):
+        mappings = [m.model_copy() for m in get_initial_mappings()]
+        for m in mappings:
+            if m.centro_custo == 'Marketing & Growth Expenses':
+                m.linha_pl = '90'
+        grouped = PnLCube(db.pnl_groups(), get_initial_mappings()).preview(mappings)
+        expected = PnLCube(frame, get_initial_mappings()).preview(mappings)
+        assert grouped.rows_moved == expected.rows_moved > 0
+        assert grouped.amount_moved == pytest.approx(expected.amount_moved)
+
+    def test_rows_from_a_row_id(self, db, frame):
+        start = int(frame.index[2000])
+        assert db.read_transactions(start_row_id=start).index.tolist() == frame.index[2000:].tolist()
+        mappings = get_initial_mappings()
+        assert_same_pnl(calculate_pnl(db.pnl_groups(start_row_id=start), mappings),
+                        calculate_pnl(frame.iloc[2000:], mappings))
+
+    def test_line_transactions_match_frame_filter(self, db, frame):
+        month = int(frame['Mes_Competencia'].iloc[0])
+        needle = str(frame['Centro de Custo 1'].iloc[0])[:4].lower()
+        expected = frame[
+            (frame['Mes_Competencia'] == month)
+            & frame['Centro de Custo 1'].astype(str).str.contains(needle, case=False, na=False, regex=False)
+        ]
+        rows = db.line_transactions(month=month, cost_center=needle)
+        assert rows.index.tolist() == expected.index.tolist()
+        assert rows['Valor_Num'].tolist() == expected['Valor_Num'].tolist()
+        assert db.line_transactions(month=month, cost_center='no such cost center').empty
+
+    def test_drill_down_uses_indexes(self, db):
+        with db.connect() as conn:
+            plan = ' '.join(row[-1] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE cost_center IN ('a', 'b') AND month = 3"))
+        assert 'USING INDEX' in plan
+
+    def test_failed_write_keeps_previous_transactions(self, db, frame):
+        with pytest.raises(RuntimeError):
+            with db.transaction_writer() as writer:
+                writer.write(frame.head(10))
+                raise RuntimeError('upload failed')
+        assert len(db.read_transactions()) == len(frame)
+
+    def test_mappings_and_overrides_round_trip(self, db):
+        mappings = [m.model_dump() for m in get_initial_mappings()]
+        db.save_mappings(mappings)
+        assert db.load_mappings() == mappings
+
+        db.save_overrides({'56': {'2024-01': 1.5}})
+        db.set_override('56', '2024-02', 2.0)
+        db.set_override('56', '2024-01', 3.0)
+        assert db.load_overrides() == {'56': {'2024-01': 3.0, '2024-02': 2.0}}
+        db.clear_overrides()
+        assert db.load_overrides() == {}
@@ -0,0 +1,141 @@
+"""
+Tests for the Arrow on-disk frame store.
+Run with: pytest backend/test_store.py -v
+"""
+
+import json
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pyarrow as pa
+
+from benchmark_pnl import make_synthetic_frame
+from logic import calculate_pnl, get_initial_mappings
+from schema import apply_schema
+from store import FrameChunkWriter, read_frame, read_pickled_frame, write_frame, write_json
+
+
+def make_chunk(start: int, cc: list) -> pd.DataFrame:
+    return pd.DataFrame({
+        'Valor_Num': [float(start + i) for i in range(len(cc))],
+        'cc_norm': pd.Categorical(cc),
+    }, index=range(start, start + len(cc)))
+
+
+class TestFrameStore:
+
+    def test_chunks_round_trip_as_one_frame(self, tmp_path):
+        path = tmp_path / 'current_data.arrow'
+        with FrameChunkWriter(path) as writer:
+            writer.write(make_chunk(0, ['a', 'b']))
+            writer.write(make_chunk(2, ['c', 'a']))
+
+        df = read_frame(path)
+
+        assert writer.rows == 4
+        assert df.index.tolist() == [0, 1, 2, 3]
+        assert df['Valor_Num'].tolist() == [0.0, 1.0, 2.0, 3.0]
+        assert df['cc_norm'].dtype == 'category'
+        assert df['cc_norm'].tolist() == ['a', 'b', 'c', 'a']
+
+    def test_failed_write_keeps_previous_file(self, tmp_path):
+        path = tmp_path / 'current_data.arrow'
+        write_frame(path, make_chunk(0, ['old']))
+
+        with pytest.raises(ValueError):
+            with FrameChunkWriter(path) as writer:
+                writer.write(make_chunk(0, ['new']))
+                raise ValueError("upload failed halfway")
+
+        assert read_frame(path)['cc_norm'].tolist() == ['old']
+        assert not writer.tmp_path.exists()
+
+    def test_record_batch_per_month(self, tmp_path):
+        path = tmp_path / 'current_data.arrow'
+        with FrameChunkWriter(path) as writer:
+            writer.write(make_chunk(0, ['a', 'b', 'c']).assign(Mes_Competencia=[24300, 24301, 24300]))
+            writer.write(make_chunk(3, ['d', 'e']).assign(Mes_Competencia=[24301, 24301]))
+
+        assert pa.ipc.open_file(str(path)).num_record_batches == 3
+        # Grouped by month within each chunk, index kept
+        df = read_frame(path)
+        assert df.index.tolist() == [0, 2, 1, 3, 4]
+        assert df.sort_index()['cc_norm'].tolist() == ['a', 'b', 'c', 'd', 'e']
+
+        df = read_frame(path, months=[24301])
+        assert df.index.tolist() == [1, 3, 4]
+        assert df['cc_norm'].tolist() == ['b', 'd', 'e']
+
+    def test_stored_frame_gives_same_pnl(self, tmp_path):
+        """Month grouping keeps the summation order of every line x month cell"""
+        path = tmp_path / 'current_data.arrow'
+        df = apply_schema(make_synthetic_frame(3000, seed=4))
+        with FrameChunkWriter(path) as writer:
+            for start in range(0, len(df), 1000):
+                writer.write(df.iloc[start:start + 1000])
+
+        stored = read_frame(path)
+        mappings = get_initial_mappings()
+
+        assert stored.sort_index().equals(df)
+        assert calculate_pnl(stored, mappings) == calculate_pnl(df, mappings)
+
+    def test_reads_selected_columns(self, tmp_path):
+        path = tmp_path / 'current_data.arrow'
+        write_frame(path, make_chunk(5, ['a', 'b']))
+
+        df = read_frame(path, columns=['cc_norm', 'not stored'])
+
+        assert list(df.columns) == ['cc_norm']
+        assert df.index.tolist() == [5, 6]
+
+    def test_chunk_dtypes_are_kept(self, tmp_path):
+        """Numeric categoricals and columns empty in the first chunk"""
+        path = tmp_path / 'current_data.arrow'
+        with FrameChunkWriter(path) as writer:
+            writer.write(pd.DataFrame({'id': pd.Categorical([416968000101.0]), 'note': pd.Categorical([np.nan])}))
+            writer.write(pd.DataFrame({'id': pd.Categorical([1.0, 2.0]), 'note': pd.Categorical(['x', None])}, index=[1, 2]))
+
+        df = read_frame(path)
+
+        assert df['id'].dtype == 'category'
+        assert df['id'].tolist() == [416968000101.0, 1.0, 2.0]
+        assert df['note'].dtype == 'category'
+        assert df['note'].isna().tolist() == [True, False, True]
+
+    def test_reads_pickled_files(self, tmp_path):
+        """Files written by older versions: pickled chunks or a single pickle"""
+        path = tmp_path / 'current_data.pkl'
+        with open(path, 'wb') as f:
+            pickle.dump(make_chunk(0, ['a', 'b']), f)
+            pickle.dump(make_chunk(2, ['c']), f)
+
+        assert read_pickled_frame(path)['cc_norm'].tolist() == ['a', 'b', 'c']
+
+
+class TestJsonArtifacts:
+
+    def test_write_json(self, tmp_path):
+        path = tmp_path / 'overrides.json'
+        write_json(path, {'56': {'2025-09': 10.0}})
+        write_json(path, {'56': {'2025-09': 12.5}})
+
+        assert json.loads(path.read_text()) == {'56': {'2025-09': 12.5}}
+        assert os.listdir(tmp_path) == ['overrides.json']
+
+    def test_failed_write_keeps_previous_file(self, tmp_path):
+        path = tmp_path / 'overrides.json'
+        write_json(path, {'56': {'2025-09': 10.0}})
+
+        with pytest.raises(TypeError):
+            write_json(path, {'56': {'2025-09': object()}})
+
+        assert json.loads(path.read_text()) == {'56': {'2025-09': 10.0}}
+        assert os.listdir(tmp_path) == ['overrides.json']
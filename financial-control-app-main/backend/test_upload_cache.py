@@ -0,0 +1,49 @@
+"""
+Tests for the content-addressed cache of processed uploads.
+Run with: pytest backend/test_upload_cache.py -v
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from store import Segment
+from upload_cache import UploadCache
+
+
+def snapshot_with(tmp_path, name: str, content: str):
+    directory = tmp_path / name
+    directory.mkdir()
+    (directory / 'data.arrow').write_text(content)
+    (directory / 'text.arrow').write_text(content + ' text')
+    return directory, Segment(1, 'data.arrow', 'text.arrow', None, 10, 10, [24300], source=name)
+
+
+class TestUploadCache:
+
+    def test_entry_links_the_snapshot_files(self, tmp_path):
+        cache = UploadCache(tmp_path / 'cache')
+        directory, segment = snapshot_with(tmp_path, 'abc', 'first')
+        assert cache.get('abc') is None
+
+        cache.put('abc', directory, segment, {"rows": 10})
+        entry = cache.get('abc')
+        assert cache.segment(entry) == segment
+        assert entry["result"] == {"rows": 10}
+        assert os.path.samefile(tmp_path / 'cache' / 'abc' / 'data.arrow', directory / 'data.arrow')
+
+        target = tmp_path / 'next'
+        target.mkdir()
+        cache.link_into('abc', entry, target)
+        assert (target / 'text.arrow').read_text() == 'first text'
+
+    def test_least_recently_used_entries_are_pruned(self, tmp_path):
+        cache = UploadCache(tmp_path / 'cache', keep=2)
+        for i, name in enumerate(['a', 'b', 'c']):
+            directory, segment = snapshot_with(tmp_path, name, name)
+            cache.put(name, directory, segment, {"rows": i})
+            os.utime(tmp_path / 'cache' / name, (i, i))
+            if name == 'b':
+                cache.get('a')  # 'a' is now more recent than 'b'
+        assert sorted(p.name for p in (tmp_path / 'cache').iterdir()) == ['a', 'c']
@@ -0,0 +1,294 @@
+"""
+Tests for upload ingestion as background jobs with stage progress.
+Run with: pytest backend/test_upload_jobs.py -v
+"""
+
+import io
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_ingest import make_extrato_bytes
+from logic import UPLOAD_STAGES, calculate_pnl, get_initial_mappings, process_upload, process_upload_stream
+from models import PnLResponse
+from snapshot import SnapshotStore
+from sqlite_store import SqliteStore
+from store import read_frame, read_manifest, read_segments, write_json
+from upload_jobs import APPEND_FILE, new_job, run_upload
+
+
+def queue_job(tmp_path, data: bytes, mode: str = 'replace'):
+    job_path, upload_path = tmp_path / 'job.json', tmp_path / 'upload.csv'
+    upload_path.write_bytes(data)
+    write_json(job_path, new_job('job', len(data), mode))
+    return job_path, upload_path
+
+
+def run_job(tmp_path, data: bytes, mode: str = 'replace', sqlite_path=None) -> dict:
+    job_path, upload_path = queue_job(tmp_path, data, mode)
+    return run_upload(job_path, upload_path, tmp_path / 'snapshots', 'data.arrow', 'text.arrow', sqlite_path)
+
+
+def overlapping_exports():
+    """(whole export, its first 500 rows, rows 300-799 with row 300's amount edited)"""
+    rows = pd.read_csv(io.BytesIO(make_extrato_bytes(800)), dtype=str)
+    later = rows.iloc[300:].copy()
+    later.iloc[0, later.columns.get_loc('Valor (R$)')] = '1,23'
+    return [df.to_csv(index=False).encode() for df in (rows, rows.iloc[:500], later)]
+
+
+def assert_same_pnl(actual, expected):
+    assert actual.headers == expected.headers
+    for a, e in zip(actual.rows, expected.rows):
+        assert a.values == pytest.approx(e.values, abs=1e-6)
+
+
+class TestUploadProgress:
+
+    def test_stages_are_reported_in_order(self):
+        data = make_extrato_bytes(3000)
+        calls = []
+        df = process_upload_stream(io.BytesIO(data), chunk_bytes=64 * 1024,
+                                   on_progress=lambda stage, rows: calls.append((stage, rows)))
+
+        assert calls[0] == ('sniff', 0)
+        stages = [stage for stage, _ in calls[1:]]
+        assert stages == UPLOAD_STAGES[1:] * (len(stages) // 4)
+        assert len(stages) > 4  # Several chunks
+        assert calls[-1] == ('persist', len(df))
+
+
+class TestRunUpload:
+
+    def test_job_publishes_snapshot_with_progress(self, tmp_path):
+        data = make_extrato_bytes(2000)
+        job_path, upload_path = queue_job(tmp_path, data)
+
+        job = run_upload(job_path, upload_path, tmp_path / 'snapshots', 'data.arrow', 'text.arrow')
+
+        expected = process_upload(data)
+        assert job['status'] == 'done'
+        assert job['stages'] == {stage: 0 if stage == 'sniff' else len(expected) for stage in UPLOAD_STAGES}
+        assert job['bytes_read'] == len(data)
+        assert job['result']['rows'] == len(expected)
+        assert not upload_path.exists()
+
+        store = SnapshotStore(tmp_path / 'snapshots')
+        assert store.current() == job['result']['snapshot']
+        assert len(read_frame(store.path('data.arrow'))) == len(expected)
+
+    def test_failed_job_keeps_published_snapshot(self, tmp_path):
+        good_path, good_upload = queue_job(tmp_path, make_extrato_bytes(500))
+        run_upload(good_path, good_upload, tmp_path / 'snapshots', 'data.arrow', 'text.arrow')
+
+        job_path, upload_path = queue_job(tmp_path, b'a;b\n1;2\n')
+        job = run_upload(job_path, upload_path, tmp_path / 'snapshots', 'data.arrow', 'text.arrow')
+
+        assert job['status'] == 'failed'
+        assert 'Missing required columns' in job['error']
+        assert not upload_path.exists()
+        assert SnapshotStore(tmp_path / 'snapshots').current() == 1
+        assert sorted(p.name for p in (tmp_path / 'snapshots').iterdir() if p.is_dir()) == ['1']
+
+
+class TestAppendUpload:
+
+    def test_append_stores_only_new_rows(self, tmp_path):
+        whole, first, later = overlapping_exports()
+        run_job(tmp_path, first)
+        job = run_job(tmp_path, later, 'append')
+
+        assert job['status'] == 'done'
+        assert {k: job['result'][k] for k in ('rows', 'inserted', 'duplicates', 'conflicts')} == \
+            {'rows': 500, 'inserted': 300, 'duplicates': 199, 'conflicts': 1}
+
+        store = SnapshotStore(tmp_path / 'snapshots')
+        segments = read_manifest(store.directory(), 'data.arrow', 'text.arrow')
+        assert [s.rows for s in segments] == [500, 300]
+        assert os.path.samefile(store.path('data.arrow'), store.path('data.arrow', 1))  # Linked, not rewritten
+
+        df = read_segments(store.directory(), [s.data for s in segments])
+        assert df.index.is_unique
+        mappings = get_initial_mappings()
+        assert_same_pnl(calculate_pnl(df, mappings), calculate_pnl(process_upload(whole), mappings))
+
+        # Appending the same file again changes nothing
+        again = run_job(tmp_path, later, 'append')
+        assert (again['result']['inserted'], again['result']['duplicates']) == (0, 499)
+        assert len(read_manifest(store.directory(), 'data.arrow', 'text.arrow')) == 2
+
+    def test_append_to_sqlite(self, tmp_path):
+        whole, first, later = overlapping_exports()
+        db_path = tmp_path / 'finance.db'
+        run_job(tmp_path, first, sqlite_path=db_path)
+        job = run_job(tmp_path, later, 'append', sqlite_path=db_path)
+
+        assert (job['result']['inserted'], job['result']['duplicates'], job['result']['conflicts']) == (300, 199, 1)
+        db = SqliteStore(db_path)
+        mappings = get_initial_mappings()
+        assert_same_pnl(calculate_pnl(db.pnl_groups(), mappings), calculate_pnl(process_upload(whole), mappings))
+
+        store = SnapshotStore(tmp_path / 'snapshots')
+        with open(store.path(APPEND_FILE)) as f:
+            appended = json.load(f)
+        assert appended['base'] == store.current() - 1 and appended['start_row_id'] == 500
+        assert appended['months'] == sorted(set(db.read_transactions(start_row_id=500)['Mes_Competencia'].tolist()))
+
+    def test_append_needs_fingerprinted_rows(self, tmp_path):
+        db = SqliteStore(tmp_path / 'finance.db')
+        db.write_transactions(process_upload(make_extrato_bytes(100)))
+        job = run_job(tmp_path, make_extrato_bytes(100), 'append', sqlite_path=db.path)
+        assert job['status'] == 'failed'
+        assert 'predate fingerprints' in job['error']
+        assert len(db.read_transactions()) == 100
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # main keeps its data under ./data: run it in an empty directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('SQLITE_PATH', raising=False)
+    from fastapi.testclient import TestClient
+
+    import main
+    from auth import get_current_user
+
+    main.app.dependency_overrides[get_current_user] = lambda: {'name': 'Upload Test'}
+    main.replace_frame(None, 0)
+    main.app_state.update(lambda s: s.with_mappings(get_initial_mappings())._replace(overrides={}))
+    with TestClient(main.app) as client:
+        yield client
+    main.app.dependency_overrides.clear()
+
+
+def wait_for_job(api, job_id: str, timeout: float = 60) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = api.get(f'/upload/jobs/{job_id}').json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f'upload job {job_id} did not finish')
+
+
+class TestUploadApi:
+
+    def test_upload_returns_job_and_publishes_when_done(self, api):
+        data = make_extrato_bytes(1000)
+        r = api.post('/upload', files={'file': ('extrato.csv', data, 'text/csv')})
+        assert r.status_code == 202
+        assert r.json()['status'] == 'queued'
+
+        job = wait_for_job(api, r.json()['job_id'])
+        assert job['status'] == 'done'
+        assert job['stage'] == 'persist'
+
+        pnl = PnLResponse.model_validate(api.get('/pnl').json())
+        assert pnl.headers == calculate_pnl(process_upload(data), get_initial_mappings()).headers
+
+    def test_append_reloads_new_rows_only(self, api):
+        import main
+
+        whole, first, later = overlapping_exports()
+        for data, mode in ((first, 'replace'), (later, 'append')):
+            r = api.post('/upload', params={'mode': mode}, files={'file': ('extrato.csv', data, 'text/csv')})
+            assert wait_for_job(api, r.json()['job_id'])['status'] == 'done'
+
+        pnl = PnLResponse.model_validate(api.get('/pnl').json())
+        assert_same_pnl(pnl, calculate_pnl(process_upload(whole), get_initial_mappings()))
+        assert len(main.app_state.get().segments) == 2
+        assert api.post('/upload', params={'mode': 'merge'}, files={'file': ('x.csv', first, 'text/csv')}).status_code == 400
+
+    def test_append_extends_the_cached_cube(self, api, monkeypatch):
+        import main
+
+        whole, first, later = overlapping_exports()
+        r = api.post('/upload', files={'file': ('extrato.csv', first, 'text/csv')})
+        wait_for_job(api, r.json()['job_id'])
+        assert api.get('/pnl').status_code == 200  # Cube of the first upload cached
+
+        def rebuild(*args):
+            raise AssertionError("cube rebuilt from every row")
+
+        monkeypatch.setattr(main, 'PnLCube', rebuild)
+        r = api.post('/upload', params={'mode': 'append'}, files={'file': ('extrato.csv', later, 'text/csv')})
+        wait_for_job(api, r.json()['job_id'])
+        main.sync_state()
+
+        expected = calculate_pnl(process_upload(whole), get_initial_mappings())
+        assert_same_pnl(PnLResponse.model_validate(api.get('/pnl').json()), expected)
+        assert api.get('/dashboard').status_code == 200
+
+    def test_sqlite_append_reads_only_new_rows(self, api, tmp_path, monkeypatch):
+        import main
+
+        db = SqliteStore(tmp_path / 'finance.db')
+        monkeypatch.setattr(main, 'db', db)
+        monkeypatch.setattr(main.upload_jobs, 'sqlite_path', db.path)
+        monkeypatch.setattr(main.upload_jobs, 'cache', None)
+        whole, first, later = overlapping_exports()
+        r = api.post('/upload', files={'file': ('extrato.csv', first, 'text/csv')})
+        wait_for_job(api, r.json()['job_id'])
+        main.sync_state()
+        assert api.get('/pnl').status_code == 200  # Cube of the first upload cached
+
+        def read_all(*args, start_row_id=None):
+            assert start_row_id == 500, "every stored row re-read"
+            return SqliteStore.read_transactions(db, *args, start_row_id=start_row_id)
+
+        monkeypatch.setattr(main, 'PnLCube', None)  # Not rebuilt: extended with the new groups
+        monkeypatch.setattr(db, 'read_transactions', read_all)
+        r = api.post('/upload', params={'mode': 'append'}, files={'file': ('extrato.csv', later, 'text/csv')})
+        wait_for_job(api, r.json()['job_id'])
+        main.sync_state()
+
+        assert len(main.app_state.get().df) == 800
+        expected = calculate_pnl(process_upload(whole), get_initial_mappings())
+        assert_same_pnl(PnLResponse.model_validate(api.get('/pnl').json()), expected)
+
+    def test_identical_upload_is_served_from_cache(self, api):
+        import main
+
+        first, second = make_extrato_bytes(600), make_extrato_bytes(400)
+        upload = lambda data: api.post('/upload', files={'file': ('extrato.csv', data, 'text/csv')}).json()
+        job = wait_for_job(api, upload(first)['job_id'])
+        assert job['cache_hit'] is False
+        pnl = api.get('/pnl').json()
+
+        # Already the published dataset: nothing to do
+        again = upload(first)
+        assert again['status'] == 'done' and again['cache_hit'] is True
+        assert main.app_state.get().snapshot_version == job['result']['snapshot']
+
+        # Published again from the cache after another upload
+        wait_for_job(api, upload(second)['job_id'])
+        again = upload(first)
+        assert again['cache_hit'] is True
+        assert main.app_state.get().snapshot_version > job['result']['snapshot']
+        assert api.get('/pnl').json() == pnl
+
+    def test_upload_warms_the_caches(self, api):
+        import main
+
+        r = api.post('/upload', files={'file': ('extrato.csv', make_extrato_bytes(500), 'text/csv')})
+        wait_for_job(api, r.json()['job_id'])
+        api.get('/status')  # Snapshot loaded (by the job callback or this request)
+        assert main.warmer.wait(30)
+        warmup = api.get('/status').json()['warmup']
+        assert warmup['last']['reason'] in ('upload', 'sync')
+        assert set(warmup['last']['steps_ms']) == {'pnl', 'dashboard', 'forecast', 'validation'}
+
+        misses = main.pnl_cache.stats()['misses']
+        for path in ('/dashboard', '/pnl', '/api/forecast', '/validate'):
+            assert api.get(path).status_code == 200
+        assert main.pnl_cache.stats()['misses'] == misses
+
+    def test_unknown_job_is_404(self, api):
+        assert api.get('/upload/jobs/0123abcd').status_code == 404
+        assert api.get('/upload/jobs/not-a-job').status_code == 404
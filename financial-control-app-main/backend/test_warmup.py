@@ -0,0 +1,56 @@
+"""
+Tests for the background cache warm-up.
+Run with: pytest backend/test_warmup.py -v
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from warmup import CacheWarmer
+
+
+class TestCacheWarmer:
+
+    def test_steps_run_in_background_and_are_timed(self):
+        ran = []
+        warmer = CacheWarmer(lambda: {"pnl": lambda: ran.append("pnl"), "dashboard": lambda: ran.append("dashboard")})
+        assert warmer.stats() == {"running": False, "runs": 0, "last": None}
+
+        warmer.request("startup")
+        assert warmer.wait(5)
+        assert ran == ["pnl", "dashboard"]
+        stats = warmer.stats()
+        assert stats["runs"] == 1
+        assert stats["last"]["reason"] == "startup"
+        assert list(stats["last"]["steps_ms"]) == ["pnl", "dashboard"]
+        assert stats["last"]["duration_ms"] >= 0 and stats["last"]["error"] is None
+
+    def test_requests_during_a_run_fold_into_one_more_run(self):
+        release = threading.Event()
+        runs = []
+
+        def steps():
+            runs.append(len(runs))
+            return {"pnl": lambda: release.wait(5)} if len(runs) == 1 else {}
+
+        warmer = CacheWarmer(steps)
+        warmer.request("upload")
+        for reason in ("mappings", "overrides", "sync"):
+            warmer.request(reason)
+        assert warmer.stats()["running"]
+        release.set()
+        assert warmer.wait(5)
+        assert len(runs) == 2
+        assert warmer.stats()["last"]["reason"] == "sync"
+
+    def test_failures_are_recorded(self):
+        def fail():
+            raise ValueError("boom")
+
+        warmer = CacheWarmer(lambda: {"pnl": fail})
+        warmer.request("startup")
+        assert warmer.wait(5)
+        assert warmer.stats()["last"]["error"] == "boom"
@@ -0,0 +1,81 @@
+"""
+Content-addressed cache of processed uploads (data/upload_cache/).
+
+Uploads are hashed (SHA-256) while they are stored. The snapshot files a
+full upload produced are kept here under that hash, as hard links of the
+published files, so an identical upload (a re-sent export, the same file from
+two users) is not processed again: its files are linked into a new snapshot,
+a pointer swap instead of the whole pipeline. The `keep` most recently used
+entries are kept.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from store import Segment, link_file, write_json
+
+ENTRY_FILE = 'entry.json'
+
+Entry = Dict[str, Any]  # {"segment": Segment fields, "result": job result}
+
+
+class UploadCache:
+    """Processed uploads by content hash, shared by the workers."""
+
+    def __init__(self, root: Path, keep: int = 4):
+        self.root = Path(root)
+        self.keep = keep
+
+    def get(self, digest: str) -> Optional[Entry]:
+        """Entry of an upload processed before (None: not cached)."""
+        entry_path = self.root / digest / ENTRY_FILE
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        os.utime(entry_path.parent)  # Most recently used
+        return entry
+
+    def segment(self, entry: Entry) -> Segment:
+        return Segment(**entry["segment"])
+
+    def put(self, digest: str, directory: Path, segment: Segment, result: Dict[str, Any]):
+        """Cache the files of `segment` in the snapshot `directory` under the upload's hash."""
+        target = self.root / digest
+        if target.exists():
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Built aside and renamed: a reader never sees a partial entry
+        tmp = self.root / f'.{digest}.{os.getpid()}'
+        tmp.mkdir()
+        try:
+            for name in (segment.data, segment.text, segment.fingerprints):
+                if name is not None and (Path(directory) / name).exists():
+                    link_file(Path(directory) / name, tmp / name)
+            write_json(tmp / ENTRY_FILE, {"segment": segment._asdict(), "result": result})
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker cached the same upload first
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not target.exists():
+                raise
+        self._prune()
+
+    def link_into(self, digest: str, entry: Entry, directory: Path):
+        """Link the cached files of an entry into a snapshot directory."""
+        segment = self.segment(entry)
+        for name in (segment.data, segment.text, segment.fingerprints):
+            if name is not None and (self.root / digest / name).exists():
+                link_file(self.root / digest / name, Path(directory) / name)
+
+    def _prune(self):
+        entries = sorted(
+            (p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith('.')),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for path in entries[:max(len(entries) - self.keep, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,327 @@
+"""
+Upload ingestion as background jobs (data/jobs/).
+
+POST /upload only stores the file and returns a job id; the parsing, cleaning
+and classification run in a separate process (a ProcessPoolExecutor), so a
+large upload neither blocks the event loop nor competes with the requests
+for the GIL. The job writes a new snapshot and publishes it atomically when
+it succeeds; a failed job leaves the published data as it was.
+
+An append job (mode "append") merges only the rows not stored yet: its rows
+are fingerprinted (dedup.py) and looked up in the fingerprints of the stored
+segments, and the new ones become one more segment of the next snapshot,
+which links the previous segments' files instead of rewriting them. The
+cost of an append follows the size of the uploaded file, not of the history.
+With the SQLite backend the new rows are inserted after the stored ones and
+the snapshot records where they start (APPEND_FILE), so the workers read
+only them.
+
+A full upload identical to one processed before (same SHA-256) skips the
+job altogether: the dataset kept in the upload cache (upload_cache.py) is
+linked into a new snapshot, or left as it is if it is already published.
+
+The status of a job is a small JSON file the job process rewrites as every
+stage of logic.UPLOAD_STAGES advances, so any uvicorn worker can answer
+GET /upload/jobs/{id}, not only the one that accepted the upload.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dedup import FINGERPRINT_COLUMNS, Deduplicator, FingerprintIndex, fingerprint_frame
+from logic import UPLOAD_STAGES, stream_upload
+from schema import month_label, split_free_text
+from snapshot import SnapshotStore
+from sqlite_store import SqliteStore
+from store import FrameChunkWriter, Segment, link_file, read_frame, read_manifest, write_json, write_manifest
+from upload_cache import UploadCache
+
+Job = Dict[str, Any]
+
+JOB_RETENTION_SECONDS = 24 * 3600  # Finished job files kept for polling
+
+UPLOAD_MODES = ('replace', 'append')
+
+# SQLite append: {"base": snapshot appended to, "start_row_id": first new row, "months": their codes}
+APPEND_FILE = 'append.json'
+
+
+def new_job(job_id: str, size: int, mode: str = 'replace', digest: Optional[str] = None) -> Job:
+    return {
+        "id": job_id,
+        "mode": mode,
+        "sha256": digest,
+        "cache_hit": False,
+        "status": "queued",  # queued -> running -> done | failed
+        "stage": None,
+        "stages": {stage: 0 for stage in UPLOAD_STAGES},  # Rows through each stage
+        "bytes_total": size,
+        "bytes_read": 0,
+        "created": datetime.now().isoformat(),
+        "started": None,
+        "finished": None,
+        "error": None,
+        "result": None,
+    }
+
+
+def _segment_file(name: str, version: int) -> str:
+    """File name of an appended segment: current_data.arrow -> current_data.<version>.arrow"""
+    stem, suffix = os.path.splitext(name)
+    return f'{stem}.{version}{suffix}'
+
+
+def _carry_segments(base: Path, snapshot_dir: Path, segments: List[Segment]) -> List[Segment]:
+    """
+    Link the files of the published segments into the new snapshot, with
+    their fingerprints (computed once for segments stored before them).
+    """
+    carried = []
+    for segment in segments:
+        for name in (segment.data, segment.text, segment.fingerprints):
+            if name is not None and (base / name).exists():
+                link_file(base / name, snapshot_dir / name)
+        if segment.fingerprints is None:
+            frame = read_frame(base / segment.data, columns=FINGERPRINT_COLUMNS).sort_index()
+            segment = segment._replace(fingerprints=f'fingerprints.{segment.version}.npy')
+            np.save(snapshot_dir / segment.fingerprints, FingerprintIndex.build(*fingerprint_frame(frame)))
+        carried.append(segment)
+    return carried
+
+
+def _ingest_files(upload, snapshots: SnapshotStore, snapshot_dir: Path, data_file: str, text_file: str,
+                  append: bool, on_progress: Callable[[str, int], None], source: Optional[str] = None):
+    """Write the upload's (new) rows as a segment of the snapshot being published."""
+    version = int(snapshot_dir.name)
+    segments = []
+    if append:
+        base = snapshots.directory()
+        segments = _carry_segments(base, snapshot_dir, read_manifest(base, data_file, text_file))
+        data_file, text_file = _segment_file(data_file, version), _segment_file(text_file, version)
+    index = FingerprintIndex([np.load(snapshot_dir / s.fingerprints, mmap_mode='r') for s in segments])
+    dedup = Deduplicator(index.lookup if segments else None)
+    start = max((s.end for s in segments), default=0)
+
+    with FrameChunkWriter(snapshot_dir / data_file) as writer, FrameChunkWriter(snapshot_dir / text_file) as text_writer:
+        def on_chunk(chunk: pd.DataFrame):
+            rows, _, _ = dedup.filter(chunk)
+            # Index labels continue after the stored segments
+            rows = rows.set_axis(rows.index + start)
+            rows, text = split_free_text(rows)
+            writer.write(rows)
+            text_writer.write(text)
+
+        rows, dialect = stream_upload(upload, on_chunk=on_chunk, on_progress=on_progress)
+
+    if dedup.inserted:
+        fingerprints = f'fingerprints.{version}.npy'
+        np.save(snapshot_dir / fingerprints, dedup.index_part())
+        segments.append(Segment(version, data_file, text_file, fingerprints, dedup.inserted, start + rows,
+                                sorted(dedup.months), source))
+    else:
+        (snapshot_dir / data_file).unlink()
+        (snapshot_dir / text_file).unlink()
+    write_manifest(snapshot_dir, segments)
+    return rows, dialect, dedup
+
+
+def _ingest_sqlite(upload, db: SqliteStore, append: bool, on_progress: Callable[[str, int], None]):
+    """Write the upload's (new) rows to the database, in one transaction."""
+    if append and db.has_unfingerprinted():
+        raise ValueError("Stored transactions predate fingerprints: upload the full file once before appending")
+    dedup = Deduplicator(db.lookup_fingerprints if append else None)
+    with db.transaction_writer(append=append) as writer:
+        start = writer.next_row_id()
+
+        def on_chunk(chunk: pd.DataFrame):
+            rows, fingerprints, keys = dedup.filter(chunk)
+            writer.write(rows.set_axis(rows.index + start).assign(fingerprint=fingerprints, match_key=keys))
+
+        rows, dialect = stream_upload(upload, on_chunk=on_chunk, on_progress=on_progress)
+    return rows, dialect, dedup, start
+
+
+def run_upload(job_path: Path, upload_path: Path, snapshots_root: Path, data_file: str, text_file: str,
+               sqlite_path: Optional[Path] = None, cache_root: Optional[Path] = None) -> Job:
+    """
+    Body of a job (runs in the pool process): ingest the uploaded file into a
+    new snapshot, recording progress in the job file. Returns the final job.
+    """
+    with open(job_path, 'r') as f:
+        job = json.load(f)
+    job.update(status="running", started=datetime.now().isoformat())
+    write_json(job_path, job)
+    snapshots = SnapshotStore(snapshots_root)
+    append = job.get("mode") == "append"
+    try:
+        with open(upload_path, 'rb') as upload:
+            def on_progress(stage: str, rows: int):
+                job["stage"] = stage
+                job["stages"][stage] = rows
+                job["bytes_read"] = min(upload.tell(), job["bytes_total"])
+                write_json(job_path, job)
+
+            # Chunks go straight to the new snapshot (or the database), which
+            # is published only if all of them made it
+            with snapshots.writer_lock(), snapshots.publish() as snapshot_dir:
+                if sqlite_path is not None:
+                    base = snapshots.current()
+                    rows, dialect, dedup, start = _ingest_sqlite(upload, SqliteStore(sqlite_path), append, on_progress)
+                    if append:
+                        write_json(snapshot_dir / APPEND_FILE, {
+                            "base": base, "start_row_id": start, "months": sorted(dedup.months)})
+                else:
+                    rows, dialect, dedup = _ingest_files(upload, snapshots, snapshot_dir, data_file, text_file, append, on_progress,
+                                              source=job.get("sha256"))
+        result = {
+            "rows": rows,
+            **dedup.counts(),
+            "months": [month_label(m) for m in sorted(dedup.months)],
+            "dialect": dialect._asdict(),
+        }
+        if cache_root is not None and job.get("sha256") and sqlite_path is None and not append and dedup.inserted:
+            segment = read_manifest(snapshot_dir, data_file, text_file)[0]
+            UploadCache(cache_root).put(job["sha256"], snapshot_dir, segment, result)
+        job.update(status="done", bytes_read=job["bytes_total"], result={**result, "snapshot": int(snapshot_dir.name)})
+    except Exception as e:
+        job.update(status="failed", error=str(e))
+    finally:
+        upload_path.unlink(missing_ok=True)
+    job["finished"] = datetime.now().isoformat()
+    write_json(job_path, job)
+    return job
+
+
+class UploadJobs:
+    """Submit uploads to a process pool and read their status files."""
+
+    def __init__(self, jobs_dir: Path, snapshots_root: Path, data_file: str, text_file: str,
+                 sqlite_path: Optional[Path] = None, max_workers: int = 1, cache_root: Optional[Path] = None):
+        self.jobs_dir = Path(jobs_dir)
+        self.uploads_dir = self.jobs_dir / 'uploads'
+        self.snapshots_root = Path(snapshots_root)
+        self.data_file = data_file
+        self.text_file = text_file
+        self.sqlite_path = sqlite_path
+        self.max_workers = max_workers
+        self.cache = UploadCache(cache_root) if cache_root is not None else None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Created on first use; spawn, as forking a threaded server is unsafe
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f'{job_id}.json'
+
+    def upload_path(self, job_id: str) -> Path:
+        """Where the file of a job is stored until the job has read it."""
+        return self.uploads_dir / f'{job_id}.csv'
+
+    def create(self) -> str:
+        """Allocate a job id; the caller stores its file at upload_path(id)."""
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self.prune()
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, mode: str = 'replace', on_done: Optional[Callable[[Job], None]] = None,
+               digest: Optional[str] = None) -> Job:
+        """
+        Queue the job of a stored upload (SHA-256 `digest`); on_done(job) runs
+        in this process when it ends. A full upload found in the cache is
+        done on return.
+        """
+        job_path, upload_path = self._job_path(job_id), self.upload_path(job_id)
+        job = new_job(job_id, upload_path.stat().st_size, mode, digest)
+        entry = self.cache.get(digest) if self.cache is not None and digest and mode == 'replace' else None
+        if entry is not None:
+            job = self._reuse(job, entry)
+            upload_path.unlink(missing_ok=True)
+            write_json(job_path, job)
+            if on_done is not None:
+                on_done(job)
+            return job
+
+        write_json(job_path, job)
+        future = self._pool().submit(run_upload, job_path, upload_path, self.snapshots_root, self.data_file,
+                                     self.text_file, self.sqlite_path, self.cache.root if self.cache else None)
+
+        def finished(future: Future):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The job process died (or the pool was shut down): record it
+                result = {**self.get(job_id), "status": "failed", "error": str(e) or type(e).__name__,
+                          "finished": datetime.now().isoformat()}
+                write_json(job_path, result)
+                upload_path.unlink(missing_ok=True)
+            if on_done is not None:
+                on_done(result)
+
+        future.add_done_callback(finished)
+        return job
+
+    def _reuse(self, job: Job, entry: Dict[str, Any]) -> Job:
+        """Publish the cached dataset of an upload (unless it is the published one)."""
+        segment = self.cache.segment(entry)
+        snapshots = SnapshotStore(self.snapshots_root)
+        with snapshots.writer_lock():
+            if read_manifest(snapshots.directory(), self.data_file, self.text_file) == [segment]:
+                version = snapshots.current()
+            else:
+                with snapshots.publish() as snapshot_dir:
+                    self.cache.link_into(job["sha256"], entry, snapshot_dir)
+                    write_manifest(snapshot_dir, [segment])
+                version = int(snapshot_dir.name)
+        now = datetime.now().isoformat()
+        rows = entry["result"]["rows"]
+        return {
+            **job,
+            "status": "done",
+            "cache_hit": True,
+            "stage": UPLOAD_STAGES[-1],
+            "stages": {stage: 0 if stage == 'sniff' else rows for stage in UPLOAD_STAGES},
+            "bytes_read": job["bytes_total"],
+            "started": now,
+            "finished": now,
+            "result": {**entry["result"], "snapshot": version},
+        }
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Current status of a job, from any worker (None: unknown id)."""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._job_path(job_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def prune(self, max_age: float = JOB_RETENTION_SECONDS):
+        """Remove the status files of jobs older than `max_age` seconds."""
+        if not self.jobs_dir.exists():
+            return
+        cutoff = time.time() - max_age
+        for path in self.jobs_dir.glob('*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -2,11 +2,39 @@
 Validation module for financial calculations.
 
 Validates consistency between Dashboard KPIs and P&L totals,
-and internal calculation logic.
+and internal calculation logic. Rows are looked up and identities checked
+through the P&L graph (pnl_graph.py), the definition the P&L is built from.
 """
 
+import re
 from typing import Dict, List, Tuple
 
+import numpy as np
+
+from pnl_graph import PNL_GRAPH, TOLERANCE
+
+
+def _description_key(description: str) -> str:
+    """'(=) LUCRO BRUTO' -> 'lucro bruto'"""
+    return re.sub(r'^\([-=+]\)\s*', '', description.strip()).lower()
+
+
+def month_values(pnl_data: Dict, month: str):
+    """
+    P&L graph node values (1-element arrays) of one month of a P&L in dict
+    form. Rows are matched by line number, or by description for rows
+    without one; missing rows count as 0.
+    """
+    by_description = {_description_key(row.description): row.line_number for row in PNL_GRAPH.rows}
+    values = {row.line_number: np.zeros(1) for row in PNL_GRAPH.rows}
+    for row in pnl_data['rows']:
+        line_number = row.get('line_number')
+        if line_number is None:
+            line_number = by_description.get(_description_key(row['description']))
+        if line_number is not None:
+            values[line_number] = np.array([row['values'].get(month, 0)], dtype=float)
+    return PNL_GRAPH.row_reader(values)
+
 
 def validate_dashboard_pnl_consistency(
     dashboard_data: Dict,
@@ -30,15 +58,11 @@ def validate_dashboard_pnl_consistency(
     
     latest_month = pnl_data['headers'][-1]
     
-    # Helper function to find P&L value by description
-    def find_value(description: str) -> float:
-        for row in pnl_data['rows']:
-            if description.lower() in row['description'].lower():
-                return row['values'].get(latest_month, 0)
-        return 0
+    values = month_values(pnl_data, latest_month)
+    find_value = lambda key: float(values(key)[0])
     
     # Validate Revenue
-    pnl_revenue = find_value('receita operacional bruta')
+    pnl_revenue = find_value('total_revenue')
     dash_revenue = dashboard_data['kpis']['total_revenue']
     
     if abs(pnl_revenue - dash_revenue) > 0.01:
@@ -56,7 +80,7 @@ def validate_dashboard_pnl_consistency(
         )
     
     # Validate Net Result
-    pnl_net = find_value('resultado líquido')
+    pnl_net = find_value('net_result')
     dash_net = dashboard_data['kpis']['net_result']
     
     if abs(pnl_net - dash_net) > 0.01:
@@ -65,7 +89,7 @@ def validate_dashboard_pnl_consistency(
         )
     
     # Validate Gross Margin calculation
-    gross_profit = find_value('lucro bruto')
+    gross_profit = find_value('gross_profit')
     if dash_revenue > 0:
         expected_margin = (gross_profit / dash_revenue) * 100
         actual_margin = dashboard_data['kpis']['gross_margin']
@@ -82,7 +106,7 @@ def validate_calculation_logic(pnl_data: Dict, month: str) -> Tuple[bool, List[s
     """
     Validate internal calculation consistency for a specific month.
     
-    Checks:
+    Checks (pnl_graph.CHECKS):
     - Gross Profit = Revenue - COGS - Payment Processing
     - EBITDA = Gross Profit - OpEx
     - Net Result = EBITDA (currently)
@@ -95,48 +119,11 @@ def validate_calculation_logic(pnl_data: Dict, month: str) -> Tuple[bool, List[s
         (is_valid, list_of_errors)
     """
     errors = []
-    
-    # Helper function to find P&L value by description
-    def find_value(description: str) -> float:
-        for row in pnl_data['rows']:
-            if description.lower() in row['description'].lower():
-                return row['values'].get(month, 0)
-        return 0
-    
-    # Get values
-    revenue = find_value('receita operacional bruta')
-    payment_proc = abs(find_value('payment processing'))
-    cogs = abs(find_value('cogs'))
-    gross_profit = find_value('lucro bruto')
-    
-    # Validate Gross Profit
-    expected_gp = revenue - payment_proc - cogs
-    if abs(gross_profit - expected_gp) > 0.01:
-        errors.append(
-            f"Gross Profit calculation error: Expected={expected_gp:.2f}, Actual={gross_profit:.2f}"
-        )
-    
-    # Get OpEx components
-    marketing = abs(find_value('marketing'))
-    wages = abs(find_value('salários'))
-    tech = abs(find_value('tech support'))
-    other = abs(find_value('outras despesas'))
-    
-    total_opex = marketing + wages + tech + other
-    
-    ebitda = find_value('ebitda')
-    expected_ebitda = gross_profit - total_opex
-    
-    if abs(ebitda - expected_ebitda) > 0.01:
-        errors.append(
-            f"EBITDA calculation error: Expected={expected_ebitda:.2f}, Actual={ebitda:.2f}"
-        )
-    
-    # Validate Net Result = EBITDA
-    net_result = find_value('resultado líquido')
-    if abs(net_result - ebitda) > 0.01:
-        errors.append(
-            f"Net Result should equal EBITDA: EBITDA={ebitda:.2f}, Net Result={net_result:.2f}"
-        )
+    value = month_values(pnl_data, month)
+
+    for check in PNL_GRAPH.checks:
+        expected, actual = (float(v[0]) for v in PNL_GRAPH.check_values(value, check))
+        if abs(actual - expected) > TOLERANCE:
+            errors.append(check.message.format(name=check.name, expected=expected, actual=actual))
     
     return len(errors) == 0, errors
@@ -0,0 +1,82 @@
+"""
+Background cache warm-up.
+
+After startup, an upload or an edit, the payloads the UI asks for first (the
+default P&L, dashboard, forecast and validation) are computed into the shared
+cache by a background thread, so the first interactive request is served
+from memory instead of paying for them. A request arriving while they are
+computed waits for that result (PnLCache.get_or_compute) rather than
+computing it again.
+
+Warm-ups run one at a time; requests made during a run are folded into a
+single follow-up run on the state current by then.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# name -> compute step, in order; empty when there is nothing to warm
+Steps = Callable[[], Dict[str, Callable[[], Any]]]
+
+
+class CacheWarmer:
+    """Runs the warm-up steps in a daemon thread and records how long they took."""
+
+    def __init__(self, steps: Steps):
+        self.steps = steps
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._reason: Optional[str] = None  # Reason of the pending follow-up run
+        self.runs = 0
+        self.last: Optional[Dict[str, Any]] = None
+
+    def request(self, reason: str):
+        """Warm the caches for the current state, in the background."""
+        with self._lock:
+            self._reason = reason
+            if not self._idle.is_set():
+                return  # Picked up by the running warm-up when it ends
+            self._idle.clear()
+        threading.Thread(target=self._run, name='cache-warmup', daemon=True).start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until no warm-up is running (True) or the timeout passes."""
+        return self._idle.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                reason, self._reason = self._reason, None
+                if reason is None:
+                    self._idle.set()
+                    return
+            self._warm(reason)
+
+    def _warm(self, reason: str):
+        started = datetime.now().isoformat()
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        error = None
+        try:
+            for name, compute in self.steps().items():
+                step_start = time.perf_counter()
+                compute()
+                timings[name] = round((time.perf_counter() - step_start) * 1000, 1)
+        except Exception as e:
+            # The request that needs the failing payload reports the error
+            error = str(e)
+            print(f"⚠️ Cache warm-up ({reason}) failed: {e}")
+        self.runs += 1
+        self.last = {
+            "reason": reason,
+            "started": started,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "steps_ms": timings,
+            "error": error,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": not self._idle.is_set(), "runs": self.runs, "last": self.last}
@@ -7,6 +7,7 @@ import StatCard from './StatCard';
 import AiInsights from './AiInsights';
 import FormulaModal from './FormulaModal';
 import { getFormulaBreakdown } from '../utils/formulaBreakdown';
+import type { DashboardData } from '../utils/formulaBreakdown';
 import { TrendingUp, DollarSign, Activity, PieChart as PieChartIcon, Trash2, Download } from 'lucide-react';
 import { GlassCard } from './ui/GlassCard';
 import { motion } from 'framer-motion';
@@ -15,12 +16,6 @@ interface DashboardProps {
     language: 'pt' | 'en';
 }
 
-interface DashboardData {
-    kpis: any;
-    monthly_data: any[];
-    cost_structure: any;
-}
-
 const translations = {
     pt: {
         loading: 'Carregando dashboard...',
@@ -4,6 +4,21 @@ import { Upload, CheckCircle, AlertCircle, FileSpreadsheet, Loader2, Trash2 } fr
 import { GlassCard } from './ui/GlassCard';
 import { motion, AnimatePresence } from 'framer-motion';
 
+interface UploadJob {
+    id: string;
+    mode: 'replace' | 'append';
+    status: 'queued' | 'running' | 'done' | 'failed';
+    stage: 'sniff' | 'parse' | 'clean' | 'classify' | 'persist' | null;
+    stages: Record<string, number>;
+    bytes_total: number;
+    bytes_read: number;
+    cache_hit: boolean;
+    error: string | null;
+    result: { rows: number; inserted: number; duplicates: number; conflicts: number } | null;
+}
+
+const JOB_POLL_MS = 500;
+
 interface FileUploadProps {
     language: 'pt' | 'en';
 }
@@ -17,7 +32,13 @@ const translations = {
         fileType: 'Arquivos CSV do Conta Azul',
         processBtn: 'Processar Arquivo',
         processing: 'Processando...',
+        stages: { queued: 'Na fila', sniff: 'Detectando formato', parse: 'Lendo', clean: 'Limpando', classify: 'Classificando', persist: 'Salvando' },
+        rows: 'registros',
+        appendMode: 'Adicionar aos dados existentes (ignora transações já importadas)',
+        appended: (inserted: number, duplicates: number, conflicts: number) =>
+            `${inserted} novos registros, ${duplicates} duplicados ignorados, ${conflicts} em conflito.`,
         success: 'Registros processados com sucesso.',
+        cached: 'Arquivo já processado antes: dados restaurados sem reprocessar.',
         error: 'Falha no upload:',
         serverError: 'Falha no upload: Não foi possível conectar ao servidor.',
         unknownError: 'Erro desconhecido',
@@ -32,7 +53,13 @@ const translations = {
         fileType: 'CSV files from Conta Azul',
         processBtn: 'Process File',
         processing: 'Processing...',
+        stages: { queued: 'Queued', sniff: 'Detecting format', parse: 'Reading', clean: 'Cleaning', classify: 'Classifying', persist: 'Saving' },
+        rows: 'records',
+        appendMode: 'Append to existing data (skips transactions already imported)',
+        appended: (inserted: number, duplicates: number, conflicts: number) =>
+            `${inserted} new records, ${duplicates} duplicates skipped, ${conflicts} conflicting.`,
         success: 'Successfully processed records.',
+        cached: 'File already processed: data restored without reprocessing.',
         error: 'Upload failed:',
         serverError: 'Upload failed: Cannot connect to server.',
         unknownError: 'Unknown error occurred',
@@ -45,6 +72,8 @@ export default function FileUpload({ language }: FileUploadProps) {
     const [file, setFile] = useState<File | null>(null);
     const [status, setStatus] = useState<'idle' | 'uploading' | 'success' | 'error'>('idle');
     const [message, setMessage] = useState('');
+    const [job, setJob] = useState<UploadJob | null>(null);
+    const [append, setAppend] = useState(false);
     const t = translations[language];
 
     const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
@@ -63,15 +92,34 @@ export default function FileUpload({ language }: FileUploadProps) {
         formData.append('file', file);
 
         try {
-            const response = await api.post('/upload', formData);
+            // The upload is processed by a background job: poll it until it ends
+            const response = await api.post('/upload', formData, { params: { mode: append ? 'append' : 'replace' } });
+            let current: UploadJob = (await api.get(response.data.status_url)).data;
+            setJob(current);
+            while (current.status === 'queued' || current.status === 'running') {
+                await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+                current = (await api.get(response.data.status_url)).data;
+                setJob(current);
+            }
+            setJob(null);
+            if (current.status === 'failed') {
+                setStatus('error');
+                setMessage(`${t.error} ${current.error || t.unknownError}`);
+                return;
+            }
             setStatus('success');
-            setMessage(`${t.success} (${response.data.rows} records)`);
+            const result = current.result;
+            setMessage(current.mode === 'append' && result
+                ? t.appended(result.inserted, result.duplicates, result.conflicts)
+                : `${current.cache_hit ? t.cached : t.success} (${result?.rows} records)`);
 
             // Refresh the page data after successful upload
             setTimeout(() => {
                 window.location.reload();
             }, 1500);
         } catch (error: unknown) {
+            setJob(null);
+            setStatus('error');
             console.error('Error:', error);
             console.error('Upload error:', error);
 
@@ -157,6 +205,18 @@ export default function FileUpload({ language }: FileUploadProps) {
                     </div>
                 </div>
 
+                {/* Upload Mode */}
+                <label className="flex items-center justify-center gap-3 mb-6 text-sm text-slate-300 cursor-pointer">
+                    <input
+                        type="checkbox"
+                        checked={append}
+                        onChange={(e) => setAppend(e.target.checked)}
+                        disabled={status === 'uploading'}
+                        className="accent-cyan-500"
+                    />
+                    <span>{t.appendMode}</span>
+                </label>
+
                 {/* Upload Button */}
                 <button
                     onClick={handleUpload}
@@ -169,7 +229,11 @@ export default function FileUpload({ language }: FileUploadProps) {
                     {status === 'uploading' ? (
                         <>
                             <Loader2 size={24} className="animate-spin" />
-                            <span>{t.processing}</span>
+                            <span>
+                                {job
+                                    ? `${t.stages[job.stage ?? 'queued']}${job.stage && job.stage !== 'sniff' ? ` (${job.stages[job.stage].toLocaleString()} ${t.rows})` : ''}`
+                                    : t.processing}
+                            </span>
                         </>
                     ) : (
                         <>
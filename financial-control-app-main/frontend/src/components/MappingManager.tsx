@@ -18,6 +18,22 @@ interface MappingItem {
     observacoes?: string;
 }
 
+interface LineMove {
+    from_line: number;
+    to_line: number;
+    rows: number;
+    amount: number;
+}
+
+interface MappingPreview {
+    cells: { line_number: number; description: string; month: string; before: number; after: number; delta: number }[];
+    moves: LineMove[];
+    rows_moved: number;
+    amount_moved: number;
+}
+
+const PREVIEW_DELAY_MS = 400;
+
 const translations = {
     pt: {
         title: 'Gerenciador de Mapeamentos',
@@ -38,7 +54,12 @@ const translations = {
         success: 'Mapeamentos salvos com sucesso!',
         error: 'Erro ao salvar mapeamentos.',
         resetMappings: 'Resetar Padrão',
-        confirmReset: 'Tem certeza que deseja resetar os mapeamentos para o padrão?'
+        confirmReset: 'Tem certeza que deseja resetar os mapeamentos para o padrão?',
+        previewTitle: 'Impacto no DRE (não salvo)',
+        previewNoImpact: 'Nenhuma transação muda de linha.',
+        previewSummary: (rows: number, cells: number) => `${rows} transações mudam de linha, ${cells} células do DRE mudam`,
+        unmapped: 'Não mapeado',
+        line: 'Linha'
     },
     en: {
         title: 'Mapping Manager',
@@ -59,7 +80,12 @@ const translations = {
         success: 'Mappings saved successfully!',
         error: 'Error saving mappings.',
         resetMappings: 'Reset Defaults',
-        confirmReset: 'Are you sure you want to reset mappings to default?'
+        confirmReset: 'Are you sure you want to reset mappings to default?',
+        previewTitle: 'P&L impact (not saved)',
+        previewNoImpact: 'No transaction changes line.',
+        previewSummary: (rows: number, cells: number) => `${rows} transactions change line, ${cells} P&L cells change`,
+        unmapped: 'Unmapped',
+        line: 'Line'
     }
 };
 
@@ -68,12 +94,44 @@ export default function MappingManager({ language }: MappingManagerProps) {
     const [loading, setLoading] = useState(true);
     const [searchTerm, setSearchTerm] = useState('');
     const [hasUnsavedChanges, setHasUnsavedChanges] = useState(false);
+    const [preview, setPreview] = useState<MappingPreview | null>(null);
     const t = translations[language];
 
     useEffect(() => {
         fetchMappings();
     }, []);
 
+    // Dry run of the unsaved mappings, once the user pauses typing
+    useEffect(() => {
+        if (!hasUnsavedChanges) {
+            setPreview(null);
+            return;
+        }
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            try {
+                const response = await api.post('/mappings/preview', { mappings });
+                if (!cancelled) setPreview(response.data);
+            } catch (error) {
+                console.error('Error previewing mappings:', error);
+            }
+        }, PREVIEW_DELAY_MS);
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [mappings, hasUnsavedChanges]);
+
+    const formatCurrency = (val: number) =>
+        val.toLocaleString(language === 'pt' ? 'pt-BR' : 'en-US', {
+            style: 'currency',
+            currency: 'BRL',
+            minimumFractionDigits: 0,
+            maximumFractionDigits: 0
+        });
+
+    const lineLabel = (line: number) => (line === 0 ? t.unmapped : `${t.line} ${line}`);
+
     const fetchMappings = async () => {
         try {
             const response = await api.get('/mappings');
@@ -197,6 +255,28 @@ export default function MappingManager({ language }: MappingManagerProps) {
                 />
             </div>
 
+            {/* Preview of the unsaved changes */}
+            {preview && (
+                <GlassCard className="p-4">
+                    <h3 className="text-sm font-semibold text-cyan-300 mb-2">{t.previewTitle}</h3>
+                    {preview.moves.length === 0 ? (
+                        <p className="text-slate-400 text-sm">{t.previewNoImpact}</p>
+                    ) : (
+                        <>
+                            <p className="text-slate-400 text-sm mb-2">{t.previewSummary(preview.rows_moved, preview.cells.length)}</p>
+                            <ul className="space-y-1 text-sm">
+                                {preview.moves.slice(0, 8).map(move => (
+                                    <li key={`${move.from_line}-${move.to_line}`} className="flex justify-between gap-4 text-slate-300">
+                                        <span>{lineLabel(move.from_line)} → {lineLabel(move.to_line)} ({move.rows})</span>
+                                        <span className="font-mono">{formatCurrency(move.amount)}</span>
+                                    </li>
+                                ))}
+                            </ul>
+                        </>
+                    )}
+                </GlassCard>
+            )}
+
             {/* Table */}
             <GlassCard className="overflow-hidden p-0">
                 <div className="overflow-x-auto">
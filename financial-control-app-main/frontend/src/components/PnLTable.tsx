@@ -11,9 +11,16 @@ interface PnLRow {
     values: { [key: string]: number };
     is_header: boolean;
     is_total: boolean;
+    editable?: boolean;
     indent_level: number;
 }
 
+interface PnLCell {
+    line_number: number;
+    month: string;
+    value: number;
+}
+
 interface Transaction {
     date: string;
     month: string;
@@ -116,23 +123,26 @@ export default function PnLTable({ language }: PnLTableProps) {
         if (!editingCell || !data) return;
 
         try {
-            await api.post('/pnl/override', {
+            const response = await api.post('/pnl/override', {
                 line_number: editingCell.line,
                 month: editingCell.month,
                 value: parseFloat(editValue)
             });
 
-            // Optimistic update
+            // Apply only the cells of the month the override changed
+            const cells: PnLCell[] = response.data.cells || [];
             const newRows = data.rows.map(row => {
-                if (row.line_number === editingCell.line) {
-                    return {
-                        ...row,
-                        values: { ...row.values, [editingCell.month]: parseFloat(editValue) }
-                    };
-                }
-                return row;
+                const changed = cells.filter(cell => cell.line_number === row.line_number);
+                if (changed.length === 0) return row;
+                const values = { ...row.values };
+                changed.forEach(cell => { values[cell.month] = cell.value; });
+                return { ...row, values };
             });
-            setData({ ...data, rows: newRows });
+            const alerts = [
+                ...(data.validation_alerts || []).filter(alert => alert.month !== editingCell.month),
+                ...(response.data.validation_alerts || [])
+            ].sort((a, b) => data.headers.indexOf(a.month) - data.headers.indexOf(b.month));
+            setData({ ...data, rows: newRows, validation_alerts: alerts.length ? alerts : undefined });
             setEditingCell(null);
         } catch (error) {
             console.error('Error saving override:', error);
@@ -385,7 +395,7 @@ export default function PnLTable({ language }: PnLTableProps) {
                                                                         />
                                                                     </div>
                                                                 )}
-                                                                {!isHeader && !isTotal && (
+                                                                {row.editable && (
                                                                     <button
                                                                         onClick={(e) => {
                                                                             e.stopPropagation();